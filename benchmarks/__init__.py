@@ -0,0 +1,11 @@
+"""Performance benchmarks (for asv, see asv.conf.json) of the core functions with seeded synthetic data.
+
+    asv run                           # benchmark current commit
+    asv continuous master HEAD        # compare two commits and report regressions
+    asv run --bench NMS2D --quick     # single benchmark class, each parameter combination only once
+
+Benchmarks are parametrized by the number of objects (up to 10^6, where feasible) and,
+for the OpenMP-parallelized C/C++ code, by the number of threads (requires 'threadpoolctl').
+The import time of the lightweight entry points (e.g. for post-processing workers) is measured
+in a fresh interpreter (see bench_import.py).
+"""
@@ -0,0 +1,92 @@
+"""Rendering of synthetic polygons/polyhedra and computation of star distances from label images."""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from .common import THREADS, ThreadsMixin, throughput
+from .synthetic import star_convex_objects2D, star_convex_objects3D, label_image2D, label_image3D
+
+
+class PolygonsToLabel(object):
+    params = [10**3, 10**4, 10**5, 10**6]
+    param_names = ['n_objects']
+    timeout = 900
+
+    def setup(self, n_objects):
+        self.dist, self.points, self.scores, self.shape = star_convex_objects2D(n_objects)
+
+    def _render(self):
+        from stardist import polygons_to_label
+        return polygons_to_label(self.dist, self.points, self.shape, prob=self.scores)
+
+    def time_polygons_to_label(self, n_objects):
+        self._render()
+
+    def track_throughput(self, n_objects):
+        return throughput(self._render, n_objects)
+    track_throughput.unit = 'objects/s'
+
+    def peakmem_polygons_to_label(self, n_objects):
+        self._render()
+
+
+class PolyhedronToLabel(ThreadsMixin):
+    # the label volume of 10^6 polyhedra would need ~4 GB
+    params = ([10**3, 10**4, 10**5], THREADS)
+    param_names = ['n_objects', 'n_threads']
+    timeout = 900
+
+    def setup(self, n_objects, n_threads):
+        self.dist, self.points, self.scores, self.rays, self.shape = star_convex_objects3D(n_objects)
+        self.limit_threads(n_threads)
+
+    def _render(self):
+        from stardist import polyhedron_to_label
+        return polyhedron_to_label(self.dist, self.points, self.rays, self.shape, prob=self.scores, verbose=False)
+
+    def time_polyhedron_to_label(self, n_objects, n_threads):
+        self._render()
+
+    def track_throughput(self, n_objects, n_threads):
+        return throughput(self._render, n_objects)
+    track_throughput.unit = 'objects/s'
+
+
+class StarDist2D(ThreadsMixin):
+    # star_dist uses uint16 labels, i.e. at most 65535 objects
+    params = ([10**3, 10**4, 6*10**4], THREADS, [32, 96])
+    param_names = ['n_objects', 'n_threads', 'n_rays']
+    timeout = 600
+
+    def setup(self, n_objects, n_threads, n_rays):
+        self.lbl = label_image2D(n_objects)
+        self.limit_threads(n_threads)
+
+    def time_star_dist(self, n_objects, n_threads, n_rays):
+        from stardist import star_dist
+        star_dist(self.lbl, n_rays)
+
+    def track_throughput(self, n_objects, n_threads, n_rays):
+        from stardist import star_dist
+        return throughput(lambda: star_dist(self.lbl, n_rays), self.lbl.size)
+    track_throughput.unit = 'pixels/s'
+
+
+class StarDist3D(ThreadsMixin):
+    params = ([10**3, 10**4], THREADS, [64, 96])
+    param_names = ['n_objects', 'n_threads', 'n_rays']
+    timeout = 900
+
+    def setup(self, n_objects, n_threads, n_rays):
+        from stardist import Rays_GoldenSpiral
+        self.lbl = label_image3D(n_objects)
+        self.rays = Rays_GoldenSpiral(n_rays)
+        self.limit_threads(n_threads)
+
+    def time_star_dist3D(self, n_objects, n_threads, n_rays):
+        from stardist import star_dist3D
+        star_dist3D(self.lbl, self.rays)
+
+    def track_throughput(self, n_objects, n_threads, n_rays):
+        from stardist import star_dist3D
+        return throughput(lambda: star_dist3D(self.lbl, self.rays), self.lbl.size)
+    track_throughput.unit = 'pixels/s'
@@ -0,0 +1,16 @@
+"""Import time of the package and its lightweight entry points (each in a fresh interpreter)."""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+
+def timeraw_import_stardist():
+    return "import stardist"
+
+
+def timeraw_import_stardist_nms():
+    # entry points of post-processing workers, which must not import TensorFlow, numba, etc.
+    return "from stardist import non_maximum_suppression, polygons_to_label"
+
+
+def timeraw_import_stardist_nms3D():
+    return "from stardist import non_maximum_suppression_3d, polyhedron_to_label"
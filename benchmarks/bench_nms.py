@@ -0,0 +1,67 @@
+"""Non-maximum suppression of synthetic (pre-sorted) polygons/polyhedra."""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+
+from .common import THREADS, ThreadsMixin, throughput
+from .synthetic import star_convex_objects2D, star_convex_objects3D
+
+
+def _sorted_by_score(scores, *arrays):
+    # NMS expects candidates sorted by decreasing score
+    ind = np.argsort(scores)[::-1]
+    return (scores[ind],) + tuple(a[ind] for a in arrays)
+
+
+class NMS2D(ThreadsMixin):
+    params = ([10**3, 10**4, 10**5, 10**6], THREADS)
+    param_names = ['n_objects', 'n_threads']
+    timeout = 600
+
+    def setup(self, n_objects, n_threads):
+        dist, points, scores, _ = star_convex_objects2D(n_objects)
+        self.scores, self.dist, self.points = _sorted_by_score(scores, dist, points)
+        self.limit_threads(n_threads)
+
+    def _nms(self):
+        from stardist.nms import non_maximum_suppression_inds
+        return non_maximum_suppression_inds(self.dist, self.points, self.scores, thresh=0.4, verbose=0)
+
+    def time_nms(self, n_objects, n_threads):
+        self._nms()
+
+    def track_throughput(self, n_objects, n_threads):
+        return throughput(self._nms, n_objects)
+    track_throughput.unit = 'objects/s'
+
+    def track_kept(self, n_objects, n_threads):
+        return int(np.count_nonzero(self._nms()))
+    track_kept.unit = 'objects'
+
+
+class NMS3D(ThreadsMixin):
+    # 3D NMS of 10^6 polyhedra takes too long for routine runs
+    params = ([10**3, 10**4, 10**5], THREADS)
+    param_names = ['n_objects', 'n_threads']
+    timeout = 900
+
+    def setup(self, n_objects, n_threads):
+        dist, points, scores, self.rays, _ = star_convex_objects3D(n_objects)
+        self.scores, self.dist, self.points = _sorted_by_score(scores, dist, points)
+        self.limit_threads(n_threads)
+
+    def _nms(self):
+        from stardist.nms import non_maximum_suppression_3d_inds
+        return non_maximum_suppression_3d_inds(self.dist, self.points, self.rays, self.scores, thresh=0.4, verbose=0)
+
+    def time_nms(self, n_objects, n_threads):
+        self._nms()
+
+    def track_throughput(self, n_objects, n_threads):
+        return throughput(self._nms, n_objects)
+    track_throughput.unit = 'objects/s'
+
+    def track_kept(self, n_objects, n_threads):
+        return int(np.count_nonzero(self._nms()))
+    track_kept.unit = 'objects'
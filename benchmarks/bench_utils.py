@@ -0,0 +1,55 @@
+"""Object probabilities (EDT) and matching of synthetic label images."""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+
+from .common import throughput
+from .synthetic import label_image2D
+
+
+class EdtProb(object):
+    params = [10**3, 10**4, 10**5, 10**6]
+    param_names = ['n_objects']
+    timeout = 900
+
+    def setup(self, n_objects):
+        self.lbl = label_image2D(n_objects)
+
+    def time_edt_prob(self, n_objects):
+        from stardist import edt_prob
+        edt_prob(self.lbl)
+
+    def track_throughput(self, n_objects):
+        from stardist import edt_prob
+        return throughput(lambda: edt_prob(self.lbl), n_objects)
+    track_throughput.unit = 'objects/s'
+
+
+class Matching(object):
+    # the (dense) overlap matrix grows quadratically with the number of objects
+    params = [10**3, 3*10**3, 10**4]
+    param_names = ['n_objects']
+    timeout = 900
+
+    def setup(self, n_objects):
+        from stardist.matching import matching
+        # prediction: same objects with different shapes, some missing
+        self.y_true = label_image2D(n_objects, seed=1)
+        self.y_pred = label_image2D(n_objects, seed=1, radius=(3,10))
+        self.y_pred[np.isin(self.y_pred, np.arange(1, n_objects+1, 10))] = 0
+        # compile numba functions
+        matching(self.y_true[:64,:64], self.y_pred[:64,:64])
+
+    def time_matching(self, n_objects):
+        from stardist.matching import matching
+        matching(self.y_true, self.y_pred, thresh=0.5)
+
+    def track_throughput(self, n_objects):
+        from stardist.matching import matching
+        return throughput(lambda: matching(self.y_true, self.y_pred, thresh=0.5), n_objects)
+    track_throughput.unit = 'objects/s'
+
+    def peakmem_matching(self, n_objects):
+        from stardist.matching import matching
+        matching(self.y_true, self.y_pred, thresh=0.5)
@@ -0,0 +1,49 @@
+"""Shared helpers of the benchmarks."""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import os
+import time
+
+
+# thread counts of the OpenMP-parallelized C/C++ code
+THREADS = sorted({1, os.cpu_count() or 1})
+
+
+class ThreadsMixin(object):
+    """Limit the number of OpenMP threads (parameter 'n_threads') during a benchmark.
+
+    Requires 'threadpoolctl', otherwise only the default number of threads
+    (i.e. OMP_NUM_THREADS or the number of CPUs) is benchmarked and the others are skipped.
+    """
+
+    def limit_threads(self, n_threads):
+        self._limits = None
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            if n_threads != int(os.environ.get('OMP_NUM_THREADS', os.cpu_count() or 1)):
+                raise NotImplementedError("'threadpoolctl' is required to control the number of threads")
+            return
+        self._limits = threadpool_limits(limits=n_threads, user_api='openmp')
+
+    def teardown(self, *args):
+        if getattr(self, '_limits', None) is not None:
+            self._limits.restore_original_limits()
+            self._limits = None
+
+
+def _timed(func):
+    t = time.perf_counter()
+    func()
+    return time.perf_counter() - t
+
+
+def throughput(func, n_items, repeat=5, max_time=10.0):
+    """Items per second of ``func``, from the fastest of ``repeat`` calls after a warm-up call.
+
+    Slow functions are called fewer times (but at least once), such that the repeats take about ``max_time`` seconds.
+    """
+    t = _timed(func) # warm-up (e.g. caches, numba compilation)
+    repeat = max(1, min(int(repeat), int(max_time / max(t, 1e-9))))
+    return n_items / min(_timed(func) for _ in range(repeat))
@@ -0,0 +1,241 @@
+"""End-to-end inference benchmark with random-weight models (no download required).
+
+Runs ``predict_instances`` (dense and sparse) and ``predict_instances_big`` for a grid of image sizes,
+``n_tiles``, ``grid`` and ``n_rays``, and records the wall time per stage (see :mod:`stardist.profiling`)
+as well as the peak resident memory of every configuration, which is run in a separate process.
+
+    python -m benchmarks.inference run -o results.json [--dims 2] [--quick]
+    python -m benchmarks.inference compare base.json results.json
+
+Note that this module is not picked up by asv, since it doesn't define any benchmark functions.
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import subprocess
+from pathlib import Path
+
+
+MODES = ('dense', 'sparse', 'big')
+
+GRID_2D = dict(
+    shape   = [(512,512), (1024,1024), (2048,2048)],
+    n_tiles = [None, (2,2)],
+    grid    = [(1,1), (2,2)],
+    n_rays  = [32, 64],
+)
+GRID_3D = dict(
+    shape   = [(48,128,128), (64,256,256)],
+    n_tiles = [None, (1,2,2)],
+    grid    = [(1,1,1), (1,2,2)],
+    n_rays  = [64, 96],
+)
+
+
+def configs(dims=(2,3), modes=MODES, quick=False):
+    """All benchmark configurations (dicts) for the given dimensions and modes."""
+    result = []
+    for n_dim in dims:
+        grid = dict(GRID_2D if n_dim==2 else GRID_3D)
+        if quick:
+            grid = {k: v[:1] if k != 'n_tiles' else v for k,v in grid.items()}
+        for values in itertools.product(*grid.values()):
+            conf = dict(zip(grid.keys(), values))
+            for mode in modes:
+                if mode == 'big' and conf['n_tiles'] is not None:
+                    continue # blocks are predicted without tiling
+                result.append(dict(n_dim=n_dim, mode=mode, **conf))
+    return result
+
+
+def config_key(conf):
+    return "{n_dim}D {mode:6s} shape={shape} n_tiles={n_tiles} grid={grid} n_rays={n_rays}".format(**conf)
+
+
+def _peak_rss_mb():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1e6 if sys.platform == 'darwin' else 1e3)
+
+
+def _synthetic_image(shape, seed):
+    # rendered synthetic objects with smooth intensities and noise
+    import numpy as np
+    from scipy.ndimage import gaussian_filter
+    from .synthetic import star_convex_objects2D, star_convex_objects3D
+    from stardist import polygons_to_label, polyhedron_to_label
+    n_dim, shape = len(shape), tuple(shape)
+    spacing = 12 if n_dim == 2 else 10
+    # one object per grid cell
+    n_objects = int(np.prod([np.ceil(s/spacing) for s in shape]))
+    if n_dim == 2:
+        dist, points, scores, _ = star_convex_objects2D(n_objects, spacing=spacing, seed=seed, shape=shape)
+        lbl = polygons_to_label(dist, points, shape, prob=scores)
+    else:
+        dist, points, scores, rays, _ = star_convex_objects3D(n_objects, spacing=spacing, seed=seed, shape=shape)
+        lbl = polyhedron_to_label(dist, points, rays, shape, prob=scores, verbose=False)
+    rng = np.random.default_rng(seed)
+    img = gaussian_filter((lbl > 0).astype(np.float32), 1) + 0.1*rng.normal(size=lbl.shape).astype(np.float32)
+    assert img.shape == shape
+    return img.astype(np.float32)
+
+
+def run_config(conf, repeat=3, candidate_fraction=0.02, seed=42):
+    """Run a single benchmark configuration (in the current process) and return its results."""
+    import numpy as np
+    import tensorflow as tf
+    from stardist.models import Config2D, Config3D, StarDist2D, StarDist3D
+    from stardist.profiling import profile
+
+    tf.keras.utils.set_random_seed(seed)
+    n_dim, shape = conf['n_dim'], tuple(conf['shape'])
+    n_tiles = None if conf['n_tiles'] is None else tuple(conf['n_tiles'])
+    if n_dim == 2:
+        model = StarDist2D(Config2D(n_rays=conf['n_rays'], grid=tuple(conf['grid']), n_channel_in=1), None, None)
+        axes = 'YX'
+    else:
+        model = StarDist3D(Config3D(n_rays=conf['n_rays'], grid=tuple(conf['grid']), n_channel_in=1), None, None)
+        axes = 'ZYX'
+    img = _synthetic_image(shape, seed)
+
+    # probability threshold such that a realistic fraction of pixels are object candidates
+    # (the untrained network predicts similar probabilities everywhere)
+    crop = tuple(slice(0,min(s,128)) for s in shape)
+    prob = model.predict(img[crop], show_tile_progress=False)[0]
+    prob_thresh = float(np.quantile(prob, 1-candidate_fraction))
+
+    kwargs = dict(prob_thresh=prob_thresh, show_tile_progress=False)
+    if conf['mode'] == 'big':
+        # 2x2 blocks along Y and X (only neighboring blocks may overlap)
+        min_overlap = tuple(s//16 if i >= n_dim-2 else 0 for i,s in enumerate(shape))
+        block_size = tuple(s//2+3*o if i >= n_dim-2 else s for i,(s,o) in enumerate(zip(shape,min_overlap)))
+        def _predict():
+            return model.predict_instances_big(img, axes=axes, block_size=block_size, min_overlap=min_overlap,
+                                               context=min_overlap, show_progress=False, **kwargs)
+    else:
+        def _predict():
+            return model.predict_instances(img, n_tiles=n_tiles, sparse=(conf['mode']=='sparse'), **kwargs)
+
+    _predict() # warm-up (e.g. to build the prediction graph)
+    rss_before = _peak_rss_mb()
+    times = []
+    with profile() as prof:
+        for _ in range(repeat):
+            t = time.perf_counter()
+            labels, polys = _predict()
+            times.append(time.perf_counter() - t)
+    stages = prof.summary()
+    for s in stages.values():
+        # per prediction
+        s['calls'] /= repeat
+        s['total'] /= repeat
+
+    return dict(conf,
+        wall       = float(np.median(times)),
+        wall_all   = times,
+        stages     = stages,
+        n_objects  = int(len(polys['prob'])),
+        prob_thresh = prob_thresh,
+        peak_rss_mb   = _peak_rss_mb(),
+        peak_rss_warmup_mb = rss_before,
+    )
+
+
+def _meta():
+    import numpy as np
+    def _version(name):
+        try:
+            from importlib.metadata import version
+            return version(name)
+        except Exception:
+            return None
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'], capture_output=True, text=True, check=True,
+                                cwd=str(Path(__file__).parent)).stdout.strip()
+    except Exception:
+        commit = None
+    import os
+    return dict(commit=commit, date=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                platform=platform.platform(), cpu_count=os.cpu_count(),
+                numpy=np.__version__, tensorflow=_version('tensorflow') or _version('tensorflow-cpu'),
+                stardist=_version('stardist'))
+
+
+def run(fname, dims=(2,3), modes=MODES, quick=False, repeat=3, candidate_fraction=0.02, timeout=3600):
+    """Run all benchmark configurations (each in a new process) and save results to JSON file ``fname``."""
+    results = dict(meta=_meta(), results=[])
+    for conf in configs(dims, modes, quick):
+        print(config_key(conf), end=' ... ', flush=True)
+        cmd = [sys.executable, '-m', 'benchmarks.inference', '_single', json.dumps(conf),
+               '--repeat', str(repeat), '--candidate-fraction', str(candidate_fraction)]
+        try:
+            proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, cwd=str(Path(__file__).parent.parent))
+            res = json.loads(proc.stdout.strip().splitlines()[-1]) if proc.returncode == 0 else dict(conf, error=proc.stderr.strip().splitlines()[-1:])
+        except subprocess.TimeoutExpired:
+            res = dict(conf, error='timeout')
+        results['results'].append(res)
+        print(('%.3f s, %.0f MB' % (res['wall'], res['peak_rss_mb'])) if 'error' not in res else 'failed: %s' % res['error'], flush=True)
+        # save after every configuration, such that partial results are available
+        with open(str(fname),'w') as f:
+            json.dump(results, f, indent=1)
+    return results
+
+
+def compare(fname_base, fname_new, threshold=0.1):
+    """Print relative change of wall time and peak memory for all configurations in both result files."""
+    def _load(fname):
+        with open(str(fname)) as f:
+            d = json.load(f)
+        return d['meta'], {config_key(r): r for r in d['results'] if 'error' not in r}
+    meta_base, base = _load(fname_base)
+    meta_new,  new  = _load(fname_new)
+    print("base: %s (%s)\nnew:  %s (%s)\n" % (meta_base.get('commit'), meta_base.get('date'), meta_new.get('commit'), meta_new.get('date')))
+    n_regressions = 0
+    for key in (k for k in new if k in base):
+        b, n = base[key], new[key]
+        dt, dm = n['wall']/b['wall']-1, n['peak_rss_mb']/b['peak_rss_mb']-1
+        flag = '  <-- regression' if dt > threshold or dm > threshold else ''
+        n_regressions += int(bool(flag))
+        print("%s  time %8.3f s (%+6.1f%%)  memory %8.0f MB (%+6.1f%%)%s" % (key, n['wall'], 100*dt, n['peak_rss_mb'], 100*dm, flag))
+    return n_regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end inference benchmark with random-weight StarDist models.")
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('run', help="run benchmark and save results as JSON")
+    p.add_argument('-o', '--output', required=True, help="JSON result file")
+    p.add_argument('--dims', type=int, nargs='+', default=[2,3], choices=[2,3])
+    p.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    p.add_argument('--quick', action='store_true', help="only smallest image size, grid and n_rays")
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--candidate-fraction', type=float, default=0.02, help="fraction of pixels that are object candidates")
+    p.add_argument('--timeout', type=float, default=3600, help="timeout (in seconds) for each configuration")
+    p = sub.add_parser('compare', help="compare two result files")
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=0.1, help="relative increase that is reported as regression")
+    p = sub.add_parser('_single') # internal: run single configuration and print results as JSON
+    p.add_argument('config')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--candidate-fraction', type=float, default=0.02)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        run(args.output, dims=args.dims, modes=args.modes, quick=args.quick, repeat=args.repeat,
+            candidate_fraction=args.candidate_fraction, timeout=args.timeout)
+    elif args.command == 'compare':
+        return int(compare(args.base, args.new, threshold=args.threshold) > 0)
+    else:
+        res = run_config(json.loads(args.config), repeat=args.repeat, candidate_fraction=args.candidate_fraction)
+        print(json.dumps(res), flush=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Seeded generator of synthetic star-convex objects (polygons/polyhedra) for the benchmarks."""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+
+from csbdeep.utils import _raise
+
+
+def _centers(n_objects, n_dim, spacing, rng, shape=None):
+    # object centers on a jittered regular grid (roughly cubic image if shape is None)
+    if shape is None:
+        n_cells = (int(np.ceil(n_objects**(1/n_dim))),)*n_dim
+        shape = tuple(n*spacing for n in n_cells)
+    else:
+        len(shape) == n_dim or _raise(ValueError("shape must have %d dimensions" % n_dim))
+        n_cells = tuple(int(np.ceil(s/spacing)) for s in shape)
+        n_objects <= np.prod(n_cells) or _raise(ValueError("at most %d objects fit into shape %s" % (np.prod(n_cells), tuple(shape))))
+    grid = np.stack(np.meshgrid(*(np.arange(n) for n in n_cells), indexing='ij'), axis=-1).reshape(-1,n_dim)
+    grid = grid[rng.permutation(len(grid))[:n_objects]]
+    points = (grid + 0.5) * spacing + rng.uniform(-spacing/4, spacing/4, grid.shape)
+    # centers of the last (partial) cells may lie outside the image
+    points = np.clip(points, 0, np.array(shape)-1)
+    return points.astype(np.float32), tuple(shape)
+
+
+def star_convex_objects2D(n_objects, n_rays=32, radius=(4,9), spacing=12, seed=42, shape=None):
+    """Random star-convex polygons.
+
+    The polygon centers lie on a jittered grid with ``spacing``, which covers the given image ``shape``
+    (with ``ceil(s/spacing)`` cells along each axis) or a roughly square image if ``shape`` is None.
+
+    Returns
+    -------
+    (dist, points, scores, shape)
+        Radial distances ``(n_objects, n_rays)``, centers ``(n_objects, 2)`` and scores ``(n_objects,)``
+        of the polygons, and the shape of an image that contains all of them.
+        Neighboring polygons overlap if their radii exceed ``spacing/2``.
+    """
+    from stardist import ray_angles
+    rng = np.random.default_rng(seed)
+    points, shape = _centers(n_objects, 2, spacing, rng, shape)
+    # smooth random radial profiles, i.e. star-convex by construction
+    phi = ray_angles(n_rays)[np.newaxis]
+    r = rng.uniform(*radius, (n_objects,1))
+    profile = sum(rng.uniform(0,0.15,(n_objects,1)) * np.cos(k*phi + rng.uniform(0,2*np.pi,(n_objects,1))) for k in (2,3))
+    dist = np.maximum(1, r*(1+profile)).astype(np.float32)
+    scores = rng.uniform(0,1,n_objects).astype(np.float32)
+    return dist, points, scores, shape
+
+
+def star_convex_objects3D(n_objects, n_rays=64, radius=(3,7), spacing=10, seed=42, shape=None):
+    """Random star-convex polyhedra.
+
+    Returns
+    -------
+    (dist, points, scores, rays, shape)
+        Like :func:`star_convex_objects2D`, with the rays (:class:`stardist.Rays_GoldenSpiral`) of the polyhedra.
+    """
+    from stardist import Rays_GoldenSpiral
+    rng = np.random.default_rng(seed)
+    points, shape = _centers(n_objects, 3, spacing, rng, shape)
+    rays = Rays_GoldenSpiral(n_rays)
+    # ellipsoid-like random deformations along a random direction
+    direction = rng.normal(size=(n_objects,3))
+    direction /= np.linalg.norm(direction, axis=1, keepdims=True)
+    r = rng.uniform(*radius, (n_objects,1))
+    profile = rng.uniform(0,0.3,(n_objects,1)) * (direction @ rays.vertices.T)**2
+    dist = np.maximum(1, r*(1+profile)).astype(np.float32)
+    scores = rng.uniform(0,1,n_objects).astype(np.float32)
+    return dist, points, scores, rays, shape
+
+
+def label_image2D(n_objects, n_rays=32, seed=42, **kwargs):
+    """Label image of random (rendered) star-convex polygons (see :func:`star_convex_objects2D`)."""
+    from stardist import polygons_to_label
+    dist, points, scores, shape = star_convex_objects2D(n_objects, n_rays=n_rays, seed=seed, **kwargs)
+    return polygons_to_label(dist, points, shape, prob=scores)
+
+
+def label_image3D(n_objects, n_rays=64, seed=42, **kwargs):
+    """Label image of random (rendered) star-convex polyhedra (see :func:`star_convex_objects3D`)."""
+    from stardist import polyhedron_to_label
+    dist, points, scores, rays, shape = star_convex_objects3D(n_objects, n_rays=n_rays, seed=seed, **kwargs)
+    return polyhedron_to_label(dist, points, rays, shape, prob=scores, verbose=False)
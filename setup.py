@@ -91,6 +91,12 @@ setup(
 
     package_data={'stardist': ['kernels/*.cl', 'data/images/*']},
 
+    entry_points={
+        'console_scripts': [
+            'stardist = stardist.cli:main',
+        ],
+    },
+
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Science/Research',
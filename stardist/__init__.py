@@ -1,4 +1,5 @@
 from __future__ import absolute_import, print_function
+import sys
 import warnings
 import pathlib
 def format_Warning(message, category, filename, lineno, line=''):
@@ -8,11 +9,42 @@ warnings.formatwarning = format_Warning
 from .version import __version__
 
 # TODO: which functions to expose here? all?
-from .nms import non_maximum_suppression, non_maximum_suppression_3d, non_maximum_suppression_3d_sparse
-from .utils import edt_prob, fill_label_holes, sample_points, calculate_extents, export_imagej_rois, gputools_available
-from .geometry import star_dist,   polygons_to_label,   relabel_image_stardist, ray_angles, dist_to_coord
-from .geometry import star_dist3D, polyhedron_to_label, relabel_image_stardist3D
-from .plot.plot import random_label_cmap, draw_polygons, _draw_polygons
-from .plot.render import render_label, render_label_pred
-from .rays3d import rays_from_json, Rays_Cartesian, Rays_SubDivide, Rays_Tetra, Rays_Octo, Rays_GoldenSpiral, Rays_Explicit
-from .sample_patches import sample_patches
+# public functions and the submodules that define them, which are only imported on first access
+# (PEP 562), such that e.g. 'from stardist import non_maximum_suppression' doesn't import unrelated heavy dependencies
+_lazy_attributes = {
+    'nms':            ('non_maximum_suppression', 'non_maximum_suppression_3d', 'non_maximum_suppression_3d_sparse'),
+    'utils':          ('edt_prob', 'fill_label_holes', 'sample_points', 'calculate_extents', 'export_imagej_rois', 'gputools_available'),
+    'instances':      ('StarDistInstances',),
+    'geometry':       ('star_dist',   'polygons_to_label',   'relabel_image_stardist', 'ray_angles', 'dist_to_coord',
+                       'star_dist3D', 'polyhedron_to_label', 'relabel_image_stardist3D'),
+    'plot.plot':      ('random_label_cmap', 'draw_polygons', '_draw_polygons'),
+    'plot.render':    ('render_label', 'render_label_pred'),
+    'rays3d':         ('rays_from_json', 'Rays_Cartesian', 'Rays_SubDivide', 'Rays_Tetra', 'Rays_Octo', 'Rays_GoldenSpiral', 'Rays_Explicit'),
+    'sample_patches': ('sample_patches',),
+}
+_lazy_attributes = {name: module for module, names in _lazy_attributes.items() for name in names}
+_lazy_submodules = ('big', 'geometry', 'instances', 'matching', 'models', 'nms', 'plot', 'postprocess', 'rays3d', 'sample_patches', 'utils')
+
+__all__ = list(_lazy_attributes)
+
+
+def __getattr__(name):
+    from importlib import import_module
+    if name in _lazy_attributes:
+        value = getattr(import_module('.' + _lazy_attributes[name], __name__), name)
+    elif name in _lazy_submodules:
+        value = import_module('.' + name, __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes) | set(_lazy_submodules))
+
+
+if sys.version_info < (3,7):
+    # module-level __getattr__ not supported
+    for _name in __all__:
+        __getattr__(_name)
@@ -1,13 +1,23 @@
 import numpy as np
 import warnings
 import math
+import json
+import hashlib
+import inspect
+import threading
+from pathlib import Path
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from skimage.measure import regionprops
 from skimage.draw import polygon
-from csbdeep.utils import _raise, axes_check_and_normalize, axes_dict
+from csbdeep.utils import _raise, axes_check_and_normalize, axes_dict, load_json, save_json, normalize_mi_ma
+from csbdeep.data import PercentileNormalizer
 from itertools import product
 
 from .geometry import polygons_to_label_coord, polyhedron_to_label
+from .instances import StarDistInstances
 
 
 
@@ -380,16 +390,100 @@ class BlockND:
             return labels_filtered
         else:
             # it is assumed that ids in 'labels' map to entries in 'polys'
-            assert isinstance(polys,dict) and any(k in polys for k in COORD_KEYS)
+            assert isinstance(polys,Mapping) and any(k in polys for k in COORD_KEYS)
             filtered_labels = np.unique(labels_filtered)
             filtered_ind = [i-1 for i in filtered_labels if i > 0]
-            polys_out = {k: (v[filtered_ind] if k in OBJECT_KEYS else v) for k,v in polys.items()}
-            for k in COORD_KEYS:
-                if k in polys_out.keys():
-                    polys_out[k] = self.translate_coordinates(polys_out[k], axes=axes)
+            polys_out = self._select_objects(polys, filtered_ind, axes=axes)
 
         return labels_filtered, polys_out#, tuple(problem_ids)
 
+    def filter_objects_bbox(self, polys, axes=None, render=True):
+        """Filter out objects that block is not responsible for (without a label image).
+
+        Like `filter_objects`, but decides responsibility based on the bounding box of each
+        polygon/polyhedron as computed from its coordinates (and not from a rendered label image).
+        If 'render' is True, only the retained objects (and those that might occlude them)
+        are rendered into a label image of the block's write region.
+
+        This function will return a pair (labels, polys) of the label image (or None if 'render' is False)
+        and the dictionary of retained objects. Label ids in 'labels' map to the entries in 'polys'.
+        It will raise a RuntimeError if an object is found in the overlap area
+        of neighboring blocks that violates the assumption to be smaller than 'min_overlap'.
+
+        Notes
+        -----
+        - Object coordinates in 'polys' are assumed to be local to the block read region.
+        - Objects are assumed to be sorted by decreasing probability, which determines the render order.
+        - Does not modify 'polys', but returns a modified copy.
+
+        Example
+        -------
+        >>> _, polys = model.predict_instances(block.read(img), return_labels=False)
+        >>> labels, polys = block.filter_objects_bbox(polys)
+
+        """
+        assert isinstance(polys,Mapping) and any(k in polys for k in COORD_KEYS)
+        ndim = len(self.blocks_for_axes(axes))
+        assert ndim in (2,3)
+        crop = self.slice_crop_context(axes)
+        shape = tuple(s.stop-s.start for s in crop)
+        start = np.array([s.start for s in crop])
+
+        # bounding boxes relative to crop region (clipped to it)
+        if ndim == 2:
+            coord = polys['coord'] - start.reshape(1,2,1)
+            mins, maxs = np.min(coord,axis=-1), np.max(coord,axis=-1)
+        else:
+            rays = polys['rays']
+            coord = polys['dist'][...,np.newaxis] * rays.vertices[np.newaxis] + (polys['points'] - start.reshape(1,3))[:,np.newaxis]
+            mins, maxs = np.min(coord,axis=1), np.max(coord,axis=1)
+        bmins = np.maximum(0,     np.floor(mins)).astype(int)
+        bmaxs = np.minimum(shape, np.floor(maxs)+1).astype(int)
+        visible = np.all(bmins < bmaxs, axis=1)
+
+        responsible = np.zeros(len(visible), bool)
+        for i in np.flatnonzero(visible):
+            slices = tuple(slice(a,b) for a,b in zip(bmins[i],bmaxs[i]))
+            try:
+                responsible[i] = self.is_responsible(slices, axes)
+            except NotFullyVisible as e:
+                shape_object = tuple(s.stop-s.start for s in slices)
+                shape_min_overlap = tuple(t.min_overlap for t in self.blocks_for_axes(axes))
+                raise RuntimeError(f"Found object of shape {shape_object}, which violates the assumption of being smaller than 'min_overlap' {shape_min_overlap}. Increase 'min_overlap' to avoid this problem.")
+        ind = np.flatnonzero(responsible)
+
+        labels = None
+        if render:
+            # also render visible objects that (may) overlap with retained ones, since they can occlude them
+            occluding = np.zeros_like(responsible)
+            for i in np.flatnonzero(visible & ~responsible):
+                occluding[i] = np.any(np.all((bmins[ind] < bmaxs[i]) & (bmins[i] < bmaxs[ind]), axis=1))
+            ind_render = np.concatenate([ind, np.flatnonzero(occluding)])
+            # retained objects have label ids 1..len(ind), occluding objects are removed after rendering
+            ids = np.arange(1, 1+len(ind_render))
+            if ndim == 2:
+                # render in order of increasing probability (i.e. lowest probability first)
+                order = np.argsort(polys['prob'][ind_render], kind='stable')
+                labels = polygons_to_label_coord(coord[ind_render][order], shape=shape, labels=ids[order]-1)
+            else:
+                labels = polyhedron_to_label(polys['dist'][ind_render], polys['points'][ind_render] - start.reshape(1,3), rays=rays,
+                                             prob=polys['prob'][ind_render], labels=ids, shape=shape, verbose=False)
+            labels[labels > len(ind)] = 0
+
+        polys_out = self._select_objects(polys, ind, axes=axes)
+
+        return labels, polys_out
+
+    def _select_objects(self, polys, ind, axes=None):
+        # subset of objects with global coordinates
+        if isinstance(polys, StarDistInstances):
+            return polys[ind].translate([s.start for s in self.slice_read(axes)])
+        polys_out = {k: (v[ind] if k in OBJECT_KEYS else v) for k,v in polys.items()}
+        for k in COORD_KEYS:
+            if k in polys_out.keys():
+                polys_out[k] = self.translate_coordinates(polys_out[k], axes=axes)
+        return polys_out
+
     def translate_coordinates(self, coordinates, axes=None):
         """Translate local block coordinates (of read region) to global ones based on block position"""
         ndim = len(self.blocks_for_axes(axes))
@@ -581,11 +675,654 @@ def predict_big(model, *args, **kwargs):
 
 
 
+class BlockReader:
+    """Read blocks of a (large) image, with prefetching and caching of image chunks.
+
+    Blocks are read (in the given order) by background threads, with at most 'prefetch'
+    blocks being read ahead of the block that is currently processed.
+
+    If the image is stored in chunks (e.g. a zarr array or `TiledTiffArray`), it is read chunk by chunk
+    and the most recently used chunks (up to a total of 'cache_bytes') are kept in memory,
+    since neighboring (i.e. overlapping) blocks typically share some chunks.
+
+    Example
+    -------
+    >>> blocks = BlockND.cover(img.shape, axes, block_size, min_overlap, context)
+    >>> for block, x in BlockReader(img, blocks, axes):
+    >>>     labels, polys = model.predict_instances(x)
+
+    """
+    def __init__(self, img, blocks, axes=None, prefetch=1, cache_bytes=256*2**20):
+        self.img = img
+        self.blocks = tuple(blocks)
+        self.axes = axes
+        self.prefetch = int(prefetch)
+        self.prefetch >= 0 or _raise(ValueError("prefetch must be non-negative"))
+        self.cache_bytes = int(cache_bytes)
+        self.chunks = _chunk_shape(img)
+        self._cache = OrderedDict()
+        self._cache_nbytes = 0
+        self._lock = threading.Lock()
+
+    def _read_chunk(self, index):
+        key = tuple(index)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        if hasattr(self.img, 'read_chunk'):
+            chunk = self.img.read_chunk(key)
+        else:
+            chunk = self._read(tuple(slice(i*c,(i+1)*c) for i,c in zip(key,self.chunks)))
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = chunk
+                self._cache_nbytes += chunk.nbytes
+                # evict least recently used chunks (but keep the current one)
+                while self._cache_nbytes > self.cache_bytes and len(self._cache) > 1:
+                    _, c = self._cache.popitem(last=False)
+                    self._cache_nbytes -= c.nbytes
+        return chunk
+
+    def _read(self, slices):
+        x = self.img[slices]
+        # force actual reading of lazy arrays (e.g. np.memmap), such that prefetching/caching is effective
+        return np.array(x) if isinstance(x, np.memmap) or not isinstance(x, np.ndarray) else x
+
+    def read(self, block):
+        """Read block "read region" from image"""
+        return self.read_region(block.slice_read(self.axes))
+
+    def read_region(self, slices):
+        """Read region given by tuple of (contiguous) slices from image"""
+        if self.chunks is None:
+            return self._read(slices)
+        out = np.empty(tuple(s.stop-s.start for s in slices), self.img.dtype)
+        ranges = [range(s.start//c, (s.stop-1)//c+1) for s,c in zip(slices,self.chunks)]
+        for index in product(*ranges):
+            chunk = self._read_chunk(index)
+            # intersection of chunk and block read region (in global coordinates)
+            isect = [(max(s.start,i*c), min(s.stop,(i+1)*c)) for s,i,c in zip(slices,index,self.chunks)]
+            out[tuple(slice(a-s.start,b-s.start) for (a,b),s in zip(isect,slices))] = \
+                chunk[tuple(slice(a-i*c,b-i*c) for (a,b),i,c in zip(isect,index,self.chunks))]
+        return out
+
+    def __iter__(self):
+        if self.prefetch == 0:
+            for block in self.blocks:
+                yield block, self.read(block)
+            return
+        pool = ThreadPoolExecutor(max_workers=self.prefetch)
+        futures = deque()
+        blocks = iter(self.blocks)
+        try:
+            for block in blocks:
+                futures.append((block, pool.submit(self.read, block)))
+                if len(futures) > self.prefetch:
+                    block, future = futures.popleft()
+                    yield block, future.result()
+            while len(futures) > 0:
+                block, future = futures.popleft()
+                yield block, future.result()
+        finally:
+            for _, future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+
+
+class BlockWriter:
+    """Write (only entries > 0 of) block label images to the block "write regions" of an output array.
+
+    If the output is stored in chunks (e.g. a zarr array), writes are buffered per chunk
+    and every chunk is written to the output only once, i.e. as soon as all blocks that
+    overlap with it have been written (or when calling `close`).
+    Hence, every chunk of the output is read and written at most once, which is much more efficient than
+    `BlockND.write` (read-modify-write of the entire write region) if blocks and chunks are not aligned.
+
+    Methods `write` and `close` return the blocks whose labels are now completely written to the output.
+
+    Example
+    -------
+    >>> writer = BlockWriter(labels_out, blocks)
+    >>> for block in blocks:
+    >>>     ...
+    >>>     writer.write(block, labels)
+    >>> writer.close()
+
+    """
+    def __init__(self, out, blocks, axes=None):
+        self.out = out
+        self.axes = axes
+        self.chunks = _chunk_shape(out)
+        self._buffers = {}
+        if self.chunks is not None:
+            # blocks (yet to be written) per chunk, and chunks (yet to be written to output) per block
+            self._chunk_blocks, self._n_blocks, self._pending = {}, {}, {}
+            for block in blocks:
+                indices = tuple(self._chunk_indices(block.slice_write(self.axes)))
+                for index in indices:
+                    self._chunk_blocks.setdefault(index,[]).append(block)
+                    self._n_blocks[index] = self._n_blocks.get(index,0) + 1
+                self._pending[block] = set(indices)
+            self._written = set()
+
+    def _chunk_indices(self, slices):
+        return product(*(range(s.start//c, (s.stop-1)//c+1) for s,c in zip(slices,self.chunks)))
+
+    def _chunk_slices(self, index):
+        return tuple(slice(i*c, min((i+1)*c,n)) for i,c,n in zip(index,self.chunks,self.out.shape))
+
+    def _flush(self, index):
+        self.out[self._chunk_slices(index)] = self._buffers.pop(index)
+        done = []
+        for block in self._chunk_blocks.pop(index):
+            indices = self._pending[block]
+            indices.discard(index)
+            if len(indices) == 0 and block in self._written:
+                done.append(block)
+        return done
+
+    def write(self, block, labels):
+        slices = block.slice_write(self.axes)
+        labels.shape == tuple(s.stop-s.start for s in slices) or _raise(ValueError("labels must have the shape of the block write region"))
+        if self.chunks is None:
+            if isinstance(self.out, np.ndarray):
+                # write directly into view of output array
+                mask = labels > 0
+                self.out[slices][mask] = labels[mask]
+            else:
+                block.write(self.out, labels, axes=self.axes)
+            return [block]
+
+        (block in self._pending and block not in self._written) or _raise(ValueError(f"unexpected block {block}"))
+        self._written.add(block)
+        done = []
+        for index in self._chunk_indices(slices):
+            chunk_slices = self._chunk_slices(index)
+            if index not in self._buffers:
+                self._buffers[index] = np.asarray(self.out[chunk_slices])
+            # intersection of chunk and block write region (in global coordinates)
+            isect = [(max(s.start,c.start), min(s.stop,c.stop)) for s,c in zip(slices,chunk_slices)]
+            src = labels[tuple(slice(a-s.start,b-s.start) for (a,b),s in zip(isect,slices))]
+            dst = self._buffers[index][tuple(slice(a-c.start,b-c.start) for (a,b),c in zip(isect,chunk_slices))]
+            mask = src > 0
+            dst[mask] = src[mask]
+            self._n_blocks[index] -= 1
+            if self._n_blocks[index] == 0:
+                done.extend(self._flush(index))
+        return done
+
+    def close(self):
+        """Write all remaining buffered chunks to the output"""
+        done = []
+        for index in list(self._buffers.keys()):
+            done.extend(self._flush(index))
+        return done
+
+
+
+class TiledTiffArray:
+    """Array-like access to a tiled TIFF page that only reads (and decodes) the tiles that are needed.
+
+    Provides attributes 'shape', 'dtype', 'ndim', and 'chunks' (tile shape) and
+    supports reading via slicing (e.g. ``x[100:200,300:400]``) and per tile via ``read_chunk``.
+    Can be used as (lazy) input image for `StarDist2D.predict_instances_big`.
+
+    """
+    def __init__(self, fname, key=0):
+        import tifffile
+        self._tif = tifffile.TiffFile(str(fname))
+        self._page = page = self._tif.pages[key]
+        self._lock = threading.Lock()
+        page.is_tiled or _raise(ValueError(f"TIFF page {key} of '{fname}' is not tiled."))
+        (page.tiledepth == 1 and page.planarconfig == 1) or _raise(NotImplementedError("only 2D tiles with interleaved samples are supported."))
+        self.shape = tuple(page.shape)
+        self.dtype = np.dtype(page.dtype)
+        self.ndim = len(self.shape)
+        tiles = (page.tilelength, page.tilewidth)
+        self.chunks = tiles + tuple(self.shape[2:])
+        self._n_tiles = tuple(-(-s//t) for s,t in zip(self.shape,tiles))
+
+    def read_chunk(self, index):
+        ty, tx = index[:2]
+        i = ty * self._n_tiles[1] + tx
+        with self._lock:
+            (data, _), = self._tif.filehandle.read_segments([self._page.dataoffsets[i]], [self._page.databytecounts[i]], [i])
+        tile = self._page.decode(data, i, jpegtables=self._page.jpegtables)[0]
+        tile = tile.reshape(self.chunks)
+        # crop tiles at the image border
+        return tile[tuple(slice(0,min(c,s-j*c)) for s,j,c in zip(self.shape,index,self.chunks))]
+
+    def __getitem__(self, slices):
+        slices = slices if isinstance(slices, tuple) else (slices,)
+        all(isinstance(s,slice) and s.step in (None,1) for s in slices) or _raise(NotImplementedError("only contiguous slicing supported"))
+        slices = tuple(slice(*s.indices(n)[:2]) for s,n in zip(slices+(slice(None),)*(self.ndim-len(slices)),self.shape))
+        return BlockReader(self, (), prefetch=0, cache_bytes=0).read_region(slices)
+
+    def close(self):
+        self._tif.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+class StreamingPercentileNormalizer(PercentileNormalizer):
+    """Percentile-based normalization with percentiles estimated once for an entire (large) image.
+
+    In contrast to `csbdeep.data.PercentileNormalizer`, the percentiles are not computed
+    for each image (or block) that is normalized, but estimated beforehand via `fit` in a single pass over the
+    image, which is read in chunks (of at most 'max_bytes') and hence does not need to fit into memory.
+    Percentiles are computed individually for each channel (if present in `axes`).
+
+    For images of (at most) 16-bit integer type, the percentiles are exact (i.e. the same as for
+    ``np.percentile``) since they are computed from a histogram of all values. For other data types,
+    they are estimated from a uniform random sample (with replacement) of about 'n_samples' values per channel.
+
+    Example
+    -------
+    >>> normalizer = StreamingPercentileNormalizer(1, 99.8)
+    >>> labels, polys = model.predict_instances_big(img, axes='YX', block_size=4096, min_overlap=128, normalizer=normalizer)
+
+    """
+    def __init__(self, pmin=2, pmax=99.8, do_after=True, dtype=np.float32, n_samples=10**7, max_bytes=256*2**20, seed=42, **kwargs):
+        super().__init__(pmin=pmin, pmax=pmax, do_after=do_after, dtype=dtype, **kwargs)
+        self.n_samples = int(n_samples)
+        self.max_bytes = int(max_bytes)
+        self.seed = seed
+        self.mi_channel = self.ma_channel = None
+
+    @property
+    def fitted(self):
+        return self.mi_channel is not None
+
+    def fit(self, img, axes):
+        """Estimate percentiles of (lazily loaded) image 'img' with axes semantics 'axes' in one chunked pass"""
+        axes = axes_check_and_normalize(axes, img.ndim)
+        # move channel axis to the end (if present)
+        n_channel = img.shape[axes.index('C')] if 'C' in axes else 1
+        dtype = np.dtype(img.dtype)
+        exact = (dtype.kind in 'ui' and dtype.itemsize <= 2) or dtype.kind == 'b'
+        n_values = int(np.prod(img.shape)) // n_channel
+
+        if exact:
+            offset = 0 if dtype.kind in 'ub' else -np.iinfo(dtype).min
+            hist = np.zeros((n_channel, 2**(8*dtype.itemsize)), np.int64)
+        else:
+            rng = np.random.RandomState(self.seed)
+            p_sample = min(1, self.n_samples / max(1,n_values))
+            samples = []
+
+        # read chunks along the first non-channel axis
+        ax = 0 if axes[0] != 'C' else 1
+        row_bytes = max(1, dtype.itemsize * n_values * n_channel // img.shape[ax])
+        n = max(1, self.max_bytes // row_bytes)
+        for i in range(0, img.shape[ax], n):
+            x = np.asarray(img[(slice(None),)*ax + (slice(i,i+n),)])
+            x = np.moveaxis(x, axes.index('C'), -1).reshape(-1,n_channel) if 'C' in axes else x.reshape(-1,1)
+            if exact:
+                for c in range(n_channel):
+                    h = np.bincount(x[:,c].astype(np.int64) + offset)
+                    hist[c,:len(h)] += h
+            else:
+                k = rng.binomial(len(x), p_sample) if p_sample < 1 else len(x)
+                # sample with replacement, since choice without replacement would permute all indices of the chunk
+                samples.append(x[rng.randint(0, len(x), k)] if k < len(x) else x)
+
+        if exact:
+            values = np.arange(hist.shape[1]) - offset
+            self.mi_channel = np.array([self._percentile_hist(values, h, self.pmin) for h in hist])
+            self.ma_channel = np.array([self._percentile_hist(values, h, self.pmax) for h in hist])
+        else:
+            samples = np.concatenate(samples, axis=0)
+            self.mi_channel = np.percentile(samples, self.pmin, axis=0)
+            self.ma_channel = np.percentile(samples, self.pmax, axis=0)
+        return self
+
+    @staticmethod
+    def _percentile_hist(values, counts, p):
+        # same as np.percentile (with linear interpolation) of data given by histogram
+        cumsum = np.cumsum(counts)
+        r = p / 100 * (cumsum[-1] - 1)
+        lo, hi = int(np.floor(r)), int(np.ceil(r))
+        v_lo, v_hi = values[np.searchsorted(cumsum, lo, side='right')], values[np.searchsorted(cumsum, hi, side='right')]
+        return v_lo + (r - lo) * (v_hi - v_lo)
+
+    def before(self, x, axes):
+        """Normalization of image (block) 'x' with fixed (global) percentiles.
+
+        See :func:`csbdeep.predict.Normalizer.before` for parameter descriptions.
+        """
+        self.fitted or _raise(RuntimeError("percentiles must be estimated first, see 'fit'"))
+        self.axes_before = axes_check_and_normalize(axes,x.ndim)
+        shape = tuple(len(self.mi_channel) if a == 'C' else 1 for a in self.axes_before)
+        ('C' in self.axes_before) or len(self.mi_channel) == 1 or _raise(ValueError("x must have a channel axis"))
+        self.mi = self.mi_channel.reshape(shape).astype(self.dtype,copy=False)
+        self.ma = self.ma_channel.reshape(shape).astype(self.dtype,copy=False)
+        return normalize_mi_ma(x, self.mi, self.ma, dtype=self.dtype, **self.kwargs)
+
+
+
+class ForegroundPrescan:
+    """Cheap foreground pre-scan to skip prediction for image regions without any plausible objects.
+
+    In `fit`, the image is read in chunks and reduced to a low-resolution image by taking the maximum
+    over non-overlapping windows of size 'downsample' (per spatial axis, and also over all channels).
+    A low-resolution pixel is considered (potential) foreground if its value is above 'threshold'.
+    If 'threshold' is None, it is determined automatically via Otsu's method on the low-resolution image.
+    If 'invert' is True (e.g. for brightfield images), foreground is darker than background instead,
+    i.e. the minimum is taken and pixels not above 'threshold' are considered foreground.
+
+    An image region (e.g. a tile or block) is background (see `is_background`) if it does not
+    overlap with any foreground after being enlarged by 'margin' pixels on all sides.
+    Hence, larger values of 'margin' are more conservative, i.e. fewer regions are skipped.
+
+    The pre-scan can be passed as argument 'prescan' to the prediction methods of a StarDist model
+    (e.g. `predict_instances` and `predict_instances_big`), which will then not run the neural network
+    for background tiles/blocks and instead use empty outputs (i.e. zero object probability) there.
+    If not fitted, it will be fitted on the input image of the first prediction it is used for.
+    The number of skipped regions is counted in attributes 'n_skipped' and 'n_total'.
+
+    Example
+    -------
+    >>> prescan = ForegroundPrescan(threshold=300, margin=64)
+    >>> labels, polys = model.predict_instances(img, n_tiles=(8,8), normalizer=normalizer, prescan=prescan)
+    >>> print(f'skipped {prescan.n_skipped} of {prescan.n_total} tiles')
+
+    """
+    def __init__(self, threshold=None, margin=32, downsample=8, invert=False, max_bytes=256*2**20):
+        self.threshold = threshold
+        self.margin = int(margin)
+        self.downsample = downsample
+        self.invert = bool(invert)
+        self.max_bytes = int(max_bytes)
+        self.margin >= 0 or _raise(ValueError("margin must be non-negative"))
+        self.mask = None
+        self.n_skipped = self.n_total = 0
+
+    @property
+    def fitted(self):
+        return self.mask is not None
+
+    def fit(self, img, axes):
+        """Compute low-resolution foreground mask of (lazily loaded) image 'img' with axes semantics 'axes'"""
+        axes = axes_check_and_normalize(axes, img.ndim)
+        self.axes = axes.replace('C','')
+        self.shape = tuple(s for s,a in zip(img.shape,axes) if a != 'C')
+        self.offset = (0,)*len(self.axes)
+        ds = (self.downsample,)*len(self.axes) if np.isscalar(self.downsample) else tuple(self.downsample)
+        (len(ds) == len(self.axes) and all(int(d)==d and d>=1 for d in ds)) or _raise(ValueError(
+            f"downsample must be a positive integer or a sequence of {len(self.axes)} positive integers"))
+        self.ds = tuple(map(int,ds))
+        reduce = np.min if self.invert else np.max
+
+        def _pool(x):
+            x = reduce(x, axis=axes.index('C')) if 'C' in axes else x
+            # pad to multiple of window size (repeating edge values doesn't change max/min)
+            x = np.pad(x, tuple((0,-s%d) for s,d in zip(x.shape,self.ds)), mode='edge')
+            x = x.reshape(sum(((s//d,d) for s,d in zip(x.shape,self.ds)),()))
+            return reduce(x, axis=tuple(range(1,x.ndim,2)))
+
+        # read chunks along the first spatial axis (of a multiple of the window size)
+        ax = axes.index(self.axes[0])
+        row_bytes = max(1, np.dtype(img.dtype).itemsize * int(np.prod(img.shape)) // img.shape[ax])
+        n = self.ds[0] * max(1, self.max_bytes // (row_bytes*self.ds[0]))
+        lowres = np.concatenate([_pool(np.asarray(img[(slice(None),)*ax + (slice(i,i+n),)]))
+                                 for i in range(0, img.shape[ax], n)], axis=0)
+
+        if self.threshold is None:
+            from skimage.filters import threshold_otsu
+            threshold = threshold_otsu(lowres) if lowres.min() < lowres.max() else lowres.flat[0]
+        else:
+            threshold = self.threshold
+        self.mask = (lowres <= threshold) if self.invert else (lowres > threshold)
+        return self
+
+    def crop(self, slices, axes):
+        """Return pre-scan restricted to image region 'slices' (e.g. of a block) with axes semantics 'axes'"""
+        self.fitted or _raise(RuntimeError("pre-scan must be fitted first, see 'fit'"))
+        axes = axes_check_and_normalize(axes, len(slices))
+        slices = dict(zip(axes,slices))
+        prescan = ForegroundPrescan(self.threshold, self.margin, self.downsample, self.invert, self.max_bytes)
+        prescan.axes, prescan.ds, prescan.mask = self.axes, self.ds, self.mask
+        prescan.offset = tuple(o + slices[a].indices(s)[0] for a,o,s in zip(self.axes,self.offset,self.shape))
+        prescan.shape  = tuple(len(range(*slices[a].indices(s))) for a,s in zip(self.axes,self.shape))
+        return prescan
+
+    def is_background(self, region=None):
+        """Check if image region is background.
+
+        region: dict or None
+            Interval (start,stop) for each spatial axis (missing axes denote their entire extent).
+            If None, check the entire image.
+        """
+        self.fitted or _raise(RuntimeError("pre-scan must be fitted first, see 'fit'"))
+        region = {} if region is None else region
+        window = []
+        for a,o,s,d in zip(self.axes,self.offset,self.shape,self.ds):
+            start, stop = region.get(a,(0,s))
+            start = max(0, o + start - self.margin)
+            stop  = min(self.mask.shape[len(window)]*d, o + min(stop,s) + self.margin)
+            window.append(slice(start//d, -(-stop//d)))
+        self.n_total += 1
+        background = not np.any(self.mask[tuple(window)])
+        self.n_skipped += int(background)
+        return background
+
+
+
+class BlockCheckpoint:
+    """Persist results of completed blocks to resume an interrupted block-wise prediction.
+
+    For each completed block (identified by `BlockND.id`), the filtered polygons/polyhedra
+    are stored in a file 'block_<id>.npz' and marked as done via an empty file 'block_<id>.done'.
+    A fingerprint of the prediction arguments is stored in 'checkpoint.json' and must match
+    when resuming, since results of a different configuration cannot be reused.
+    Objects (e.g. normalizers) are part of the fingerprint via their type and constructor arguments.
+    Objects given as `StarDistInstances` are stored without derived quantities (such as coordinates)
+    and also loaded as such.
+
+    Example
+    -------
+    >>> checkpoint = BlockCheckpoint('checkpoint', fingerprint)
+    >>> labels_out = checkpoint.labels_out(shape, np.int32)
+    >>> for block in blocks:
+    >>>     if checkpoint.is_done(block):
+    >>>         polys = checkpoint.load(block, label_offset)
+    >>>     else:
+    >>>         ... # predict, filter, relabel, and write labels of block
+    >>>         checkpoint.save(block, polys, label_offset, labels_out)
+    >>>     label_offset += len(polys['prob'])
+
+    """
+    def __init__(self, path, fingerprint):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # normalize fingerprint (e.g. tuples to lists) to make it comparable with the stored one
+        fingerprint = json.loads(json.dumps(fingerprint, sort_keys=True, default=self._json_default))
+        fname = self.path / 'checkpoint.json'
+        if fname.exists():
+            fingerprint_stored = load_json(str(fname))
+            fingerprint_stored == fingerprint or _raise(ValueError(
+                f"checkpoint directory '{self.path}' was created with different arguments, cannot resume from it."))
+        else:
+            save_json(fingerprint, str(fname))
+
+    @staticmethod
+    def _json_default(obj):
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            # large arrays (e.g. mask of a fitted pre-scan) only via their hash
+            if obj.size <= 64:
+                return obj.tolist()
+            return dict(shape=obj.shape, dtype=str(obj.dtype), sha1=hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest())
+        if isinstance(obj, np.dtype):
+            return str(obj)
+        if isinstance(obj, type) or (callable(obj) and hasattr(obj, '__qualname__')):
+            return f'{obj.__module__}.{obj.__qualname__}'
+        # objects such as normalizers: type and constructor arguments (e.g. percentiles), such that a different
+        # configuration is detected. These are taken from the attributes of the same name (possibly with leading
+        # underscore), i.e. other attributes (e.g. statistics of the last normalized image, counters) are ignored.
+        try:
+            params = inspect.signature(type(obj)).parameters
+        except (TypeError, ValueError):
+            params = {}
+        attrs = getattr(obj, '__dict__', {})
+        config = {name: attrs.get(name, attrs.get('_'+name)) for name in params if name in attrs or '_'+name in attrs}
+        return dict(type=f'{type(obj).__module__}.{type(obj).__qualname__}', **config)
+
+    def labels_out(self, shape, dtype):
+        """Return label image as memory-mapped file 'labels.npy' in the checkpoint directory"""
+        fname = self.path / 'labels.npy'
+        if fname.exists():
+            labels = np.load(str(fname), mmap_mode='r+')
+            (labels.shape == tuple(shape) and labels.dtype == np.dtype(dtype)) or _raise(ValueError(
+                f"'{fname}' has shape {labels.shape} and type {labels.dtype}, but expected shape {tuple(shape)} and type {np.dtype(dtype)}."))
+            return labels
+        else:
+            return np.lib.format.open_memmap(str(fname), mode='w+', dtype=dtype, shape=tuple(shape))
+
+    def _fname(self, block, ext):
+        return self.path / f'block_{block.id}.{ext}'
+
+    def is_done(self, block):
+        return self._fname(block, 'done').exists()
+
+    def save(self, block, polys, label_offset, labels_out=None, done=True):
+        """Save polygons/polyhedra of completed block (after its labels have been written to 'labels_out')
+
+        If 'done' is False, the block is not yet marked as done (see `set_done`),
+        e.g. because its labels have not been completely written to 'labels_out' yet.
+        """
+        data = {'label_offset': np.int64(label_offset)}
+        if isinstance(polys, StarDistInstances):
+            # only store columns, i.e. no derived quantities such as coordinates
+            data['instances'] = np.array(True)
+            polys = dict(polys.columns, **({} if polys.rays is None else dict(rays=polys.rays)))
+        for k,v in polys.items():
+            if hasattr(v, 'to_json'):
+                data[f'json:{k}'] = np.array(json.dumps(v.to_json()))
+            else:
+                data[k] = np.asarray(v)
+        # write to temporary file first, so that only complete files are used
+        fname = self._fname(block, 'npz')
+        fname_tmp = fname.with_name(fname.stem + '.tmp.npz')
+        np.savez(str(fname_tmp), **data)
+        fname_tmp.replace(fname)
+        if done:
+            self.set_done(block, labels_out)
+
+    def set_done(self, block, labels_out=None):
+        """Mark block as done (after its polygons/polyhedra have been saved and its labels written to 'labels_out')"""
+        if labels_out is not None and hasattr(labels_out, 'flush'):
+            labels_out.flush()
+        self._fname(block, 'done').touch()
+
+    def load(self, block, label_offset):
+        """Load polygons/polyhedra of completed block"""
+        polys = {}
+        with np.load(str(self._fname(block, 'npz'))) as data:
+            int(data['label_offset']) == label_offset or _raise(RuntimeError(
+                f"inconsistent label offset for block {block.id} in checkpoint directory '{self.path}'."))
+            for k in data.files:
+                if k.startswith('json:'):
+                    from .rays3d import rays_from_json
+                    polys[k[len('json:'):]] = rays_from_json(json.loads(str(data[k])))
+                elif k not in ('label_offset', 'instances'):
+                    polys[k] = data[k]
+            if 'instances' in data.files:
+                polys = StarDistInstances(**polys, dist_dtype=polys['dist'].dtype)
+        return polys
+
+
+
 class NotFullyVisible(Exception):
     pass
 
 
 
+def relabel_block(labels, offset=1, dtype=None, chunk_size=2**20, out=None):
+    """Relabel non-zero label ids of 'labels' to {offset, ..., offset + number_of_labels - 1}.
+
+    Memory-efficient alternative to ``relabel_sequential(labels, offset)[0]`` for (large) label offsets.
+    The lookup table only covers the label ids present in 'labels' (independent of 'offset'),
+    and is applied in chunks of at most 'chunk_size' elements to avoid temporary full-size copies.
+    The order of labels is preserved and 0 (background) is never remapped.
+
+    If 'dtype' is None or the same as 'labels.dtype', 'labels' is modified in-place and returned.
+    Otherwise, i.e. only if the data type changes, a new full-size array of type 'dtype' is allocated and returned,
+    unless a preallocated output array 'out' (of the same shape as 'labels') is provided. Then the relabeled ids are
+    written to 'out' chunk by chunk, 'dtype' defaults to 'out.dtype', and 'out' is returned.
+    If 'dtype' is None and the relabeled ids do not fit into the data type of 'labels',
+    a (larger) integer data type will be chosen automatically.
+
+    Example
+    -------
+    >>> labels = block.crop_context(labels)
+    >>> labels, polys = block.filter_objects(labels, polys)
+    >>> labels = relabel_block(labels, label_offset)
+    >>> label_offset += len(polys['prob'])
+
+    """
+    offset = int(offset)
+    offset > 0 or _raise(ValueError("offset must be strictly positive."))
+    np.issubdtype(labels.dtype, np.integer) or _raise(ValueError("labels must be an array of integers."))
+    if out is not None:
+        out.shape == labels.shape or _raise(ValueError("out must have the same shape as labels."))
+        dtype is None or np.dtype(dtype) == out.dtype or _raise(ValueError("dtype must be the same as out.dtype."))
+        dtype = out.dtype
+    if labels.size == 0:
+        return labels if dtype is None else (labels.astype(dtype) if out is None else out)
+    labels.min() >= 0 or _raise(ValueError("labels must be non-negative."))
+
+    # process chunks along the first axis
+    n = max(1, chunk_size // max(1, labels[0].size))
+    chunks = [slice(i,i+n) for i in range(0, len(labels), n)]
+
+    # compact lookup table (size is given by the largest label id of this block)
+    present = np.zeros(int(labels.max())+1, bool)
+    for sl in chunks:
+        c = np.bincount(labels[sl].ravel())
+        present[:len(c)] |= c > 0
+    present[0] = False
+    ids = np.flatnonzero(present)
+    new_max = offset + len(ids) - 1
+
+    if dtype is None:
+        dtype = labels.dtype
+        if len(ids) > 0 and not np.can_cast(np.min_scalar_type(new_max), dtype):
+            dtype = np.promote_types(dtype, np.min_scalar_type(new_max))
+    dtype = np.dtype(dtype)
+    np.issubdtype(dtype, np.integer) or _raise(ValueError("dtype must be an integer type."))
+    len(ids) == 0 or new_max <= np.iinfo(dtype).max or _raise(ValueError(f"label ids up to {new_max} do not fit into {dtype}."))
+
+    lut = np.zeros(len(present), dtype)
+    lut[ids] = np.arange(offset, new_max + 1, dtype=np.uint64 if dtype.kind == 'u' else np.int64)
+
+    if out is None:
+        out = labels if dtype == labels.dtype else np.empty(labels.shape, dtype)
+    for sl in chunks:
+        out[sl] = lut[labels[sl]]
+    return out
+
+
+
+def _chunk_shape(x):
+    """Chunk shape of array-like 'x' (e.g. zarr array), or None if not chunked"""
+    chunks = getattr(x, 'chunks', None)
+    if chunks is None or len(chunks) != x.ndim or not all(isinstance(c,(int,np.integer)) for c in chunks):
+        return None
+    if tuple(chunks) == tuple(x.shape):
+        return None
+    return tuple(int(c) for c in chunks)
+
+
+
 def _grid_divisible(grid, size, name=None, verbose=True):
     if size % grid == 0:
         return size
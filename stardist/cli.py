@@ -0,0 +1,301 @@
+"""Command line interface, e.g. ``stardist predict --help`` or ``stardist serve --help``"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from glob import glob
+from pathlib import Path
+from collections import OrderedDict, Counter, deque, defaultdict
+
+from csbdeep.utils import _raise
+
+
+
+def load_model(spec):
+    """Load model from folder (containing 'config.json') or by name/alias of a registered pretrained model"""
+    from .models import StarDist2D, StarDist3D
+    path = Path(spec)
+    if path.is_dir():
+        (path / 'config.json').exists() or _raise(ValueError(f"model folder '{path}' does not contain 'config.json'"))
+        with open(str(path / 'config.json'), 'r') as f:
+            n_dim = json.load(f).get('n_dim', 2)
+        model_class = {2: StarDist2D, 3: StarDist3D}[n_dim]
+        return model_class(None, name=path.name, basedir=str(path.resolve().parent))
+    from csbdeep.models.pretrained import get_registered_models
+    for model_class in (StarDist2D, StarDist3D):
+        models, aliases = get_registered_models(model_class)
+        if spec in models or any(spec in a for a in aliases.values()):
+            return model_class.from_pretrained(spec)
+    raise ValueError(f"'{spec}' is neither a model folder nor a registered pretrained model")
+
+
+def _parse_shape(s):
+    return tuple(int(v) for v in s.lower().split('x'))
+
+
+
+_image_extensions = ('.tif', '.tiff', '.png', '.jpg', '.jpeg')
+_output_suffixes = dict(labels='.tif', rois='.rois.zip', csv='.csv')
+
+
+def _collect_files(inputs):
+    files = []
+    for s in inputs:
+        if Path(s).is_dir():
+            files.extend(sorted(f for f in Path(s).iterdir() if f.suffix.lower() in _image_extensions))
+        else:
+            matches = sorted(glob(s))
+            len(matches) > 0 or _raise(ValueError(f"'{s}' is neither a folder nor matches any files"))
+            files.extend(Path(f) for f in matches)
+    return list(OrderedDict.fromkeys(files))
+
+
+def _imread(path):
+    t = time.perf_counter()
+    if path.suffix.lower() in ('.tif', '.tiff'):
+        from tifffile import imread
+    else:
+        from skimage.io import imread
+    return imread(str(path)), time.perf_counter() - t
+
+
+def _output_names(files):
+    # path of every file relative to the common folder of all files (without suffix),
+    # such that files with the same name in different folders don't overwrite each other's results
+    if len(files) == 0:
+        return {}
+    parents = [Path(os.path.abspath(str(f.parent))) for f in files]
+    root = Path(os.path.commonpath([str(p) for p in parents]))
+    names = OrderedDict((f, p.relative_to(root) / f.stem) for f,p in zip(files, parents))
+    counts = Counter(names.values())
+    duplicates = sorted(str(f) for f,n in names.items() if counts[n] > 1)
+    len(duplicates) == 0 or _raise(ValueError(f"files with the same name (but different suffix) would have the same output files: {', '.join(duplicates)}"))
+    return names
+
+
+def _output_files(name, outdir, outputs):
+    return {o: Path(outdir) / name.parent / (name.name + _output_suffixes[o]) for o in outputs}
+
+
+def _atomic_write(fname, write):
+    # write to temporary file first, such that incomplete outputs are never mistaken as done
+    tmp = fname.with_name('.part.' + fname.name)
+    write(tmp)
+    os.replace(str(tmp), str(fname))
+
+
+def _postprocess_and_save(files, axes, shape_inst, prob, dist, prob_class, nms_kwargs, model=None):
+    # runs in worker process (or in main process with the loaded model if workers=0)
+    from tifffile import imwrite
+    from .postprocess import _instances_from_prediction_worker
+    instances_from_prediction = _instances_from_prediction_worker if model is None else model._instances_from_prediction
+    t = time.perf_counter()
+    labels, polys = instances_from_prediction(shape_inst, prob, dist, prob_class=prob_class, **nms_kwargs)
+    t_post, t = time.perf_counter() - t, time.perf_counter()
+    if 'labels' in files:
+        _atomic_write(files['labels'], lambda f: imwrite(str(f), labels, metadata=None, photometric='minisblack'))
+    if 'rois' in files:
+        from .utils import export_imagej_rois
+        _atomic_write(files['rois'], lambda f: export_imagej_rois(str(f), polys['coord']))
+    if 'csv' in files:
+        columns = OrderedDict(label = np.arange(1, len(polys['prob'])+1))
+        columns.update((a.lower(), polys['points'][:,i]) for i,a in enumerate(axes.replace('C','')))
+        columns['prob'] = polys['prob']
+        if 'class_id' in polys:
+            columns['class_id'] = polys['class_id']
+        header = ','.join(columns)
+        table = np.stack(list(columns.values()), axis=1) if len(polys['prob']) > 0 else np.zeros((0,len(columns)))
+        _atomic_write(files['csv'], lambda f: np.savetxt(str(f), table, fmt='%g', delimiter=',', header=header, comments=''))
+    return t_post, time.perf_counter() - t
+
+
+def predict_files(model, files, outdir, outputs=('labels','rois','csv'), axes=None, normalize_input=True, pmin=1, pmax=99.8,
+                  n_tiles=None, batch_size=4, readers=2, workers=None, resume=True, prob_thresh=None, nms_thresh=None, verbose=True):
+    """Predict instances for all image files and save the results (label image, ImageJ ROIs, table of objects) to a folder.
+
+    Images are read by a pool of ``readers`` threads and (up to ``batch_size``) consecutive images of the same shape
+    are predicted together by the neural network. Non-maximum suppression, rendering of the label images,
+    and saving of the results is done by a pool of ``workers`` processes (or in the main process if ``workers=0``),
+    by default ``min(4, os.cpu_count())``, since the prediction of the neural network (in the main process) limits the throughput.
+    Memory is bounded by limiting the number of images that are read ahead or are waiting for post-processing.
+    The results of every image are named after its path relative to the common folder of all images
+    (e.g. 'a/img.tif' and 'b/img.tif' are saved to subfolders 'a' and 'b' of ``outdir``).
+    If ``resume`` is True, images with existing results are skipped.
+
+    Returns
+    -------
+    dict
+        Number of processed and skipped images, total time and time spent for every stage (summed over all threads/processes).
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    from multiprocessing import get_context
+    from csbdeep.utils import normalize
+    from .postprocess import postprocess_params, _init_worker
+
+    t_start = time.perf_counter()
+    outputs = tuple(outputs)
+    set(outputs) <= set(_output_suffixes) or _raise(ValueError(f"outputs must be a subset of {tuple(_output_suffixes)}"))
+    if 'rois' in outputs and model.config.n_dim != 2:
+        outputs = tuple(o for o in outputs if o != 'rois')
+        verbose and print("ImageJ ROIs can only be exported for 2D models, skipping them.")
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+    files = list(OrderedDict.fromkeys(Path(f) for f in files))
+    names = _output_names(files)
+    todo = [f for f in files if not (resume and all(o.exists() for o in _output_files(names[f], outdir, outputs).values()))]
+    verbose and len(todo) < len(files) and print(f"skipping {len(files)-len(todo)} image(s) with existing results")
+
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+    times = defaultdict(float)
+    nms_kwargs = dict(prob_thresh=prob_thresh, nms_thresh=nms_thresh)
+    worker_args = ({None: postprocess_params(model)},)
+    # post-processing with the loaded model if done in the main process
+    post_model = model if workers == 0 else None
+
+    with ThreadPoolExecutor(max(1,readers)) as read_pool, \
+         (ThreadPoolExecutor(1) if workers == 0 else ProcessPoolExecutor(workers, mp_context=get_context('spawn'), initializer=_init_worker, initargs=worker_args)) as post_pool:
+        n_pending_max = max(2*batch_size, 2*getattr(post_pool, '_max_workers', 1))
+        reads = deque()
+        posts = deque()
+        files_iter = iter(todo)
+
+        def _finish_post(block):
+            while len(posts) > (0 if block else n_pending_max):
+                t_post, t_write = posts.popleft().result()
+                times['postprocess'] += t_post; times['write'] += t_write
+
+        def _next_image():
+            # keep a bounded number of images being read ahead
+            while len(reads) < n_pending_max:
+                f = next(files_iter, None)
+                if f is None: break
+                reads.append((f, read_pool.submit(_imread, f)))
+            if len(reads) == 0:
+                return None
+            f, future = reads.popleft()
+            img, t_read = future.result()
+            times['read'] += t_read
+            return f, img
+
+        def _predict(batch):
+            t = time.perf_counter()
+            imgs = [img for _,img,_ in batch]
+            _axes = batch[0][2]
+            if n_tiles is None:
+                results = model._predict_batch(imgs, _axes, verbose=0)
+            else:
+                results = [model.predict(img, _axes, n_tiles=n_tiles, show_tile_progress=False, verbose=0) for img in imgs]
+            times['predict'] += time.perf_counter() - t
+            for (f,img,_axes), result in zip(batch, results):
+                prob, dist = result[:2]
+                prob_class = result[2] if model._is_multiclass() else None
+                shape_inst = tuple(s for s,a in zip(img.shape, _axes) if a != 'C')
+                files_out = _output_files(names[f], outdir, outputs)
+                (Path(outdir) / names[f].parent).mkdir(parents=True, exist_ok=True)
+                posts.append(post_pool.submit(_postprocess_and_save, files_out, _axes, shape_inst, prob, dist, prob_class, nms_kwargs, post_model))
+            _finish_post(block=False)
+
+        batch = []
+        for i in range(len(todo)):
+            f, img = _next_image()
+            t = time.perf_counter()
+            _axes = model._normalize_axes(img, axes)
+            if normalize_input:
+                img = normalize(img, pmin, pmax, axis=tuple(d for d,a in enumerate(_axes) if a != 'C'))
+            times['normalize'] += time.perf_counter() - t
+            if len(batch) > 0 and (img.shape, _axes) != (batch[0][1].shape, batch[0][2]):
+                _predict(batch); batch = []
+            batch.append((f, img, _axes))
+            if len(batch) == (1 if n_tiles is not None else batch_size):
+                _predict(batch); batch = []
+            verbose and print(f"[{i+1}/{len(todo)}] {f}", flush=True)
+        if len(batch) > 0:
+            _predict(batch)
+        _finish_post(block=True)
+
+    stats = dict(processed=len(todo), skipped=len(files)-len(todo), time=time.perf_counter()-t_start, stages=dict(times))
+    if verbose:
+        print(f"processed {stats['processed']} image(s) in {stats['time']:.1f} s ({stats['processed']/max(stats['time'],1e-6):.2f} images/s), skipped {stats['skipped']}")
+        if stats['processed'] > 0:
+            print(f"{'stage':<12} {'time [s]':>10} {'images/s':>10}")
+            for stage, t in stats['stages'].items():
+                print(f"{stage:<12} {t:>10.2f} {stats['processed']/max(t,1e-6):>10.2f}")
+    return stats
+
+
+
+def _predict_cli(args):
+    model = load_model(args.model)
+    files = _collect_files(args.input)
+    predict_files(model, files, args.output, outputs=args.outputs.split(','), axes=args.axes, normalize_input=not args.no_normalize,
+                  pmin=args.pmin, pmax=args.pmax, n_tiles=args.n_tiles, batch_size=args.batch_size, readers=args.readers, workers=args.workers,
+                  resume=not args.overwrite, prob_thresh=args.prob_thresh, nms_thresh=args.nms_thresh, verbose=not args.quiet)
+
+
+
+def _serve(args):
+    from .serve import serve
+    models = {}
+    for spec in args.model:
+        model = load_model(spec)
+        name = Path(spec).name if Path(spec).is_dir() else spec
+        if args.warmup:
+            model.warmup(args.warmup, verbose=0)
+        models[name] = model
+    serve(models, host=args.host, port=args.port, unix_socket=args.socket, max_batch_size=args.max_batch_size,
+          max_delay=args.max_delay/1000, workers=args.workers, processes=not args.threads, quiet=args.quiet)
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='stardist', description='StarDist command line interface.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('serve', help='run local inference server that keeps model(s) resident',
+                              description='Run local inference server that keeps model(s) resident (see stardist.serve).')
+    p.add_argument('--model', '-m', action='append', required=True, help='model folder or name/alias of pretrained model (can be repeated)')
+    p.add_argument('--host', default='127.0.0.1', help='host address (default: %(default)s)')
+    p.add_argument('--port', '-p', type=int, default=8765, help='port (default: %(default)s)')
+    p.add_argument('--socket', default=None, help='listen at unix socket path instead of host/port')
+    p.add_argument('--max-batch-size', type=int, default=8, help='max. number of same-shape images predicted together (default: %(default)s)')
+    p.add_argument('--max-delay', type=float, default=10, help='max. time in milliseconds to wait for a batch to fill (default: %(default)s)')
+    p.add_argument('--workers', type=int, default=None, help='number of worker processes for non-maximum suppression and rendering')
+    p.add_argument('--threads', action='store_true', help='use worker threads instead of processes (limited by the GIL)')
+    p.add_argument('--warmup', type=_parse_shape, nargs='*', default=None, metavar='SHAPE',
+                   help='image shape(s) to warm up the model(s) with, e.g. 512x512')
+    p.add_argument('--quiet', '-q', action='store_true', help='do not log requests')
+    p.set_defaults(func=_serve)
+
+    p = subparsers.add_parser('predict', help='predict instances for all images of a folder or glob pattern',
+                              description='Predict instances for all images of a folder or glob pattern and save label images, ImageJ ROIs and tables of objects.')
+    p.add_argument('input', nargs='+', help='image folder(s) or glob pattern(s), e.g. "data/*.tif"')
+    p.add_argument('--model', '-m', required=True, help='model folder or name/alias of pretrained model')
+    p.add_argument('--output', '-o', required=True, help='output folder (results keep the relative paths of the input images)')
+    p.add_argument('--outputs', default='labels,rois,csv', help='comma-separated outputs to save (default: %(default)s)')
+    p.add_argument('--axes', default=None, help='axes of input images (default: axes of model)')
+    p.add_argument('--no-normalize', action='store_true', help='do not percentile-normalize input images')
+    p.add_argument('--pmin', type=float, default=1, help='low percentile for normalization (default: %(default)s)')
+    p.add_argument('--pmax', type=float, default=99.8, help='high percentile for normalization (default: %(default)s)')
+    p.add_argument('--n-tiles', type=_parse_shape, default=None, help='number of tiles per image axis, e.g. 2x2 (disables batching)')
+    p.add_argument('--prob-thresh', type=float, default=None, help='probability threshold (default: from model)')
+    p.add_argument('--nms-thresh', type=float, default=None, help='overlap threshold for non-maximum suppression (default: from model)')
+    p.add_argument('--batch-size', type=int, default=4, help='max. number of same-shape images predicted together (default: %(default)s)')
+    p.add_argument('--readers', type=int, default=2, help='number of threads for reading images (default: %(default)s)')
+    p.add_argument('--workers', type=int, default=None, help='number of processes for post-processing and saving (0: main process, default: min(4, number of CPUs))')
+    p.add_argument('--overwrite', action='store_true', help='do not skip images with existing results')
+    p.add_argument('--quiet', '-q', action='store_true', help='do not show progress and summary')
+    p.set_defaults(func=_predict_cli)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
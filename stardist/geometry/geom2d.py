@@ -2,8 +2,6 @@ from __future__ import print_function, unicode_literals, absolute_import, divisi
 import numpy as np
 import warnings
 
-from skimage.measure import regionprops
-from skimage.draw import polygon
 from csbdeep.utils import _raise
 
 from ..utils import path_absolute, _is_power_of_2, _normalize_grid
@@ -104,6 +102,7 @@ def _dist_to_coord_old(rhos, grid=(1,1)):
 
 
 def _polygons_to_label_old(coord, prob, points, shape=None, thr=-np.inf):
+    from skimage.draw import polygon
     sh = coord.shape[:2] if shape is None else shape
     lbl = np.zeros(sh,np.int32)
     # sort points with increasing probability
@@ -136,18 +135,26 @@ def dist_to_coord(dist, points):
     return coord
 
 
-def polygons_to_label_coord(coord, shape, labels=None):
+def polygons_to_label_coord(coord, shape, labels=None, out=None):
     """renders polygons to image of given shape
 
     coord.shape   = (n_polys, n_rays)
+
+    out: (optional) int32 array of given shape to render into (instead of allocating a new label image)
     """
+    from skimage.draw import polygon
     coord = np.asarray(coord)
     if labels is None: labels = np.arange(len(coord))
 
     _check_label_array(labels, "labels")
     assert coord.ndim==3 and coord.shape[1]==2 and len(coord)==len(labels)
 
-    lbl = np.zeros(shape,np.int32)
+    if out is None:
+        lbl = np.zeros(shape,np.int32)
+    else:
+        (out.shape == tuple(shape) and out.dtype == np.int32) or _raise(ValueError("out must be an int32 array of shape %s" % str(tuple(shape))))
+        lbl = out
+        lbl.fill(0)
 
     for i,c in zip(labels,coord):
         rr,cc = polygon(*c, shape)
@@ -156,13 +163,15 @@ def polygons_to_label_coord(coord, shape, labels=None):
     return lbl
 
 
-def polygons_to_label(dist, points, shape, prob=None, thr=-np.inf):
+def polygons_to_label(dist, points, shape, prob=None, thr=-np.inf, out=None):
     """converts distances and center points to label image
 
     dist.shape   = (n_polys, n_rays)
     points.shape = (n_polys, 2)
 
     label ids will be consecutive and adhere to the order given
+
+    out: (optional) int32 array of given shape to render into (instead of allocating a new label image)
     """
     dist = np.asarray(dist)
     points = np.asarray(points)
@@ -184,7 +193,7 @@ def polygons_to_label(dist, points, shape, prob=None, thr=-np.inf):
 
     coord = dist_to_coord(dist, points)
 
-    return polygons_to_label_coord(coord, shape=shape, labels=ind)
+    return polygons_to_label_coord(coord, shape=shape, labels=ind, out=out)
 
 
 def relabel_image_stardist(lbl, n_rays, **kwargs):
@@ -192,6 +201,7 @@ def relabel_image_stardist(lbl, n_rays, **kwargs):
     _check_label_array(lbl, "lbl")
     if not lbl.ndim==2:
         raise ValueError("lbl image should be 2 dimensional")
+    from skimage.measure import regionprops
     dist = star_dist(lbl, n_rays, **kwargs)
     points = np.array(tuple(np.array(r.centroid).astype(int) for r in regionprops(lbl)))
     dist = dist[tuple(points.T)]
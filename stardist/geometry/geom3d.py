@@ -2,9 +2,7 @@ from __future__ import print_function, unicode_literals, absolute_import, divisi
 import numpy as np
 import os
 
-from skimage.measure import regionprops
 from csbdeep.utils import _raise
-from tqdm import tqdm
 
 from ..utils import path_absolute, _normalize_grid
 from ..matching import _check_label_array
@@ -203,6 +201,7 @@ def relabel_image_stardist3D(lbl, rays, verbose=False, **kwargs):
     if not lbl.ndim==3:
         raise ValueError("lbl image should be 3 dimensional")
 
+    from skimage.measure import regionprops
     dist_all = star_dist3D(lbl, rays, **kwargs)
 
     regs = regionprops(lbl)
@@ -275,6 +274,7 @@ def dist_to_coord3D(dist, points, rays_vertices):
 
 def export_to_obj_file3D(polys, fname=None, scale=1, single_mesh=True, uv_map=False, name="poly"):
     """ exports 3D mesh result to obj file format """
+    from tqdm import tqdm
 
     try:
         dist = polys["dist"]
@@ -0,0 +1,275 @@
+"""Compact columnar container for predicted object instances (polygons/polyhedra).
+
+Example
+-------
+>>> labels, polys = model.predict_instances(img, return_instances=True)
+>>> polys['points'], polys['prob']      # dict-compatible access
+>>> polys.area, polys.bbox              # derived quantities, computed on first access
+>>> large = polys[polys.prob > 0.9]     # subset of objects (slices are views)
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from csbdeep.utils import _raise
+
+from .profiling import stage
+
+
+
+class StarDistInstances(Mapping):
+    """Predicted star-convex polygons (2D) or polyhedra (3D), stored column-wise.
+
+    Only the center points (int32), object probabilities, radial distances (float32 or float16),
+    and optionally the class probabilities and ids are stored. Coordinates, areas/volumes and bounding boxes
+    are computed from them on first access and cached.
+
+    The container behaves like the (read-only) dictionary that is returned by the prediction functions by default,
+    i.e. ``polys['dist']``, ``polys['points']``, ``polys['prob']``, ``polys['coord']`` (2D) or ``polys['rays']`` (3D), etc.
+    The prediction functions (e.g. ``predict_instances``) return this container instead with ``return_instances=True``.
+    Indexing with anything else than a string (slice, integer array, boolean mask) selects a subset of objects,
+    where slices return views of the stored arrays.
+
+    Note that, as for the dictionary, ``len(polys)`` is the number of keys and iterating yields the keys.
+    Use ``polys.n_objects`` for the number of objects.
+
+    Parameters
+    ----------
+    points : :class:`numpy.ndarray`
+        Integer center points of shape ``(n_objects, n_dim)``.
+    prob : :class:`numpy.ndarray`
+        Object probabilities of shape ``(n_objects,)``.
+    dist : :class:`numpy.ndarray`
+        Radial distances of shape ``(n_objects, n_rays)``.
+    class_prob : :class:`numpy.ndarray` or None
+        (Optional) class probabilities of shape ``(n_objects, n_classes+1)``.
+    class_id : :class:`numpy.ndarray` or None
+        (Optional) class ids of shape ``(n_objects,)``. If None, they are derived from ``class_prob`` (if given).
+    rays : :class:`stardist.rays3d.Rays_Base` or None
+        Rays of the polyhedra (required for 3D, must be None for 2D).
+    dist_dtype : numpy dtype
+        Data type to store the distances in, either ``np.float32`` or ``np.float16``.
+    """
+
+    def __init__(self, points, prob, dist, class_prob=None, class_id=None, rays=None, dist_dtype=np.float32):
+        np.dtype(dist_dtype) in (np.float32, np.float16) or _raise(ValueError("dist_dtype must be float32 or float16"))
+        points, prob, dist = np.asarray(points), np.asarray(prob), np.asarray(dist)
+        n_dim = 2 if rays is None else 3
+        n = len(prob)
+        prob.ndim == 1 or _raise(ValueError("prob must be a 1D array"))
+        if points.size == 0 and points.ndim != 2:
+            points = points.reshape(0,n_dim)
+        (points.ndim == 2 and points.shape == (n,n_dim)) or _raise(ValueError(
+            "points must be of shape %s, but is %s%s" % ((n,n_dim), points.shape, '' if n_dim==3 else " (rays are required for 3D)")))
+        if dist.size == 0 and dist.ndim != 2:
+            dist = dist.reshape(0,0 if rays is None else len(rays))
+        (dist.ndim == 2 and len(dist) == n) or _raise(ValueError("dist must be of shape (%d, n_rays), but is %s" % (n, dist.shape)))
+        rays is None or dist.shape[1] == len(rays) or _raise(ValueError("dist must have %d rays, but has %d" % (len(rays), dist.shape[1])))
+
+        if not np.issubdtype(points.dtype, np.integer):
+            np.array_equal(points, np.round(points)) or _raise(ValueError("points must be integer-valued"))
+        self._columns = OrderedDict((
+            ('points', points.astype(np.int32, copy=False)),
+            ('prob',   prob.astype(np.float32, copy=False)),
+            ('dist',   dist.astype(dist_dtype, copy=False)),
+        ))
+        if class_prob is not None:
+            class_prob = np.asarray(class_prob)
+            (class_prob.ndim == 2 and len(class_prob) == n) or _raise(ValueError("class_prob must be of shape (%d, n_classes+1)" % n))
+            if class_id is None:
+                class_id = np.argmax(class_prob, axis=-1)
+            self._columns['class_prob'] = class_prob.astype(np.float32, copy=False)
+        if class_id is not None:
+            class_id = np.asarray(class_id)
+            class_id.shape == (n,) or _raise(ValueError("class_id must be of shape (%d,)" % n))
+            self._columns['class_id'] = class_id.astype(np.int32, copy=False)
+        self.rays = rays
+        self._cache = {}
+
+
+    @classmethod
+    def _from_columns(cls, columns, rays, cache=None):
+        # no validation and conversion (used for subsets)
+        self = cls.__new__(cls)
+        self._columns, self.rays = columns, rays
+        self._cache = {} if cache is None else cache
+        return self
+
+    @classmethod
+    def concatenate(cls, instances):
+        """Concatenate the objects of several containers (e.g. of different image blocks) into a new one."""
+        instances = list(instances)
+        len(instances) > 0 or _raise(ValueError("need at least one StarDistInstances to concatenate"))
+        all(isinstance(p, cls) for p in instances) or _raise(ValueError("can only concatenate StarDistInstances"))
+        first = instances[0]
+        all(p._columns.keys() == first._columns.keys() and p.n_dim == first.n_dim and p.n_rays == first.n_rays for p in instances) or _raise(
+            ValueError("can only concatenate StarDistInstances with the same dimensionality, number of rays and (class) columns"))
+        if len(instances) == 1:
+            return first
+        columns = OrderedDict((k, np.concatenate([p._columns[k] for p in instances])) for k in first._columns)
+        return cls._from_columns(columns, first.rays)
+
+
+    @property
+    def n_dim(self):
+        return 2 if self.rays is None else 3
+
+    @property
+    def n_rays(self):
+        return self._columns['dist'].shape[1]
+
+    @property
+    def n_objects(self):
+        return len(self._columns['prob'])
+
+    @property
+    def columns(self):
+        """Dictionary of the stored arrays (i.e. without derived quantities)."""
+        return OrderedDict(self._columns)
+
+    @property
+    def nbytes(self):
+        """Memory (in bytes) of the stored arrays (i.e. without cached derived quantities)."""
+        return sum(v.nbytes for v in self._columns.values())
+
+    @property
+    def points(self):
+        return self._columns['points']
+
+    @property
+    def prob(self):
+        return self._columns['prob']
+
+    @property
+    def dist(self):
+        return self._columns['dist']
+
+    @property
+    def class_prob(self):
+        return self._columns.get('class_prob')
+
+    @property
+    def class_id(self):
+        return self._columns.get('class_id')
+
+
+    def _cached(self, name, func):
+        if name not in self._cache:
+            self._cache[name] = func()
+        return self._cache[name]
+
+    @property
+    def coord(self):
+        """Vertex coordinates of shape ``(n_objects, 2, n_rays)`` for 2D and ``(n_objects, n_rays, 3)`` for 3D."""
+        def _coord():
+            from .geometry import dist_to_coord, dist_to_coord3D
+            with stage('coords', objects=self.n_objects):
+                dist = self.dist.astype(np.float32, copy=False)
+                if self.n_dim == 2:
+                    return dist_to_coord(dist, self.points)
+                else:
+                    return dist_to_coord3D(dist, self.points, self.rays.vertices)
+        return self._cached('coord', _coord)
+
+    @property
+    def area(self):
+        """Areas of the polygons (2D) or volumes of the polyhedra (3D) of shape ``(n_objects,)``."""
+        def _area(chunk_size=2**14):
+            dist = self.dist.astype(np.float32, copy=False)
+            if self.n_dim == 2:
+                # triangles between neighboring rays (with equidistant angles)
+                return 0.5*np.sin(2*np.pi/self.n_rays) * np.sum(dist*np.roll(dist,-1,axis=1), axis=1)
+            else:
+                # tetrahedra between the center and each face (same as rays.volume, but vectorized)
+                faces = self.rays.faces
+                det = (-1/6*np.linalg.det(self.rays.vertices[faces])).astype(np.float32)
+                area = np.empty(self.n_objects, np.float32)
+                for i in range(0, self.n_objects, chunk_size):
+                    area[i:i+chunk_size] = np.prod(dist[i:i+chunk_size][:,faces], axis=-1) @ det
+                return area
+        return self._cached('area', _area)
+
+    @property
+    def bbox(self):
+        """Integer bounding boxes ``(min_0, .., min_d, max_0, .., max_d)`` of shape ``(n_objects, 2*n_dim)``
+        (maximum is exclusive, as for :func:`skimage.measure.regionprops`)."""
+        def _bbox(chunk_size=2**14):
+            # offsets from the center points (computed in chunks to bound the size of temporary arrays)
+            if self.n_dim == 2:
+                from .geometry import ray_angles
+                phis = ray_angles(self.n_rays)
+                directions = np.stack([np.sin(phis), np.cos(phis)])
+            else:
+                directions = self.rays.vertices.T
+            bbox = np.empty((self.n_objects, 2*self.n_dim), np.int32)
+            for i in range(0, self.n_objects, chunk_size):
+                offsets = self.dist[i:i+chunk_size,np.newaxis].astype(np.float32) * directions[np.newaxis].astype(np.float32)
+                bbox[i:i+chunk_size,:self.n_dim] = np.floor(np.min(offsets, axis=-1))
+                bbox[i:i+chunk_size,self.n_dim:] = np.floor(np.max(offsets, axis=-1)) + 1
+            return bbox + np.tile(self.points, 2)
+        return self._cached('bbox', _bbox)
+
+
+    def translate(self, offset):
+        """Return copy with center points (and hence all coordinates) shifted by ``offset``."""
+        offset = np.asarray(offset, np.int32).reshape(1,self.n_dim)
+        columns = OrderedDict(self._columns)
+        columns['points'] = self.points + offset
+        cache = {k:v for k,v in self._cache.items() if k == 'area'}
+        return self._from_columns(columns, self.rays, cache)
+
+    def to_dict(self):
+        """Return plain dictionary (with all derived entries such as 'coord' computed)."""
+        return dict(self.items())
+
+    def _keys(self):
+        if self.n_dim == 2:
+            keys = ['coord', 'dist', 'points', 'prob']
+        else:
+            keys = ['dist', 'points', 'prob', 'rays', 'rays_vertices', 'rays_faces']
+        return keys + [k for k in ('class_prob', 'class_id') if k in self._columns]
+
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key in self._keys() or _raise(KeyError(key))
+            if key == 'coord':
+                return self.coord
+            elif key == 'rays':
+                return self.rays
+            elif key == 'rays_vertices':
+                return self.rays.vertices
+            elif key == 'rays_faces':
+                return self.rays.faces
+            return self._columns[key]
+        # subset of objects
+        if isinstance(key, (int, np.integer)):
+            key = int(key) + (self.n_objects if key < 0 else 0)
+            0 <= key < self.n_objects or _raise(IndexError("index %d out of range for %d objects" % (key, self.n_objects)))
+            key = slice(key, key+1)
+        elif not isinstance(key, slice):
+            key = np.asarray(key)
+            if key.dtype != bool:
+                key = key.astype(np.intp, copy=False)
+        columns = OrderedDict((k, v[key]) for k,v in self._columns.items())
+        cache = {k: v[key] for k,v in self._cache.items()}
+        return self._from_columns(columns, self.rays, cache)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        # number of keys (as for a dictionary), see 'n_objects' for the number of objects
+        return len(self._keys())
+
+    def __contains__(self, key):
+        return key in self._keys()
+
+    def __repr__(self):
+        return "%s(n_objects=%d, n_dim=%d, n_rays=%d, dist_dtype=%s%s)" % (
+            type(self).__name__, self.n_objects, self.n_dim, self.n_rays, self.dist.dtype,
+            ', n_classes=%d' % (self.class_prob.shape[1]-1) if self.class_prob is not None else '')
+
@@ -1,13 +1,26 @@
 import numpy as np
 
-from numba import jit
-from tqdm import tqdm
-from scipy.optimize import linear_sum_assignment
+from functools import wraps
 from collections import namedtuple
 from csbdeep.utils import _raise
 
 matching_criteria = dict()
 
+
+def _lazy_jit(**jit_kwargs):
+    """Like numba.jit, but numba is only imported (and the function compiled) when first called"""
+    def decorator(func):
+        compiled = []
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if len(compiled) == 0:
+                from numba import jit
+                compiled.append(jit(**jit_kwargs)(func))
+            return compiled[0](*args, **kwargs)
+        return wrapper
+    return decorator
+
+
 def label_are_sequential(y):
     """ returns true if y has only sequential labels from 1... """
     labels = np.unique(y)
@@ -40,7 +53,7 @@ def label_overlap(x, y, check=True):
         x.shape == y.shape or _raise(ValueError("x and y must have the same shape"))
     return _label_overlap(x, y)
 
-@jit(nopython=True)
+@_lazy_jit(nopython=True, nogil=True)
 def _label_overlap(x, y):
     x = x.ravel()
     y = y.ravel()
@@ -151,6 +164,16 @@ def matching(y_true, y_pred, thresh=0.5, criterion='iou', report_matches=False):
     y_pred, _, map_rev_pred = relabel_sequential(y_pred)
 
     overlap = label_overlap(y_true, y_pred, check=False)
+    return _matching_from_overlap(overlap, thresh, criterion, report_matches, map_rev_true, map_rev_pred)
+
+
+
+def _matching_from_overlap(overlap, thresh, criterion='iou', report_matches=False, map_rev_true=None, map_rev_pred=None):
+    """matching metrics from the label overlap matrix of sequentially labeled y_true and y_pred, see `stardist.matching.matching`
+
+    overlap.shape = (1+n_true, 1+n_pred), where row/column 0 corresponds to the background
+    """
+    from scipy.optimize import linear_sum_assignment
     scores = matching_criteria[criterion](overlap)
     assert 0 <= np.min(scores) <= np.max(scores) <= 1
 
@@ -201,10 +224,12 @@ def matching(y_true, y_pred, thresh=0.5, criterion='iou', report_matches=False):
             panoptic_quality   = panoptic_quality,
         )
         if bool(report_matches):
+            _map_rev_true = np.arange(1+n_true) if map_rev_true is None else map_rev_true
+            _map_rev_pred = np.arange(1+n_pred) if map_rev_pred is None else map_rev_pred
             if not_trivial:
                 stats_dict.update (
                     # int() to be json serializable
-                    matched_pairs  = tuple((int(map_rev_true[i]),int(map_rev_pred[j])) for i,j in zip(1+true_ind,1+pred_ind)),
+                    matched_pairs  = tuple((int(_map_rev_true[i]),int(_map_rev_pred[j])) for i,j in zip(1+true_ind,1+pred_ind)),
                     matched_scores = tuple(scores[true_ind,pred_ind]),
                     matched_tps    = tuple(map(int,np.flatnonzero(match_ok))),
                 )
@@ -231,8 +256,7 @@ def matching_dataset(y_true, y_pred, thresh=0.5, criterion='iou', by_image=False
 
 
 def matching_dataset_lazy(y_gen, thresh=0.5, criterion='iou', by_image=False, show_progress=True, parallel=False):
-
-    expected_keys = set(('fp', 'tp', 'fn', 'precision', 'recall', 'accuracy', 'f1', 'criterion', 'thresh', 'n_true', 'n_pred', 'mean_true_score', 'mean_matched_score', 'panoptic_quality'))
+    from tqdm import tqdm
 
     single_thresh = False
     if np.isscalar(thresh):
@@ -256,6 +280,15 @@ def matching_dataset_lazy(y_gen, thresh=0.5, criterion='iou', by_image=False, sh
             for y_t,y_p in tqdm(y_gen,**tqdm_kwargs)
         )
 
+    accumulate = _accumulate_matching(stats_all, thresh=thresh, criterion=criterion, by_image=by_image)
+    return accumulate[0] if single_thresh else accumulate
+
+
+
+def _accumulate_matching(stats_all, thresh, criterion='iou', by_image=False):
+    """accumulate per-image matching stats (each a tuple with one entry per value of thresh) over a dataset"""
+    expected_keys = set(('fp', 'tp', 'fn', 'precision', 'recall', 'accuracy', 'f1', 'criterion', 'thresh', 'n_true', 'n_pred', 'mean_true_score', 'mean_matched_score', 'panoptic_quality'))
+
     # accumulate results over all images for each threshold separately
     n_images, n_threshs = len(stats_all), len(thresh)
     accumulate = [{} for _ in range(n_threshs)]
@@ -299,8 +332,7 @@ def matching_dataset_lazy(y_gen, thresh=0.5, criterion='iou', by_image=False, sh
                 panoptic_quality   = panoptic_quality,
             )
 
-    accumulate = tuple(namedtuple('DatasetMatching',acc.keys())(*acc.values()) for acc in accumulate)
-    return accumulate[0] if single_thresh else accumulate
+    return tuple(namedtuple('DatasetMatching',acc.keys())(*acc.values()) for acc in accumulate)
 
 
 
@@ -2,6 +2,8 @@ from __future__ import absolute_import, print_function
 
 from .model2d import Config2D, StarDist2D, StarDistData2D
 from .model3d import Config3D, StarDist3D, StarDistData3D
+from .base import PredictionWorkspace
+from .backend import InferenceBackend, register_backend
 
 from csbdeep.utils import backend_channels_last
 from csbdeep.utils.tf import keras_import
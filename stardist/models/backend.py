@@ -0,0 +1,185 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+import tempfile
+import zipfile
+from pathlib import Path
+
+from csbdeep.utils import _raise
+
+
+
+_backends = {}
+
+
+def register_backend(name, backend_class):
+    """Register inference backend class under ``name`` (to be used with ``StarDistBase.set_backend``)."""
+    issubclass(backend_class, InferenceBackend) or _raise(ValueError("backend class must be a subclass of InferenceBackend"))
+    _backends[name] = backend_class
+    return backend_class
+
+
+def get_backend(name):
+    """Return inference backend class that is registered under ``name``."""
+    name in _backends or _raise(ValueError("unknown backend '%s', must be one of %s" % (name, sorted(_backends))))
+    return _backends[name]
+
+
+
+class InferenceBackend(object):
+    """Neural network inference used by ``predict``, ``predict_sparse`` and ``predict_instances_big``.
+
+    A backend maps a batch of (normalized and padded) network inputs with axes ``'S'+config.axes``,
+    as described by ``input_spec``, to the list of network outputs ``[prob, dist(, prob_class)]``
+    at the resolution of ``config.grid``, as described by ``output_spec``.
+    Tiling, post-processing and non-maximum suppression are independent of the backend.
+
+    Parameters
+    ----------
+    model : :class:`stardist.models.StarDistBase`
+        Model whose config defines the input and output specification.
+        Backends that load an exported model should derive the specification from it instead
+        (see ``_spec_from_artifact``), so that ``StarDistBase.set_backend`` can reject mismatching exports.
+    """
+
+    def __init__(self, model):
+        config = model.config
+        self.input_spec  = dict(shape=(None,)*(1+config.n_dim)+(config.n_channel_in,), dtype=np.dtype(np.float32))
+        self.output_spec = (('prob',1), ('dist',config.n_rays)) + ((('prob_class',config.n_classes+1),) if model._is_multiclass() else ())
+        self.grid = tuple(config.grid)
+
+    def predict(self, x, **kwargs):
+        """Return list of network outputs ``[prob, dist(, prob_class)]`` for batch of inputs ``x``."""
+        raise NotImplementedError()
+
+    def _spec_from_artifact(self, input_shape, input_dtype, output_channels, single_output):
+        # specification of an exported model, given its input shape/dtype and number of channels of its outputs
+        input_shape = tuple(d if isinstance(d,(int,np.integer)) else None for d in input_shape)
+        # batch size is not part of the specification (e.g. fixed to 1 by export_TF)
+        self.input_spec = dict(shape=(None,)+input_shape[1:], dtype=np.dtype(input_dtype))
+        output_channels = [int(c) if c is not None else None for c in output_channels]
+        if single_output and len(output_channels) == 1 and output_channels[0] is not None:
+            # concatenated outputs (cf. export_TF) of a model without multi-class output
+            output_channels = [1, output_channels[0]-1]
+        names = ('prob', 'dist', 'prob_class')
+        self.output_spec = tuple((names[i] if i < len(names) else 'output_%d' % i, c) for i,c in enumerate(output_channels))
+
+    def _standard_outputs(self, ys, single_output, upsample_grid):
+        # convert outputs of an exported model (cf. StarDistBase.export_TF) to those of the Keras model
+        if single_output:
+            len(ys) == 1 or _raise(ValueError("expected single output, but got %d" % len(ys)))
+            splits = np.cumsum([n for _,n in self.output_spec])[:-1]
+            ys = np.split(ys[0], splits, axis=-1)
+        len(ys) == len(self.output_spec) or _raise(ValueError("expected %d outputs, but got %d" % (len(self.output_spec), len(ys))))
+        if upsample_grid and any(g>1 for g in self.grid):
+            ss = (slice(None),) + tuple(slice(None,None,g) for g in self.grid)
+            ys = [y[ss] for y in ys]
+        all(y.shape[-1] == n for y,(_,n) in zip(ys, self.output_spec)) or _raise(ValueError(
+            "output channels %s don't match %s" % (tuple(y.shape[-1] for y in ys), self.output_spec)))
+        return list(ys)
+
+
+
+class KerasBackend(InferenceBackend):
+    """Default backend that uses the Keras model (``model.keras_model``)."""
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.model = model
+
+    def predict(self, x, **predict_kwargs):
+        """``predict_kwargs`` are passed to the ``predict`` function of the Keras model."""
+        ys = self.model.keras_model.predict(x, **predict_kwargs)
+        return list(ys) if isinstance(ys, (list,tuple)) else [ys]
+
+
+
+class SavedModelBackend(InferenceBackend):
+    """Backend that uses a TensorFlow SavedModel as exported by ``model.export_TF``.
+
+    Parameters
+    ----------
+    model : :class:`stardist.models.StarDistBase`
+        Model that was exported.
+    fname : str or None
+        Path of the exported zip file or SavedModel folder.
+        If None, the default path "<modeldir>/TF_SavedModel.zip" is used.
+    single_output, upsample_grid : bool
+        Arguments that were used for ``export_TF``.
+    """
+
+    def __init__(self, model, fname=None, single_output=True, upsample_grid=True):
+        super().__init__(model)
+        import tensorflow as tf
+        not model._is_multiclass() or _raise(ValueError("models with multi-class output can't be used via export_TF"))
+        if fname is None:
+            model.basedir is not None or _raise(ValueError("Need explicit 'fname', since model directory not available (basedir=None)."))
+            fname = model.logdir / 'TF_SavedModel.zip'
+        fname = Path(fname)
+        if fname.is_file():
+            self._tmpdir = tempfile.TemporaryDirectory()
+            with zipfile.ZipFile(str(fname)) as f:
+                f.extractall(self._tmpdir.name)
+            fname = Path(self._tmpdir.name)
+        self._model = tf.saved_model.load(str(fname))
+        self._predict = self._model.signatures['serving_default']
+        self._tf = tf
+        self.single_output, self.upsample_grid = single_output, upsample_grid
+        input_spec = self._predict.structured_input_signature[1]['input']
+        # outputs are ordered by number of channels (cf. predict)
+        output_channels = sorted(y.shape[-1] for y in self._predict.structured_outputs.values())
+        self._spec_from_artifact(input_spec.shape.as_list(), input_spec.dtype.as_numpy_dtype, output_channels, single_output)
+
+    def predict(self, x, **kwargs):
+        ys = self._predict(input=self._tf.constant(x, self._tf.float32))
+        if self.single_output:
+            ys = [ys['output']]
+        else:
+            # outputs are named after their (possibly generic) layers -> order by number of channels
+            ys = sorted(ys.values(), key=lambda y: y.shape[-1])
+        return self._standard_outputs([y.numpy() for y in ys], self.single_output, self.upsample_grid)
+
+
+
+class ONNXBackend(InferenceBackend):
+    """Backend that uses an ONNX Runtime session, e.g. for a model converted with ``tf2onnx``.
+
+    Parameters
+    ----------
+    model : :class:`stardist.models.StarDistBase`
+        Model that was converted.
+    fname : str
+        Path of the ONNX model file.
+    providers : list of str
+        Execution providers of the ONNX Runtime session.
+    single_output, upsample_grid : bool
+        Whether the converted model has the outputs of ``export_TF`` with these arguments
+        (the default refers to a conversion of ``model.keras_model``).
+    sess_options : :class:`onnxruntime.SessionOptions` or None
+        (Optional) options of the ONNX Runtime session, e.g. to set the number of threads.
+    """
+
+    def __init__(self, model, fname, providers=('CPUExecutionProvider',), single_output=False, upsample_grid=False, sess_options=None):
+        super().__init__(model)
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("ONNX backend requires the 'onnxruntime' package.")
+        self._session = onnxruntime.InferenceSession(str(fname), sess_options=sess_options, providers=list(providers))
+        onnx_input = self._session.get_inputs()[0]
+        self._input_name = onnx_input.name
+        self.single_output, self.upsample_grid = single_output, upsample_grid
+        onnx_dtypes = {'tensor(float)': np.float32, 'tensor(float16)': np.float16, 'tensor(double)': np.float64}
+        onnx_input.type in onnx_dtypes or _raise(ValueError("unsupported input type '%s' of ONNX model" % onnx_input.type))
+        self._spec_from_artifact(onnx_input.shape, onnx_dtypes[onnx_input.type],
+                                 [o.shape[-1] if isinstance(o.shape[-1],int) else None for o in self._session.get_outputs()], single_output)
+
+    def predict(self, x, **kwargs):
+        ys = self._session.run(None, {self._input_name: np.asarray(x, np.float32)})
+        return self._standard_outputs(ys, self.single_output, self.upsample_grid)
+
+
+
+register_backend('keras',      KerasBackend)
+register_backend('savedmodel', SavedModelBackend)
+register_backend('onnx',       ONNXBackend)
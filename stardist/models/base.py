@@ -4,10 +4,14 @@ import numpy as np
 import sys
 import warnings
 import math
+import time
+import hashlib
 from tqdm import tqdm
 from collections import namedtuple
 from pathlib import Path
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 from csbdeep.models.base_model import BaseModel
 from csbdeep.utils.tf import export_SavedModel, keras_import, IS_TF_1, CARETensorBoard
@@ -23,9 +27,11 @@ from csbdeep.internals.predict import tile_iterator, total_n_tiles
 from csbdeep.internals.train import RollingSequence
 from csbdeep.data import Resizer
 
+from .backend import InferenceBackend, KerasBackend, get_backend
 from ..sample_patches import get_valid_inds
-from ..nms import _ind_prob_thresh
-from ..utils import _is_power_of_2,  _is_floatarray, optimize_threshold
+from ..profiling import stage
+from ..nms import _ind_prob_thresh, _to_storage_dtype, _PROB_UINT8_SCALE
+from ..utils import _is_power_of_2,  _is_floatarray, _available_memory, optimize_threshold, optimize_thresholds_grid, _matching_pool
 
 # TODO: helper function to check if receptive field of cnn is sufficient for object sizes in GT
 
@@ -214,6 +220,48 @@ class StarDistDataBase(RollingSequence):
 
 
 
+# in-process registry of pretrained model instances, see StarDistBase.from_pretrained
+_pretrained_models = {}
+_pretrained_models_lock = threading.Lock()
+
+
+class PredictionWorkspace(object):
+    """Reusable buffers for repeated predictions of same-shape images.
+
+    Can be passed to :meth:`StarDistBase.predict` and :meth:`StarDistBase.predict_instances`,
+    such that the outputs of tiled prediction (prob, dist, [prob_class]) and the label image (2D only)
+    are written to the buffers of this workspace instead of newly allocated arrays.
+    A buffer is only (re-)allocated if the requested shape or data type changes.
+
+    Other arrays are still allocated for every prediction, notably the network outputs of non-tiled prediction
+    (allocated by the neural network backend), the label image of 3D models (allocated by the C renderer),
+    and the (variable-size) object candidates of non-maximum suppression.
+
+    Note that arrays returned by a prediction with a workspace are views of its buffers,
+    hence they are overwritten by the next prediction that uses the same workspace.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.n_allocations = 0
+
+    def get(self, name, shape, dtype=np.float32):
+        """Return (uninitialized) buffer ``name`` of given shape and data type."""
+        shape, dtype = tuple(int(s) for s in shape), np.dtype(dtype)
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self.buffers[name] = np.empty(shape, dtype)
+            self.n_allocations += 1
+        return buf
+
+    @property
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self.buffers.values())
+
+    def clear(self):
+        self.buffers.clear()
+
+
 class StarDistBase(BaseModel):
 
     def __init__(self, config, name=None, basedir='.'):
@@ -241,6 +289,78 @@ class StarDistBase(BaseModel):
         print("Using default values: prob_thresh={prob:g}, nms_thresh={nms:g}.".format(prob=self.thresholds.prob, nms=self.thresholds.nms))
 
 
+    @classmethod
+    def from_pretrained(cls, name_or_alias=None, cache=True):
+        """Load pretrained model with given name or alias (or list all available models if None).
+
+        If ``cache=True``, loaded models are kept in an in-process registry (keyed by model class,
+        name, and hash of the model files), such that subsequent calls return the same already built
+        instance without extracting the model files, building the network, and loading the weights again.
+        Note that this instance is then shared, i.e. changes to it (such as of its thresholds) affect all callers.
+        Use ``clear_pretrained_cache`` to remove cached instances.
+
+        """
+        if not cache or name_or_alias is None:
+            return super().from_pretrained(name_or_alias)
+        from csbdeep.models.pretrained import get_model_details
+        try:
+            key, _, details = get_model_details(cls, name_or_alias)
+        except ValueError:
+            # not registered, let base class report available models
+            return super().from_pretrained(name_or_alias)
+        cache_key = (cls, key, details['hash'])
+        with _pretrained_models_lock:
+            model = _pretrained_models.get(cache_key)
+            if model is None:
+                model = super().from_pretrained(name_or_alias)
+                if model is not None:
+                    _pretrained_models[cache_key] = model
+        return model
+
+
+    @classmethod
+    def clear_pretrained_cache(cls):
+        """Remove all pretrained models of this class from the in-process registry (see ``from_pretrained``)."""
+        with _pretrained_models_lock:
+            for cache_key in [k for k in _pretrained_models if issubclass(k[0], cls)]:
+                del _pretrained_models[cache_key]
+
+
+    def warmup(self, shapes, axes=None, n_tiles=None, **predict_kwargs):
+        """Perform one-time initializations such that the first prediction for images of the given shapes is not slow.
+
+        This computes the receptive field of the network (needed for tiling and block-wise prediction)
+        and runs `predict` on empty images of all given shapes, which builds/traces the neural network.
+
+        Parameters
+        ----------
+        shapes : tuple or list of tuple
+            Expected shape(s) of input images.
+        axes : str or None
+            Axes of the input images (see ``predict``).
+        n_tiles : iterable or None
+            Number of tiles for every image axis (see ``predict``).
+        predict_kwargs: dict
+            Keyword arguments for ``predict``.
+
+        Returns
+        -------
+        dict
+            Duration (in seconds) of the warm-up for each shape.
+
+        """
+        shapes = [shapes] if np.isscalar(shapes[0]) else shapes
+        predict_kwargs.setdefault('show_tile_progress', False)
+        self._axes_tile_overlap(self.config.axes)
+        durations = {}
+        for shape in shapes:
+            shape = tuple(int(s) for s in shape)
+            t = time.time()
+            self.predict(np.zeros(shape, np.float32), axes=axes, n_tiles=n_tiles, **predict_kwargs)
+            durations[shape] = time.time() - t
+        return durations
+
+
     @property
     def thresholds(self):
         return self._thresholds
@@ -248,6 +368,50 @@ class StarDistBase(BaseModel):
     def _is_multiclass(self):
         return (self.config.n_classes is not None)
 
+    @property
+    def backend(self):
+        """Inference backend used for prediction (Keras model by default, see ``set_backend``)."""
+        if getattr(self, '_backend', None) is None:
+            self._backend = KerasBackend(self)
+        return self._backend
+
+    def set_backend(self, backend='keras', **kwargs):
+        """Set the inference backend used by ``predict``, ``predict_sparse`` and ``predict_instances(_big)``.
+
+        Parameters
+        ----------
+        backend : str or :class:`stardist.models.backend.InferenceBackend`
+            Backend instance or name of a registered backend class (e.g. ``'keras'``, ``'savedmodel'``, or ``'onnx'``,
+            see ``stardist.models.backend.register_backend``).
+        kwargs : dict
+            Keyword arguments for the constructor of the backend class (if ``backend`` is a name).
+
+        The input and output specification of the backend (e.g. derived from the loaded export) must match
+        the one of the model (number of input channels, number of rays, etc.), otherwise a ``ValueError`` is raised.
+        Note that in-graph candidate selection (``_candidates_function``), i.e. ``predict_sparse`` with ``sparse_dist=True``
+        or ``max_candidates``, as well as ``export_TF_candidates``, requires the Keras backend and raises a
+        ``ValueError`` for any other backend.
+
+        Returns
+        -------
+        :class:`stardist.models.backend.InferenceBackend`
+            The backend instance.
+
+        Example
+        -------
+        >>> model.export_TF()
+        >>> model.set_backend('savedmodel')
+        """
+        if isinstance(backend, str):
+            backend = get_backend(backend)(self, **kwargs)
+        isinstance(backend, InferenceBackend) or _raise(ValueError("backend must be a name or an instance of InferenceBackend"))
+        # specification expected by the model (and its config)
+        expected = InferenceBackend(self)
+        (backend.input_spec == expected.input_spec and tuple(backend.output_spec) == expected.output_spec) or _raise(ValueError(
+            "specification of backend (input: %s, output: %s) doesn't match the model" % (backend.input_spec, backend.output_spec)))
+        self._backend = backend
+        return backend
+
     def _parse_classes_arg(self, classes, length):
         """ creates a proper classes tuple from different possible "classes" arguments in model.train()
 
@@ -354,8 +518,58 @@ class StarDistBase(BaseModel):
         self._model_prepared = True
 
 
-    def _predict_setup(self, img, axes, normalizer, n_tiles, show_tile_progress, predict_kwargs):
+    def _candidates_function(self, max_candidates=None):
+        """ Function that selects object candidates in the graph, i.e. without copying dense network outputs to the host.
+
+        The returned function maps a batch of one (network) input ``x``, a probability threshold, and the (grid) coordinates
+        ``lo`` (inclusive) and ``hi`` (exclusive) of a valid region to ``(points, prob, dist[, prob_class])`` of all pixels in that
+        region with ``prob > prob_thresh`` (in row-major order). If ``max_candidates`` is given, only that many candidates
+        with the highest probabilities are kept. The dist head is only evaluated for the candidates, by applying its
+        1x1 convolution kernel as a matrix multiplication to their feature vectors.
+        """
+        isinstance(self.backend, KerasBackend) or _raise(ValueError("in-graph candidate selection requires the Keras backend"))
+        not IS_TF_1 or _raise(NotImplementedError("in-graph candidate selection requires TensorFlow 2"))
+        max_candidates is None or (np.isscalar(max_candidates) and int(max_candidates) == max_candidates > 0) or _raise(
+            ValueError("max_candidates must be None or a positive integer"))
+        fns = self.__dict__.setdefault('_candidates_fns', {})
+        if max_candidates not in fns:
+            Model = keras_import('models', 'Model')
+            layer_dist = self.keras_model.get_layer('dist')
+            outputs = [self.keras_model.get_layer('prob').output, layer_dist.input]
+            if self._is_multiclass():
+                outputs.append(self.keras_model.get_layer('prob_class').output)
+            model = Model(self.keras_model.inputs, outputs)
+            n_rays, n_dim = self.config.n_rays, self.config.n_dim
+
+            @tf.function
+            def _candidates(x, prob_thresh, lo, hi):
+                prob, features, *rest = model(x, training=False)
+                prob = prob[0,...,0]
+                mask = prob > prob_thresh
+                for i in range(n_dim):
+                    r = tf.range(tf.shape(prob)[i])
+                    valid = tf.logical_and(r >= lo[i], r < hi[i])
+                    mask = tf.logical_and(mask, tf.reshape(valid, [-1 if j==i else 1 for j in range(n_dim)]))
+                if max_candidates is None:
+                    points = tf.where(mask)
+                else:
+                    prob_flat = tf.reshape(tf.where(mask, prob, tf.fill(tf.shape(prob), -np.inf)), [-1])
+                    values, inds = tf.math.top_k(prob_flat, tf.minimum(int(max_candidates), tf.size(prob_flat)))
+                    inds = tf.sort(tf.boolean_mask(inds, values > -np.inf)) # row-major order
+                    points = tf.cast(tf.transpose(tf.unravel_index(inds, tf.shape(prob))), tf.int64)
+                features = tf.gather_nd(features[0], points)
+                dist = tf.matmul(features, tf.reshape(layer_dist.kernel, (-1,n_rays))) + layer_dist.bias
+                # avoid small dist values to prevent problems with Qhull
+                return (points, tf.gather_nd(prob, points), tf.maximum(1e-3, dist)) + tuple(tf.gather_nd(y[0], points) for y in rest)
+
+            fns[max_candidates] = _candidates
+        return fns[max_candidates]
+
+
+    def _predict_setup(self, img, axes, normalizer, n_tiles, show_tile_progress, predict_kwargs, prescan=None, candidates=None):
         """ Shared setup code between `predict` and `predict_sparse` """
+        if isinstance(n_tiles, str) and n_tiles == 'auto':
+            n_tiles = self.suggest_n_tiles(img.shape, axes, verbose=show_tile_progress)
         if n_tiles is None:
             n_tiles = [1]*img.ndim
         try:
@@ -386,15 +600,60 @@ class StarDistBase(BaseModel):
         normalizer = self._check_normalizer_resizer(normalizer, None)[0]
         resizer = StarDistPadAndCropResizer(grid=grid_dict)
 
-        x = normalizer.before(x, axes_net)
-        x = resizer.before(x, axes_net, axes_net_div_by)
+        if prescan is not None:
+            # pre-scan (of the raw input image) to skip prediction for background tiles
+            prescan.fitted or prescan.fit(img, axes)
+            shape_prescan = {a:s for a,s in zip(axes,img.shape) if a != 'C'}
+            (set(prescan.axes) == set(shape_prescan) and all(shape_prescan[a] == s for a,s in zip(prescan.axes,prescan.shape))) or _raise(ValueError(
+                f"pre-scan with axes {prescan.axes} and shape {prescan.shape} doesn't match input image"))
+
+        with stage('normalize'):
+            x = normalizer.before(x, axes_net)
+        with stage('pad'):
+            x = resizer.before(x, axes_net, axes_net_div_by)
 
         if not _is_floatarray(x):
             warnings.warn("Predicting on non-float input... ( forgot to normalize? )")
 
-        def predict_direct(x):
-            ys = self.keras_model.predict(x[np.newaxis], **predict_kwargs)
-            return tuple(y[0] for y in ys)
+        def predict_empty(x):
+            # outputs without any objects, i.e. zero object probability
+            sh = [s//grid_dict.get(a,1) for a,s in zip(axes_net,x.shape)]
+            def _empty(n_channel):
+                sh[channel] = n_channel
+                return np.zeros(sh, np.float32)
+            if candidates is not None:
+                ys = [np.zeros((0,len(grid)),np.int64), np.zeros(0,np.float32), np.zeros((0,self.config.n_rays),np.float32)]
+                if self._is_multiclass():
+                    ys.append(np.zeros((0,self.config.n_classes+1),np.float32))
+                return tuple(ys)
+            ys = [_empty(1), _empty(self.config.n_rays)]
+            if self._is_multiclass():
+                ys.append(_empty(self.config.n_classes+1))
+                np.moveaxis(ys[-1],channel,-1)[...,0] = 1 # background class
+            return tuple(ys)
+
+        def predict_direct(x, offset=None, region=None):
+            # offset: start position of x (tile) in image
+            # region: (lo, hi) grid coordinates of x for in-graph candidate selection (default: all of x)
+            if prescan is not None:
+                offset = (0,)*x.ndim if offset is None else offset
+                # (not to be confused with the candidate region, which is in grid coordinates of x)
+                tile_region = {a:(o,o+s) for a,o,s in zip(axes_net,offset,x.shape) if a != 'C'}
+                if prescan.is_background(tile_region):
+                    with stage('network', tiles=1, skipped=1):
+                        return predict_empty(x)
+            with stage('network', tiles=1) as _stage:
+                if candidates is not None:
+                    if region is None:
+                        region = (0,)*len(grid), tuple(s//grid_dict.get(a,1) for a,s in zip(axes_net,x.shape) if a != 'C')
+                    fn = self._candidates_function(candidates['max_candidates'])
+                    ys = fn(x[np.newaxis], tf.constant(candidates['prob_thresh'], tf.float32),
+                            tf.constant(region[0], tf.int32), tf.constant(region[1], tf.int32))
+                    ys = tuple(y.numpy() for y in ys)
+                    _stage.add(candidates=len(ys[0]))
+                    return ys
+                ys = self.backend.predict(x[np.newaxis], **predict_kwargs)
+                return tuple(y[0] for y in ys)
 
         def tiling_setup():
             assert np.prod(n_tiles) > 1
@@ -425,7 +684,8 @@ class StarDistBase(BaseModel):
         return x, axes, axes_net, axes_net_div_by, _permute_axes, resizer, n_tiles, grid, grid_dict, channel, predict_direct, tiling_setup
 
 
-    def predict(self, img, axes=None, normalizer=None, n_tiles=None, show_tile_progress=True, **predict_kwargs):
+    def predict(self, img, axes=None, normalizer=None, n_tiles=None, show_tile_progress=True, prescan=None, workspace=None,
+                prob_dtype=np.float32, dist_dtype=np.float32, dist_scale=None, **predict_kwargs):
         """Predict.
 
         Parameters
@@ -444,10 +704,33 @@ class StarDistBase(BaseModel):
             that are processed independently and re-assembled.
             This parameter denotes a tuple of the number of tiles for every image axis (see ``axes``).
             ``None`` denotes that no tiling should be used.
+            ``'auto'`` chooses the number of tiles based on the estimated memory (see ``suggest_n_tiles``).
         show_tile_progress: bool
             Whether to show progress during tiled prediction.
+        prescan: :class:`stardist.big.ForegroundPrescan` or None
+            (Optional) foreground pre-scan of the input image to skip prediction for background tiles,
+            which are assumed to have zero object probability.
+        workspace: :class:`PredictionWorkspace` or None
+            (Optional) reusable buffers for the outputs of tiled prediction (not used if ``n_tiles`` is None).
+            Note that the returned arrays are then views of these buffers, which are overwritten by the next call.
+        prob_dtype: numpy dtype
+            Data type to store the probabilities in, either ``np.float32``, ``np.float16``, or ``np.uint8``
+            (fixed-point with scale 1/255). Reduced precision is applied to each tile during tiled prediction,
+            i.e. a full-size float32 array is never allocated. Without tiling (``n_tiles=None``), the network outputs
+            for the entire image are float32 and only converted afterwards, hence memory is then saved for the
+            returned arrays, but not at peak.
+        dist_dtype: numpy dtype
+            Data type to store the distances in, either ``np.float32``, ``np.float16``, or ``np.uint16``/``np.uint8``
+            (fixed-point with scale ``dist_scale``, see ``prob_dtype``).
+            Non-maximum suppression supports all these data types and only converts object candidates to float32.
+        dist_scale: float or None
+            Scale of distances stored as unsigned integers (required for these ``dist_dtype``),
+            i.e. ``dist = stored_dist / dist_scale``. For example, ``dist_scale=64`` with ``np.uint16`` represents
+            distances up to 1024 pixels with a resolution of 1/64 pixel. Larger distances saturate.
+            The same ``dist_scale`` must be passed to the non-maximum suppression of these distances
+            (as done by ``predict_instances``).
         predict_kwargs: dict
-            Keyword arguments for ``predict`` function of Keras model.
+            Keyword arguments for ``predict`` function of Keras model (or of the inference backend, see ``set_backend``).
 
         Returns
         -------
@@ -457,23 +740,38 @@ class StarDistBase(BaseModel):
 
         """
 
+        np.dtype(prob_dtype) in (np.float32, np.float16, np.uint8) or _raise(ValueError("prob_dtype must be float32, float16, or uint8"))
+        np.dtype(dist_dtype) in (np.float32, np.float16, np.uint16, np.uint8) or _raise(ValueError("dist_dtype must be float32, float16, uint16, or uint8"))
+        if np.issubdtype(dist_dtype, np.integer):
+            (dist_scale is not None and dist_scale > 0) or _raise(ValueError("positive dist_scale required for dist_dtype %s" % np.dtype(dist_dtype)))
+        scales = (_PROB_UINT8_SCALE, dist_scale, None)
+
         x, axes, axes_net, axes_net_div_by, _permute_axes, resizer, n_tiles, grid, grid_dict, channel, predict_direct, tiling_setup = \
-            self._predict_setup(img, axes, normalizer, n_tiles, show_tile_progress, predict_kwargs)
+            self._predict_setup(img, axes, normalizer, n_tiles, show_tile_progress, predict_kwargs, prescan)
 
         if np.prod(n_tiles) > 1:
             tile_generator, output_shape, create_empty_output = tiling_setup()
 
-            prob = create_empty_output(1)
-            dist = create_empty_output(self.config.n_rays)
+            def empty_output(name, n_channel, dtype=np.float32):
+                if workspace is None:
+                    return create_empty_output(n_channel, dtype)
+                sh = list(output_shape)
+                sh[channel] = n_channel
+                return workspace.get(name, sh, dtype)
+
+            prob = empty_output('prob', 1, prob_dtype)
+            dist = empty_output('dist', self.config.n_rays, dist_dtype)
             if self._is_multiclass():
-                prob_class = create_empty_output(self.config.n_classes+1)
+                prob_class = empty_output('prob_class', self.config.n_classes+1)
                 result = (prob, dist, prob_class)
             else:
                 result = (prob, dist)
 
             for tile, s_src, s_dst in tile_generator:
                 # predict_direct -> prob, dist, [prob_class if multi_class]
-                result_tile = predict_direct(tile)
+                result_tile = predict_direct(tile, offset=[d.start-s.start for s,d in zip(s_src,s_dst)])
+                if prescan is not None and show_tile_progress:
+                    tile_generator.set_postfix_str(f"skipped {prescan.n_skipped} background tiles", refresh=False)
                 # account for grid
                 s_src = [slice(s.start//grid_dict.get(a,1),s.stop//grid_dict.get(a,1)) for s,a in zip(s_src,axes_net)]
                 s_dst = [slice(s.start//grid_dict.get(a,1),s.stop//grid_dict.get(a,1)) for s,a in zip(s_dst,axes_net)]
@@ -482,36 +780,82 @@ class StarDistBase(BaseModel):
                 s_dst[channel] = slice(None)
                 s_src, s_dst = tuple(s_src), tuple(s_dst)
                 # print(s_src,s_dst)
-                for part, part_tile in zip(result, result_tile):
-                    part[s_dst] = part_tile[s_src]
+                with stage('assemble'):
+                    for part, part_tile, scale in zip(result, result_tile, scales):
+                        part[s_dst] = _to_storage_dtype(part_tile[s_src], part.dtype, scale)
         else:
             # predict_direct -> prob, dist, [prob_class if multi_class]
             result = predict_direct(x)
 
-        result = [resizer.after(part, axes_net) for part in result]
+        with stage('crop'):
+            result = [resizer.after(part, axes_net) for part in result]
 
-        # permute axes back and always move channel axis to the end
-        result = [_permute_axes(part, undo=True) for part in result]
-        result[1] = np.maximum(1e-3, result[1]) # avoid small dist values to prevent problems with Qhull
+            # permute axes back and always move channel axis to the end
+            result = [_permute_axes(part, undo=True) for part in result]
+            result[0] = _to_storage_dtype(result[0], prob_dtype, _PROB_UINT8_SCALE)
+            result[1] = _to_storage_dtype(result[1], dist_dtype, dist_scale)
+            # avoid small dist values to prevent problems with Qhull (smallest positive value for integer storage)
+            np.maximum(1 if np.issubdtype(result[1].dtype, np.integer) else 1e-3, result[1], out=result[1])
         return tuple(result)
 
 
-    def predict_sparse(self, img, prob_thresh=None, axes=None, normalizer=None, n_tiles=None, show_tile_progress=True, b=2, **predict_kwargs):
+    def _predict_batch(self, imgs, axes=None, normalizer=None, **predict_kwargs):
+        """ Like `predict` (without tiling), but for a list of same-shape images that are passed together through the network.
+        Returns list of results of `predict` for every image.
+        """
+        setups = [self._predict_setup(img, axes, normalizer, None, False, predict_kwargs)[:6] for img in imgs]
+        len(set(x.shape for x,*_ in setups)) == 1 or _raise(ValueError("all images must have the same shape"))
+        ys = self.backend.predict(np.stack([x for x,*_ in setups]), **predict_kwargs)
+        results = []
+        for i, (x, axes, axes_net, axes_net_div_by, _permute_axes, resizer) in enumerate(setups):
+            result = [resizer.after(y[i], axes_net) for y in ys]
+            result = [_permute_axes(part, undo=True) for part in result]
+            np.maximum(1e-3, result[1], out=result[1]) # avoid small dist values to prevent problems with Qhull
+            results.append(tuple(result))
+        return results
+
+
+    def predict_sparse(self, img, prob_thresh=None, axes=None, normalizer=None, n_tiles=None, show_tile_progress=True, b=2, prescan=None,
+                       sparse_dist=False, max_candidates=None, **predict_kwargs):
         """ Sparse version of model.predict()
+
+        If ``sparse_dist=True``, object candidates (with probability above ``prob_thresh``) are selected in the graph and
+        the distances are only computed for them by applying the dist head to their feature vectors, i.e. dense
+        outputs are neither materialized nor copied to the host (see ``_candidates_function``).
+        If ``max_candidates`` is given (implies ``sparse_dist=True``), at most that many candidates
+        with the highest probabilities are kept per tile.
+        Both require TensorFlow 2 and ignore ``predict_kwargs``.
+
         Returns
         -------
         (prob, dist, [prob_class], points)   flat list of probs, dists, (optional prob_class) and points
         """
         if prob_thresh is None: prob_thresh = self.thresholds.prob
+        in_graph = sparse_dist or max_candidates is not None
 
         x, axes, axes_net, axes_net_div_by, _permute_axes, resizer, n_tiles, grid, grid_dict, channel, predict_direct, tiling_setup = \
-            self._predict_setup(img, axes, normalizer, n_tiles, show_tile_progress, predict_kwargs)
-
-        def _prep(prob, dist):
-            prob = np.take(prob,0,axis=channel)
-            dist = np.moveaxis(dist,channel,-1)
-            dist = np.maximum(1e-3, dist)
-            return prob, dist
+            self._predict_setup(img, axes, normalizer, n_tiles, show_tile_progress, predict_kwargs, prescan,
+                                candidates=(dict(prob_thresh=prob_thresh, max_candidates=max_candidates) if in_graph else None))
+
+        def _region(s_src, bs):
+            # (lo, hi) grid coordinates of valid candidates
+            s_src = [s for i,s in enumerate(s_src) if i != channel]
+            bs = [(0,0)]*len(s_src) if bs is None else [(bs,bs)]*len(s_src) if np.isscalar(bs) else bs
+            return (tuple(s.start+max(b0,0) for s,(b0,b1) in zip(s_src,bs)),
+                    tuple(s.stop -max(b1,0) for s,(b0,b1) in zip(s_src,bs)))
+
+        def _candidates(results, s_src, bs):
+            # points (w.r.t. s_src, in row-major order), prob, dist, [prob_class] of all candidates
+            if in_graph:
+                points, *rest = results # already selected in the graph
+                return (points - np.array(_region(s_src, None)[0], points.dtype),) + tuple(rest)
+            prob = np.take(results[0][s_src],0,axis=channel)
+            inds = _ind_prob_thresh(prob, prob_thresh, b=bs)
+            dist = np.moveaxis(results[1][s_src],channel,-1)
+            res = np.stack(np.where(inds), axis=1), prob[inds].copy(), np.maximum(1e-3, dist[inds]) # only clip dist of candidates
+            if self._is_multiclass():
+                res += (np.moveaxis(results[2][s_src],channel,-1)[inds],)
+            return res
 
         proba, dista, pointsa, prob_class = [],[],[], []
 
@@ -525,7 +869,7 @@ class StarDistBase(BaseModel):
 
             for tile, s_src, s_dst in tile_generator:
 
-                results_tile = predict_direct(tile)
+                offset = [d.start-s.start for s,d in zip(s_src,s_dst)]
 
                 # account for grid
                 s_src = [slice(s.start//grid_dict.get(a,1),s.stop//grid_dict.get(a,1)) for s,a in zip(s_src,axes_net)]
@@ -534,40 +878,39 @@ class StarDistBase(BaseModel):
                 s_dst[channel] = slice(None)
                 s_src, s_dst = tuple(s_src), tuple(s_dst)
 
-                prob_tile, dist_tile = results_tile[:2]
-                prob_tile, dist_tile = _prep(prob_tile[s_src], dist_tile[s_src])
-
                 bs = list((b if s.start==0 else -1, b if s.stop==_sh else -1) for s,_sh in zip(s_dst, sh))
                 bs.pop(channel)
-                inds   = _ind_prob_thresh(prob_tile, prob_thresh, b=bs)
-                proba.extend(prob_tile[inds].copy())
-                dista.extend(dist_tile[inds].copy())
-                _points = np.stack(np.where(inds), axis=1)
+
+                results_tile = predict_direct(tile, offset=offset, region=_region(s_src, bs))
+                if prescan is not None and show_tile_progress:
+                    tile_generator.set_postfix_str(f"skipped {prescan.n_skipped} background tiles", refresh=False)
+
+                with stage('threshold') as _stage:
+                    _points, prob_tile, dist_tile, *prob_class_tile = _candidates(results_tile, s_src, bs)
+                    _stage.add(candidates=len(_points))
+                proba.extend(prob_tile)
+                dista.extend(dist_tile)
+                if self._is_multiclass():
+                    prob_classa.extend(prob_class_tile[0])
+
                 offset = list(s.start for i,s in enumerate(s_dst))
                 offset.pop(channel)
                 _points = _points + np.array(offset).reshape((1,len(offset)))
                 _points = _points * np.array(self.config.grid).reshape((1,len(self.config.grid)))
                 pointsa.extend(_points)
 
-                if self._is_multiclass():
-                    p = results_tile[2][s_src].copy()
-                    p = np.moveaxis(p,channel,-1)
-                    prob_classa.extend(p[inds])
-
         else:
             # predict_direct -> prob, dist, [prob_class if multi_class]
-            results = predict_direct(x)
-            prob, dist = results[:2]
-            prob, dist = _prep(prob, dist)
-            inds   = _ind_prob_thresh(prob, prob_thresh, b=b)
-            proba = prob[inds].copy()
-            dista = dist[inds].copy()
-            _points = np.stack(np.where(inds), axis=1)
+            #                or points, prob, dist, [prob_class if multi_class] (candidates selected in the graph)
+            s_src = tuple(slice(None) if i == channel else slice(0,s//grid_dict.get(a,1)) for i,(a,s) in enumerate(zip(axes_net,x.shape)))
+            results = predict_direct(x, region=_region(s_src, b))
+            with stage('threshold') as _stage:
+                _points, proba, dista, *prob_classa = _candidates(results, s_src, b)
+                _stage.add(candidates=len(_points))
             pointsa = (_points * np.array(self.config.grid).reshape((1,len(self.config.grid))))
 
             if self._is_multiclass():
-                p = np.moveaxis(results[2],channel,-1)
-                prob_classa = p[inds].copy()
+                prob_classa = prob_classa[0]
 
 
         proba = np.asarray(proba)
@@ -588,7 +931,9 @@ class StarDistBase(BaseModel):
                           n_tiles=None, show_tile_progress=True,
                           verbose = False,
                           return_labels = True,
-                          predict_kwargs=None, nms_kwargs=None, overlap_label=None):
+                          predict_kwargs=None, nms_kwargs=None, overlap_label=None, prescan=None, workspace=None,
+                          prob_dtype=np.float32, dist_dtype=np.float32, dist_scale=None, sparse_dist=False, max_candidates=None,
+                          return_instances=False):
         """Predict instance segmentation from input image.
 
         Parameters
@@ -616,20 +961,46 @@ class StarDistBase(BaseModel):
             that are processed independently and re-assembled.
             This parameter denotes a tuple of the number of tiles for every image axis (see ``axes``).
             ``None`` denotes that no tiling should be used.
+            ``'auto'`` chooses the number of tiles based on the estimated memory (see ``suggest_n_tiles``).
         show_tile_progress: bool
             Whether to show progress during tiled prediction.
         predict_kwargs: dict
-            Keyword arguments for ``predict`` function of Keras model.
+            Keyword arguments for ``predict`` function of Keras model (or of the inference backend, see ``set_backend``).
         nms_kwargs: dict
             Keyword arguments for non-maximum suppression.
         overlap_label: scalar or None
             if not None, label the regions where polygons overlap with that value
+        prescan: :class:`stardist.big.ForegroundPrescan` or None
+            (Optional) foreground pre-scan of the input image to skip prediction for background tiles
+            (see ``predict``).
+        workspace: :class:`PredictionWorkspace` or None
+            (Optional) reusable buffers for the outputs of (dense) tiled prediction and the label image (2D only),
+            e.g. to avoid repeated memory allocations when predicting many images of the same shape.
+            Note that the returned label image is then a view of a buffer, which is overwritten by the next call.
+        prob_dtype, dist_dtype: numpy dtype
+            Data types to store the dense probabilities and distances in (see ``predict``),
+            e.g. ``np.float16`` to halve their memory footprint. Ignored for sparse prediction.
+            Peak memory is only reduced for tiled prediction, since otherwise the network outputs are float32.
+            The distances of the returned objects are also stored as ``dist_dtype`` (as float32 for integer types).
+        dist_scale: float or None
+            Scale of distances stored as unsigned integers (see ``predict``).
+        sparse_dist: bool
+            If true, only compute the distances at candidate pixels (with probability above ``prob_thresh``),
+            which avoids evaluating the dist head densely (see ``predict_sparse``). Implies ``sparse=True``.
+        max_candidates: int or None
+            If not None, only keep that many object candidates with the highest probabilities per tile
+            (selected in the graph, see ``predict_sparse``). Implies ``sparse_dist=True``.
+        return_instances: bool
+            If true, return the details of the polygons/polyhedra as :class:`stardist.instances.StarDistInstances`
+            instead of a dictionary, which only stores the center points, probabilities and distances
+            (derived quantities such as the coordinates are computed on first access).
 
         Returns
         -------
-        (:class:`numpy.ndarray`, dict)
+        (:class:`numpy.ndarray`, dict or :class:`stardist.instances.StarDistInstances`)
             Returns a tuple of the label instances image and also
-            a dictionary with the details (coordinates, etc.) of all remaining polygons/polyhedra.
+            the details (coordinates, etc.) of all remaining polygons/polyhedra
+            (see ``return_instances``).
 
         """
         if predict_kwargs is None:
@@ -642,16 +1013,24 @@ class StarDistBase(BaseModel):
         _axes         = self._normalize_axes(img, axes)
         _shape_inst   = tuple(s for s,a in zip(img.shape, _axes) if a != 'C')
 
-        if sparse:
+        if sparse or sparse_dist or max_candidates is not None:
             res = self.predict_sparse(img, prob_thresh = prob_thresh,
                                     axes=axes, normalizer=normalizer,
                                     n_tiles=n_tiles,
                                     show_tile_progress=show_tile_progress,
+                                    prescan=prescan,
+                                    sparse_dist=sparse_dist,
+                                    max_candidates=max_candidates,
                                     **predict_kwargs)
         else:
             res = self.predict(img, axes=axes, normalizer=normalizer,
                                       n_tiles=n_tiles,
                                       show_tile_progress=show_tile_progress,
+                                      prescan=prescan,
+                                      workspace=workspace,
+                                      prob_dtype=prob_dtype,
+                                      dist_dtype=dist_dtype,
+                                      dist_scale=dist_scale,
                                       **predict_kwargs)
             
             res = tuple(res) + (None,)
@@ -662,16 +1041,132 @@ class StarDistBase(BaseModel):
             prob, dist, points = res
             prob_class = None
             
-        return self._instances_from_prediction(_shape_inst, prob, dist,
-                                               points = points,
-                                               prob_class = prob_class,
-                                               prob_thresh=prob_thresh,
-                                               nms_thresh=nms_thresh,
-                                               return_labels = return_labels, 
-                                               overlap_label=overlap_label,
-                                               **nms_kwargs)
+        labels, polys = self._instances_from_prediction(_shape_inst, prob, dist,
+                                                        points = points,
+                                                        prob_class = prob_class,
+                                                        prob_thresh=prob_thresh,
+                                                        nms_thresh=nms_thresh,
+                                                        return_labels = return_labels, 
+                                                        overlap_label=overlap_label,
+                                                        workspace=workspace,
+                                                        dist_scale=dist_scale,
+                                                        **nms_kwargs)
+        return labels, (polys if return_instances else polys.to_dict())
+
+
+    def predict_instances_iter(self, images, axes=None, normalizer=None, batch_size=4,
+                               prob_thresh=None, nms_thresh=None, n_tiles=None,
+                               workers=1, processes=False, max_pending=None, verbose=False,
+                               return_labels=True, predict_kwargs=None, nms_kwargs=None, overlap_label=None, return_instances=False):
+        """Predict instance segmentations for a sequence of images, e.g. fields of view or frames of a time-lapse.
+
+        Consecutive images of the same shape are passed together (in batches) through the neural network,
+        and non-maximum suppression and rendering of the label images (see ``predict_instances``) run on a pool
+        of workers, i.e. they overlap with the prediction of the following images.
+
+        Parameters
+        ----------
+        images : iterable of :class:`numpy.ndarray`
+            Input images, e.g. a list or generator of images or an array whose first axis is iterated over
+            (such as the time axis of a time-lapse).
+        axes : str or None
+            Axes of each of the input ``images`` (see ``predict_instances``).
+        normalizer : :class:`csbdeep.data.Normalizer` or None
+            (Optional) normalization of each input image before prediction.
+        batch_size : int
+            Maximum number of images that are passed together through the neural network.
+        prob_thresh : float or None
+            Probability threshold (see ``predict_instances``).
+        nms_thresh : float or None
+            Overlap threshold of the non-maximum suppression (see ``predict_instances``).
+        n_tiles : iterable or None
+            Number of tiles for every image axis (see ``predict``). Disables batching if not ``None``.
+        workers : int
+            Number of workers for non-maximum suppression and rendering.
+        processes : bool
+            Whether to use worker processes instead of threads. Threads can only overlap post-processing with
+            the prediction of the neural network, whereas processes can also post-process several images in parallel.
+            Worker processes only import the post-processing functions (not TensorFlow), but still need some time to start,
+            hence processes are only beneficial for long sequences on machines with several CPU cores.
+        max_pending : int or None
+            Maximum number of predicted images that wait for post-processing, which bounds the memory consumption.
+            ``None`` denotes ``batch_size + workers``.
+        verbose : bool
+            Verbosity of the non-maximum suppression.
+        return_labels, predict_kwargs, nms_kwargs, overlap_label, return_instances
+            See ``predict_instances``.
+
+        Yields
+        ------
+        (:class:`numpy.ndarray`, dict or :class:`stardist.instances.StarDistInstances`)
+            Tuple of the label instances image and the details of all polygons/polyhedra
+            (see ``predict_instances``) for every input image, in the same order.
+
+        """
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        if predict_kwargs is None:
+            predict_kwargs = {}
+        if nms_kwargs is None:
+            nms_kwargs = {}
+        nms_kwargs.setdefault("verbose", verbose)
+        int(batch_size) >= 1 or _raise(ValueError("batch_size must be >= 1"))
+        int(workers) >= 1 or _raise(ValueError("workers must be >= 1"))
+        if max_pending is None:
+            max_pending = batch_size + workers
+        if overlap_label is not None:
+            nms_kwargs['overlap_label'] = overlap_label
+
+        if processes:
+            from multiprocessing import get_context
+            from ..postprocess import postprocess_params, _init_worker, _instances_from_prediction_worker
+            pool = ProcessPoolExecutor(workers, mp_context=get_context('spawn'), initializer=_init_worker,
+                                       initargs=({None: postprocess_params(self)},))
+            instances_from_prediction = _instances_from_prediction_worker
+        else:
+            pool = ThreadPoolExecutor(workers)
+            instances_from_prediction = self._instances_from_prediction
+        pending = deque()
+
+        def _result(future):
+            labels, polys = future.result()
+            return labels, (polys if return_instances else polys.to_dict())
+
+        def _submit(batch):
+            if n_tiles is None:
+                results = self._predict_batch(batch, axes, normalizer, **predict_kwargs)
+            else:
+                results = [self.predict(img, axes, normalizer, n_tiles=n_tiles, show_tile_progress=False, **predict_kwargs) for img in batch]
+            for img, result in zip(batch, results):
+                _axes = self._normalize_axes(img, axes)
+                _shape_inst = tuple(s for s,a in zip(img.shape, _axes) if a != 'C')
+                prob_class = result[2] if self._is_multiclass() else None
+                pending.append(pool.submit(instances_from_prediction, _shape_inst, result[0], result[1],
+                                           prob_class=prob_class, prob_thresh=prob_thresh, nms_thresh=nms_thresh,
+                                           return_labels=return_labels, **nms_kwargs))
+
+        try:
+            batch = []
+            for img in images:
+                if len(batch) > 0 and img.shape != batch[0].shape:
+                    _submit(batch); batch = []
+                batch.append(img)
+                if len(batch) == (batch_size if n_tiles is None else 1):
+                    _submit(batch); batch = []
+                # yield finished results, but wait if too many results are pending
+                while len(pending) > 0 and (pending[0].done() or len(pending) > max_pending):
+                    yield _result(pending.popleft())
+            if len(batch) > 0:
+                _submit(batch)
+            while len(pending) > 0:
+                yield _result(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
 
-    
     def _predict_instances_old(self, img, axes=None, normalizer=None,
                           sparse = False, 
                           prob_thresh=None, nms_thresh=None,
@@ -718,7 +1213,8 @@ class StarDistBase(BaseModel):
 
 
     def predict_instances_big(self, img, axes, block_size, min_overlap, context=None, 
-                              labels_out=None, labels_out_dtype=np.int32, show_progress=True, **kwargs):
+                              labels_out=None, labels_out_dtype=np.int32, show_progress=True, filter_mode='labels', checkpoint_dir=None, reader_kwargs=None, memory_budget=None,
+                              return_instances=False, **kwargs):
         """Predict instance segmentation from very large input images.
 
         Intended to be used when `predict_instances` cannot be used due to memory limitations.
@@ -738,13 +1234,15 @@ class StarDistBase(BaseModel):
 
         Parameters
         ----------
-        img: :class:`numpy.ndarray` or similar
-            Input image
+        img: :class:`numpy.ndarray` or similar, or str or :class:`pathlib.Path`
+            Input image, e.g. a numpy array, memmap, or zarr array.
+            If a filename is given, it must be a tiled TIFF file that is read lazily via ``big.TiledTiffArray``.
         axes: str
             Axes of the input ``img`` (such as 'YX', 'ZYX', 'YXC', etc.)
-        block_size: int or iterable of int
+        block_size: int or iterable of int or None
             Process input image in blocks of the provided shape.
             (If a scalar value is given, it is used for all spatial image dimensions.)
+            If None, the largest block size whose estimated memory fits into ``memory_budget`` is used.
         min_overlap: int or iterable of int
             Amount of guaranteed overlap between blocks.
             (If a scalar value is given, it is used for all spatial image dimensions.)
@@ -760,17 +1258,61 @@ class StarDistBase(BaseModel):
             Data type of returned label image if ``labels_out=None`` (has no effect otherwise).
         show_progress: bool
             Show progress bar for block processing.
+        filter_mode: str
+            How to decide which block is responsible for an object (see ``BlockND.filter_objects``).
+            If 'labels', use the object bounding boxes of each block's label image.
+            If 'bbox', use the bounding boxes computed from the object coordinates (see ``BlockND.filter_objects_bbox``)
+            and only render the retained objects, which is faster.
+        checkpoint_dir: str or :class:`pathlib.Path` or None
+            If provided, the results of each completed block are saved to this directory (see ``big.BlockCheckpoint``)
+            and a subsequent call with the same arguments will skip these blocks, e.g. after a crash.
+            If ``labels_out=None``, the label image is stored as a memory-mapped file 'labels.npy' in this directory.
+            (If ``labels_out`` is provided, it must also be persistent, e.g. a zarr array, for resumption to work.)
+        reader_kwargs: dict or None
+            Keyword arguments for ``big.BlockReader``, which reads blocks ahead of time on background threads
+            and caches image chunks of chunked inputs (e.g. ``prefetch`` and ``cache_bytes``).
+        memory_budget: int or None
+            Memory budget (in bytes) for processing a single block, only used if ``block_size=None`` or ``n_tiles='auto'``
+            (by default half of the currently available system memory, see ``estimate_memory``).
+            Note that ``n_tiles='auto'`` is resolved only once, i.e. for the largest block.
+        return_instances: bool
+            If true, return the details of the polygons/polyhedra as :class:`stardist.instances.StarDistInstances`
+            instead of a dictionary (see ``predict_instances``).
         kwargs: dict
             Keyword arguments for ``predict_instances``.
+            If ``normalizer`` is a ``big.StreamingPercentileNormalizer`` that has not been fitted yet,
+            its percentiles are first estimated from the entire image such that all blocks are normalized identically.
+            If ``prescan`` is a ``big.ForegroundPrescan``, it is fitted on the entire image (if necessary) and
+            prediction is skipped for blocks and tiles that are considered background
+            (background blocks are neither read nor normalized).
 
         Returns
         -------
-        (:class:`numpy.ndarray` or False, dict)
-            Returns the label image and a dictionary with the details (coordinates, etc.) of the polygons/polyhedra.
+        (:class:`numpy.ndarray` or False, dict or :class:`stardist.instances.StarDistInstances`)
+            Returns the label image and the details (coordinates, etc.) of the polygons/polyhedra
+            (concatenated from all blocks, see ``return_instances``).
 
         """
-        from ..big import _grid_divisible, BlockND, OBJECT_KEYS#, repaint_labels
-        from ..matching import relabel_sequential
+        from ..big import _grid_divisible, BlockND, BlockReader, BlockWriter, BlockCheckpoint, TiledTiffArray, StreamingPercentileNormalizer, ForegroundPrescan, OBJECT_KEYS, relabel_block#, repaint_labels
+        from ..instances import StarDistInstances
+
+        filter_mode in ('labels','bbox') or _raise(ValueError("filter_mode must be either 'labels' or 'bbox'"))
+        img_fname = img if isinstance(img, (str,Path)) else None
+        # close reader (background threads) and image file also if an exception occurs
+        with ExitStack() as cleanup:
+            if img_fname is not None:
+                img = TiledTiffArray(img_fname)
+                cleanup.callback(img.close)
+            labels, polys = self._predict_instances_big(img, axes, block_size, min_overlap, context, labels_out, labels_out_dtype, show_progress,
+                                                        filter_mode, checkpoint_dir, reader_kwargs, memory_budget, cleanup, **kwargs)
+        return labels, (polys.to_dict() if isinstance(polys, StarDistInstances) and not return_instances else polys)
+
+
+    def _predict_instances_big(self, img, axes, block_size, min_overlap, context, labels_out, labels_out_dtype, show_progress,
+                               filter_mode, checkpoint_dir, reader_kwargs, memory_budget, cleanup, **kwargs):
+        # see predict_instances_big, resources (such as the block reader) are registered with ExitStack 'cleanup'
+        from ..big import _grid_divisible, BlockND, BlockReader, BlockWriter, BlockCheckpoint, TiledTiffArray, StreamingPercentileNormalizer, ForegroundPrescan, OBJECT_KEYS, relabel_block#, repaint_labels
+        from ..instances import StarDistInstances
 
         n = img.ndim
         axes = axes_check_and_normalize(axes, length=n)
@@ -785,6 +1327,10 @@ class StarDistBase(BaseModel):
         if np.isscalar(block_size):  block_size  = n*[block_size]
         if np.isscalar(min_overlap): min_overlap = n*[min_overlap]
         if np.isscalar(context):     context     = n*[context]
+        if block_size is None:
+            n_tiles = kwargs.get('n_tiles')
+            block_size = self._suggest_block_size(img.shape, axes, min_overlap, context, memory_budget,
+                                                  n_tiles=(None if isinstance(n_tiles,str) else n_tiles), sparse=kwargs.get('sparse',False))
         block_size, min_overlap, context = list(block_size), list(min_overlap), list(context)
         assert n == len(block_size) == len(min_overlap) == len(context)
 
@@ -808,20 +1354,60 @@ class StarDistBase(BaseModel):
             if c < o:
                 print(f"{a}: context of {c} is small, recommended to use at least {o}", flush=True)
 
+        # estimate global percentiles (in one pass over the image) such that all blocks are normalized identically
+        normalizer = kwargs.get('normalizer')
+        if isinstance(normalizer, StreamingPercentileNormalizer) and not normalizer.fitted:
+            print('estimating percentiles for normalization', flush=True)
+            normalizer.fit(img, axes)
+
+        # foreground pre-scan of the entire image to skip prediction for background blocks/tiles
+        prescan = kwargs.get('prescan')
+        if prescan is not None:
+            isinstance(prescan, ForegroundPrescan) or _raise(ValueError("'prescan' must be a ForegroundPrescan"))
+            if not prescan.fitted:
+                print('pre-scanning image for foreground', flush=True)
+                prescan.fit(img, axes)
+            n_blocks_skipped = n_tiles_skipped = n_tiles_total = 0
+
         # create block cover
         blocks = BlockND.cover(img.shape, axes, block_size, min_overlap, context, grid)
 
         if np.isscalar(labels_out) and bool(labels_out) is False:
             labels_out = None
+            labels_out_dtype = None
+        elif labels_out is not None:
+            labels_out.shape == shape_out or _raise(ValueError(f"'labels_out' must have shape {shape_out} (axes {axes_out})."))
+            labels_out_dtype = labels_out.dtype
+
+        if checkpoint_dir is not None:
+            fingerprint = dict(
+                model = self.__class__.__name__, name = self.name, thresholds = self.thresholds._asdict(),
+                shape = img.shape, dtype = str(img.dtype), axes = axes, block_size = block_size, min_overlap = min_overlap,
+                context = context, filter_mode = filter_mode, labels_out_dtype = None if labels_out_dtype is None else str(np.dtype(labels_out_dtype)),
+                kwargs = {k:v for k,v in kwargs.items() if k not in ('show_tile_progress','verbose')},
+            )
+            checkpoint = BlockCheckpoint(checkpoint_dir, fingerprint)
+            if labels_out is None and labels_out_dtype is not None:
+                labels_out = checkpoint.labels_out(shape_out, labels_out_dtype)
         else:
-            if labels_out is None:
-                labels_out = np.zeros(shape_out, dtype=labels_out_dtype)
-            else:
-                labels_out.shape == shape_out or _raise(ValueError(f"'labels_out' must have shape {shape_out} (axes {axes_out})."))
+            checkpoint = None
 
-        polys_all = {}
+        if labels_out is None and labels_out_dtype is not None:
+            labels_out = np.zeros(shape_out, dtype=labels_out_dtype)
+
+        if isinstance(kwargs.get('n_tiles'), str) and kwargs['n_tiles'] == 'auto':
+            # resolve once (for the largest block) instead of for every block
+            shape_block = tuple(max(s.stop-s.start for s in sl) for sl in zip(*(block.slice_read(axes) for block in blocks)))
+            kwargs['n_tiles'] = self.suggest_n_tiles(shape_block, axes, memory_budget=memory_budget,
+                                                     sparse=kwargs.get('sparse',False), verbose=show_progress)
+
+        polys_all = []
         # problem_ids = []
         label_offset = 1
+        # relabel blocks directly to the data type of the output (if possible)
+        labels_dtype = labels_out.dtype if (labels_out is not None and np.issubdtype(labels_out.dtype, np.integer)) else None
+        # buffer for relabeled blocks (reused for all blocks if the data type changes)
+        labels_buffer = None
 
         kwargs_override = dict(axes=axes, overlap_label=None)
         if show_progress:
@@ -830,15 +1416,52 @@ class StarDistBase(BaseModel):
             if k in kwargs: print(f"changing '{k}' from {kwargs[k]} to {v}", flush=True)
             kwargs[k] = v
 
+        # read blocks (that still need to be processed) ahead of time
+        blocks_todo = [block for block in blocks if checkpoint is None or not checkpoint.is_done(block)]
+        # background blocks (according to the pre-scan) are neither read nor normalized
+        prescan_blocks = {} if prescan is None else {block.id: prescan.crop(block.slice_read(axes), axes) for block in blocks_todo}
+        blocks_background = {i for i,p in prescan_blocks.items() if p.is_background()}
+        reader = iter(BlockReader(img, [block for block in blocks_todo if block.id not in blocks_background],
+                                  axes=axes, **({} if reader_kwargs is None else reader_kwargs)))
+        cleanup.callback(reader.close)
+        # write each chunk of the output only once (if chunked)
+        writer = BlockWriter(labels_out, blocks_todo, axes=axes_out) if labels_out is not None else None
+
         blocks = tqdm(blocks, disable=(not show_progress))
         # actual computation
         for block in blocks:
-            labels, polys = self.predict_instances(block.read(img, axes=axes), **kwargs)
-            labels = block.crop_context(labels, axes=axes_out)
-            labels, polys = block.filter_objects(labels, polys, axes=axes_out)
-            # TODO: relabel_sequential is not very memory-efficient (will allocate memory proportional to label_offset)
-            # this should not change the order of labels
-            labels = relabel_sequential(labels, label_offset)[0]
+            if checkpoint is not None and checkpoint.is_done(block):
+                polys = checkpoint.load(block, label_offset)
+                polys_all.append(polys)
+                label_offset += len(polys['prob'])
+                continue
+
+            if block.id in blocks_background:
+                x, prescan_block = None, prescan_blocks[block.id]
+                labels, polys = self._predict_instances_background(block, return_labels=(filter_mode != 'bbox'), **kwargs)
+            else:
+                with stage('read', blocks=1):
+                    _block, x = next(reader)
+                assert _block is block
+                if prescan is not None:
+                    kwargs['prescan'] = prescan_block = prescan.crop(block.slice_read(axes), axes)
+                labels, polys = self.predict_instances(x, return_labels=(filter_mode != 'bbox'), return_instances=True, **kwargs)
+            if filter_mode == 'bbox':
+                with stage('filter_block'):
+                    labels, polys = block.filter_objects_bbox(polys, axes=axes_out, render=(labels_out is not None))
+            else:
+                with stage('filter_block'):
+                    labels = block.crop_context(labels, axes=axes_out)
+                    labels, polys = block.filter_objects(labels, polys, axes=axes_out)
+            if labels is not None:
+                # this should not change the order of labels
+                with stage('relabel'):
+                    if labels_dtype is not None and labels_dtype != labels.dtype:
+                        if labels_buffer is None or any(b < s for b,s in zip(labels_buffer.shape, labels.shape)):
+                            labels_buffer = np.empty(np.maximum(labels.shape, 0 if labels_buffer is None else labels_buffer.shape), labels_dtype)
+                        labels = relabel_block(labels, label_offset, out=labels_buffer[tuple(slice(0,s) for s in labels.shape)])
+                    else:
+                        labels = relabel_block(labels, label_offset, dtype=labels_dtype)
 
             # labels, fwd_map, _ = relabel_sequential(labels, label_offset)
             # if len(incomplete) > 0:
@@ -846,15 +1469,43 @@ class StarDistBase(BaseModel):
             #     if show_progress:
             #         blocks.set_postfix_str(f"found {len(problem_ids)} problematic {'object' if len(problem_ids)==1 else 'objects'}")
             if labels_out is not None:
-                block.write(labels_out, labels, axes=axes_out)
+                with stage('write'):
+                    blocks_written = writer.write(block, labels)
+            else:
+                blocks_written = [block]
 
-            for k,v in polys.items():
-                polys_all.setdefault(k,[]).append(v)
-                
-            label_offset += len(polys['prob'])
-            del labels 
+            if checkpoint is not None:
+                # only mark blocks as done whose labels are completely written to the output
+                checkpoint.save(block, polys, label_offset, done=False)
+                for _block in blocks_written:
+                    checkpoint.set_done(_block, labels_out)
 
-        polys_all = {k: (np.concatenate(v) if k in OBJECT_KEYS else v[0]) for k,v in polys_all.items()}
+            polys_all.append(polys)
+            label_offset += len(polys['prob'])
+            del labels, x
+
+            if prescan is not None:
+                n_blocks_skipped += int(prescan_block.n_skipped == prescan_block.n_total)
+                n_tiles_skipped  += prescan_block.n_skipped
+                n_tiles_total    += prescan_block.n_total
+                if show_progress:
+                    blocks.set_postfix_str(f"skipped {n_blocks_skipped} background blocks", refresh=False)
+
+        if writer is not None:
+            blocks_written = writer.close()
+            if checkpoint is not None:
+                for _block in blocks_written:
+                    checkpoint.set_done(_block, labels_out)
+        if prescan is not None:
+            prescan.n_skipped += n_tiles_skipped
+            prescan.n_total   += n_tiles_total
+            print(f'pre-scan: skipped {n_blocks_skipped} of {len(blocks_todo)} blocks ({n_tiles_skipped} of {n_tiles_total} tiles) as background', flush=True)
+
+        if all(isinstance(polys, StarDistInstances) for polys in polys_all):
+            polys_all = StarDistInstances.concatenate(polys_all)
+        else:
+            # e.g. resumed from a checkpoint with dictionaries
+            polys_all = {k: (np.concatenate([polys[k] for polys in polys_all]) if k in OBJECT_KEYS else v) for k,v in polys_all[0].items()}
 
         # if labels_out is not None and len(problem_ids) > 0:
         #     # if show_progress:
@@ -865,7 +1516,25 @@ class StarDistBase(BaseModel):
         return labels_out, polys_all#, tuple(problem_ids)
 
 
-    def optimize_thresholds(self, X_val, Y_val, nms_threshs=[0.3,0.4,0.5], iou_threshs=[0.3,0.5,0.7], predict_kwargs=None, optimize_kwargs=None, save_to_json=True):
+    def _predict_instances_background(self, block, axes, return_labels=True, prob_thresh=None, nms_thresh=None, nms_kwargs=None,
+                                      sparse=False, sparse_dist=False, max_candidates=None, dist_dtype=np.float32, **kwargs):
+        # result of predict_instances for a block that is background according to the pre-scan (i.e. no objects),
+        # without reading or normalizing the block (other keyword arguments of predict_instances are irrelevant)
+        shape_inst = tuple(s.stop-s.start for s,a in zip(block.slice_read(axes), axes) if a != 'C')
+        # same data type of distances as for blocks that are predicted (see predict_instances)
+        sparse = sparse or sparse_dist or max_candidates is not None
+        dist_dtype = np.float16 if (not sparse and np.dtype(dist_dtype) == np.float16) else np.float32
+        prob_class = np.zeros((0,self.config.n_classes+1), np.float32) if self._is_multiclass() else None
+        return self._instances_from_prediction(shape_inst, np.zeros(0,np.float32), np.zeros((0,self.config.n_rays),dist_dtype),
+                                               points = np.zeros((0,len(shape_inst)),np.int32),
+                                               prob_class = prob_class,
+                                               prob_thresh=prob_thresh,
+                                               nms_thresh=nms_thresh,
+                                               return_labels=return_labels,
+                                               **({} if nms_kwargs is None else nms_kwargs))
+
+
+    def optimize_thresholds(self, X_val, Y_val, nms_threshs=[0.3,0.4,0.5], iou_threshs=[0.3,0.5,0.7], predict_kwargs=None, optimize_kwargs=None, save_to_json=True, parallel=False, prob_threshs=None):
         """Optimize two thresholds (probability, NMS overlap) necessary for predicting object instances.
 
         Note that the default thresholds yield good results in many cases, but optimizing
@@ -893,6 +1562,16 @@ class StarDistBase(BaseModel):
             (If not provided, will guess value for `n_tiles` to prevent out of memory errors.)
         optimize_kwargs: dict
             Keyword arguments for ``utils.optimize_threshold`` function.
+        parallel: bool
+            Whether to run the optimization for all values of ``nms_threshs`` concurrently.
+            The object instances and matching stats of all images (and ``nms_threshs``) are then computed
+            in a single pool of worker processes (one per CPU core).
+            The result is the same as for sequential optimization; if several ``nms_threshs``
+            achieve the same score, the first one in the list is chosen.
+        prob_threshs : list of float or None
+            If provided, evaluate all combinations of ``prob_threshs`` and ``nms_threshs`` via a joint grid search
+            (see ``utils.optimize_thresholds_grid``) instead of running a separate optimization for each NMS threshold.
+            ``optimize_kwargs`` are then passed to ``utils.optimize_thresholds_grid``.
 
         """
         if predict_kwargs is None:
@@ -909,11 +1588,27 @@ class StarDistBase(BaseModel):
         # only take first two elements of predict in case multi class is activated
         Yhat_val = [self.predict(x, **_predict_kwargs(x))[:2] for x in X_val]
 
-        opt_prob_thresh, opt_measure, opt_nms_thresh = None, -np.inf, None
-        for _opt_nms_thresh in nms_threshs:
-            _opt_prob_thresh, _opt_measure = optimize_threshold(Y_val, Yhat_val, model=self, nms_thresh=_opt_nms_thresh, iou_threshs=iou_threshs, **optimize_kwargs)
-            if _opt_measure > opt_measure:
-                opt_prob_thresh, opt_measure, opt_nms_thresh = _opt_prob_thresh, _opt_measure, _opt_nms_thresh
+        def _optimize(nms_thresh, pool=None):
+            return optimize_threshold(Y_val, Yhat_val, model=self, nms_thresh=nms_thresh, iou_threshs=iou_threshs, pool=pool, **optimize_kwargs)
+
+        if prob_threshs is not None:
+            opt_prob_thresh, opt_nms_thresh, opt_measure, _ = optimize_thresholds_grid(Y_val, Yhat_val, model=self, prob_threshs=prob_threshs, nms_threshs=nms_threshs,
+                                                                                       iou_threshs=iou_threshs, parallel=parallel, **optimize_kwargs)
+            opt_prob_thresh, opt_nms_thresh = float(opt_prob_thresh), float(opt_nms_thresh)
+        else:
+            if parallel:
+                # one thread per nms_thresh only runs the optimization (and waits for results),
+                # all images are processed by a single (shared) pool of worker processes
+                with _matching_pool(Y_val, Yhat_val, self, n_tasks=len(Y_val)*len(nms_threshs)) as pool, \
+                     ThreadPoolExecutor(max_workers=len(nms_threshs)) as searches:
+                    results = list(searches.map(lambda nms_thresh: _optimize(nms_thresh, pool), nms_threshs))
+            else:
+                results = [_optimize(nms_thresh) for nms_thresh in nms_threshs]
+
+            opt_prob_thresh, opt_measure, opt_nms_thresh = None, -np.inf, None
+            for _opt_nms_thresh, (_opt_prob_thresh, _opt_measure) in zip(nms_threshs, results):
+                if _opt_measure > opt_measure:
+                    opt_prob_thresh, opt_measure, opt_nms_thresh = _opt_prob_thresh, _opt_measure, _opt_nms_thresh
         opt_threshs = dict(prob=opt_prob_thresh, nms=opt_nms_thresh)
 
         self.thresholds = opt_threshs
@@ -937,6 +1632,218 @@ class StarDistBase(BaseModel):
         return tuple(n_tiles)
 
 
+    def _network_memory(self, shape):
+        """Estimate peak memory (bytes) of all network activations for an input of spatial 'shape' (config axes).
+
+        Walks through the layers of the keras model (in topological order) and keeps track of
+        all tensors that are still needed by subsequent layers.
+        """
+        # graph structure from the (serialized) model config, i.e. without relying on private keras attributes
+        config = self.keras_model.get_config()
+        names = set(l['name'] for l in config['layers'])
+        def _layer_names(node):
+            # names of layers referenced in (nested) inbound node specification
+            if isinstance(node, str):
+                return [node] if node in names else []
+            values = node.values() if isinstance(node, dict) else node if isinstance(node, (list,tuple)) else ()
+            return list(dict.fromkeys(n for v in values for n in _layer_names(v)))
+
+        layers_dict = {l.name:l for l in self.keras_model.layers}
+        layers = [layers_dict[l['name']] for l in config['layers']]
+        inbound_dict = {l['name']: [layers_dict[n] for n in _layer_names(l['inbound_nodes'])] for l in config['layers']}
+        outputs = set(_layer_names(config['output_layers']))
+        n_consumers = {l.name:0 for l in layers}
+        for l in layers:
+            for i in inbound_dict[l.name]:
+                n_consumers[i.name] += 1
+
+        shape = np.asarray(shape, np.float64)
+        factor, nbytes = {}, {}
+        live = peak = 0
+        for l in layers:
+            inbound = inbound_dict[l.name]
+            # cumulative downsampling factor (per spatial axis) of this layer's output
+            f = factor[inbound[0].name] if len(inbound) > 0 else np.ones(len(shape))
+            if 'Pooling' in type(l).__name__ and hasattr(l, 'pool_size'):
+                f = f * np.asarray(l.strides if l.strides is not None else l.pool_size)
+            elif 'UpSampling' in type(l).__name__:
+                f = f / np.asarray(l.size)
+            elif hasattr(l, 'strides') and hasattr(l, 'kernel_size'):
+                f = f * np.asarray(l.strides)
+            factor[l.name] = f
+            output = l.output[0] if isinstance(l.output, (list,tuple)) else l.output
+            itemsize = np.dtype(getattr(l, 'compute_dtype', None) or 'float32').itemsize
+            nbytes[l.name] = int(np.prod(np.ceil(shape / f))) * int(output.shape[-1]) * itemsize
+            live += nbytes[l.name]
+            peak = max(peak, live)
+            # free inputs that are no longer needed
+            for i in inbound:
+                n_consumers[i.name] -= 1
+                if n_consumers[i.name] == 0 and i.name not in outputs:
+                    live -= nbytes[i.name]
+        return peak
+
+
+    def estimate_memory(self, img_shape, axes=None, n_tiles=None, sparse=False, candidate_fraction=0.05, prob_dtype=np.float32, dist_dtype=np.float32):
+        """Estimate peak memory required by `predict_instances` for an image of a given shape.
+
+        The estimate is composed of the normalized/padded input image, the network activations
+        (for a single tile), the (dense) predicted probabilities and distances, the object candidates
+        considered by non-maximum suppression, and the label image. Note that the result is only a rough estimate.
+
+        Parameters
+        ----------
+        img_shape : tuple
+            Shape of the input image.
+        axes : str or None
+            Axes of the input image (see ``predict``).
+        n_tiles : iterable or None
+            Number of tiles for every image axis (see ``predict``).
+        sparse : bool
+            Whether sparse prediction is used (see ``predict_instances``),
+            which avoids dense probability/distance outputs for the entire image.
+        candidate_fraction : float
+            Assumed fraction of (grid) pixels above the probability threshold,
+            i.e. which are object candidates for non-maximum suppression.
+        prob_dtype, dist_dtype : numpy dtype
+            Data types to store the dense probabilities and distances in (see ``predict``).
+            Without tiling, the float32 network outputs are additionally accounted for during prediction.
+
+        Returns
+        -------
+        dict
+            Estimated memory in bytes of 'image', 'network', 'outputs', 'candidates', 'labels', and their peak 'total'.
+
+        """
+        img_shape = tuple(int(s) for s in img_shape)
+        axes = self._normalize_axes(np.broadcast_to(np.float32(0), img_shape), axes)
+        n_tiles = (1,)*len(img_shape) if n_tiles is None else tuple(n_tiles)
+        len(n_tiles) == len(img_shape) or _raise(ValueError("n_tiles must be an iterable of length %d" % len(img_shape)))
+        axes_net = self.config.axes.replace('C','')
+        shape_dict, tiles_dict = dict(zip(axes,img_shape)), dict(zip(axes,n_tiles))
+        shape = np.array([shape_dict.get(a,1) for a in axes_net])
+        n_tiles = np.array([tiles_dict.get(a,1) for a in axes_net])
+        div_by = np.array(self._axes_div_by(axes_net))
+        grid = np.array(self.config.grid)
+        itemsize = np.dtype(np.float32).itemsize
+
+        # padded image and tile shape (see csbdeep.internals.predict.tile_iterator)
+        shape_pad = div_by * np.ceil(shape / div_by).astype(int)
+        n_blocks_overlap = np.ceil(np.array(self._axes_tile_overlap(axes_net)) / div_by).astype(int)
+        n_blocks_tile = np.ceil(shape_pad / div_by / n_tiles).astype(int)
+        shape_tile = np.where(n_tiles > 1, np.minimum(shape_pad, div_by * (n_blocks_tile + 2*n_blocks_overlap)), shape_pad)
+
+        n_classes_out = self.config.n_classes + 1 if self._is_multiclass() else 0
+        n_candidates = int(np.ceil(candidate_fraction * np.prod(shape / grid)))
+        n_dim, n_rays = self.config.n_dim, self.config.n_rays
+
+        mem = dict(
+            # normalized and padded image (and tile)
+            image      = itemsize * self.config.n_channel_in * (int(np.prod(shape)) + int(np.prod(shape_pad)) +
+                                                               (int(np.prod(shape_tile)) if np.any(n_tiles > 1) else 0)),
+            network    = self._network_memory(shape_tile),
+            # dense prob/dist/prob_class outputs
+            outputs    = 0 if sparse else int(np.prod(shape_pad // grid)) * (np.dtype(prob_dtype).itemsize + np.dtype(dist_dtype).itemsize*n_rays + itemsize*n_classes_out),
+            # prob/dist/points of candidates (and sorted copies), and their polygon/polyhedron vertices
+            candidates = n_candidates * (2*(itemsize*(1+n_rays) + 8*n_dim) + itemsize*n_dim*n_rays),
+            labels     = np.dtype(np.int32).itemsize * int(np.prod(shape)),
+        )
+        # without tiling, the outputs are only converted to reduced precision after prediction (float32 network outputs)
+        outputs_float32 = 0 if sparse or np.any(n_tiles > 1) or (np.dtype(prob_dtype) == np.dtype(dist_dtype) == np.float32) else \
+                          int(np.prod(shape_pad // grid)) * itemsize * (1 + n_rays + n_classes_out)
+        # prediction and postprocessing phases
+        mem['total'] = max(mem['image'] + mem['network'] + mem['outputs'] + outputs_float32,
+                           mem['outputs'] + mem['candidates'] + mem['labels'])
+        return mem
+
+
+    def _suggest_block_size(self, img_shape, axes, min_overlap, context, memory_budget=None, n_tiles=None, sparse=False, verbose=True):
+        """Largest (isotropic) block size for `predict_instances_big` whose estimated memory fits into the budget"""
+        if memory_budget is None:
+            memory_budget = _available_memory() // 2
+        axes = axes_check_and_normalize(axes, len(img_shape))
+        step = max(self._axes_div_by(axes))
+        # smallest valid block size for each axis
+        size_min = [s if a == 'C' else min(s, o + 2*c + step) for s,a,o,c in zip(img_shape,axes,min_overlap,context)]
+
+        def _block_shape(b):
+            return tuple(s if a == 'C' else min(s, max(b, s_min)) for s,a,s_min in zip(img_shape,axes,size_min))
+        def _memory(b):
+            shape = _block_shape(b)
+            # block of the input image (read ahead of time) and of the label image
+            mem = self.estimate_memory(shape, axes, n_tiles, sparse=sparse)
+            return mem['total'] + int(np.prod(shape)) * np.dtype(np.float32).itemsize, mem
+
+        lo, hi = 1, int(np.ceil(max(s for s,a in zip(img_shape,axes) if a != 'C') / step))
+        if _memory(lo*step)[0] > memory_budget:
+            hi = lo
+        # binary search for largest block size (multiple of step) that fits into the budget
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if _memory(mid*step)[0] <= memory_budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        block_size = _block_shape(lo*step)
+        total, mem = _memory(lo*step)
+        if total > memory_budget:
+            warnings.warn(f"estimated memory of {total/2**30:.2f} GiB for smallest block size exceeds memory budget of {memory_budget/2**30:.2f} GiB")
+        if verbose:
+            print(f"estimated memory for block_size={block_size}: {total/2**30:.2f} GiB (" +
+                  ", ".join(f"{k}: {v/2**30:.2f}" for k,v in mem.items() if k != 'total') + ")", flush=True)
+        return list(block_size)
+
+
+    def suggest_n_tiles(self, img_shape, axes=None, memory_budget=None, sparse=False, verbose=True, **kwargs):
+        """Suggest number of tiles such that the estimated memory (see ``estimate_memory``) fits into a given budget.
+
+        Tiles are added along the axis with the largest tile size until the estimated memory fits into 'memory_budget'
+        (in bytes, by default half of the currently available system memory). Note that only the memory of
+        the network activations is reduced by tiling, hence `predict_instances_big` may be required for very large images.
+        Additional 'kwargs' are passed to ``estimate_memory``.
+
+        Returns
+        -------
+        tuple
+            Number of tiles for every image axis.
+
+        """
+        if memory_budget is None:
+            memory_budget = _available_memory() // 2
+        img_shape = tuple(int(s) for s in img_shape)
+        axes = self._normalize_axes(np.broadcast_to(np.float32(0), img_shape), axes)
+        axes_net = self.config.axes.replace('C','')
+        div_by = dict(zip(axes, self._axes_div_by(axes)))
+        overlap = dict(zip(axes, self._axes_tile_overlap(axes)))
+
+        def _tile_size(a, n):
+            n_blocks = int(np.ceil(img_shape[axes.index(a)] / div_by[a]))
+            return min(n_blocks, int(np.ceil(n_blocks/n)) + 2*int(np.ceil(overlap[a]/div_by[a]))) if n > 1 else n_blocks
+
+        n_tiles, tried = [1]*len(axes), []
+        while True:
+            mem = self.estimate_memory(img_shape, axes, n_tiles, sparse=sparse, **kwargs)
+            tried.append((tuple(n_tiles), mem))
+            if mem['total'] <= memory_budget:
+                break
+            # add a tile along the axis with the largest tile size (if this reduces its size)
+            candidates = [(_tile_size(a,n), i) for i,(a,n) in enumerate(zip(axes,n_tiles))
+                          if a in axes_net and _tile_size(a,n+1) < _tile_size(a,n)]
+            if len(candidates) == 0:
+                # budget can't be met: use fewest tiles that (almost) achieve the lowest memory
+                total_min = min(m['total'] for _,m in tried)
+                n_tiles, mem = next((t,m) for t,m in tried if m['total'] <= 1.1*total_min)
+                warnings.warn(f"estimated memory of {mem['total']/2**30:.2f} GiB exceeds memory budget of {memory_budget/2**30:.2f} GiB"
+                              + (", consider using 'predict_instances_big'" if mem['network'] < mem['total']/2 else ""))
+                break
+            n_tiles[max(candidates)[1]] += 1
+
+        if verbose:
+            print(f"estimated memory for n_tiles={tuple(n_tiles)}: {mem['total']/2**30:.2f} GiB (" +
+                  ", ".join(f"{k}: {v/2**30:.2f}" for k,v in mem.items() if k != 'total') + ")", flush=True)
+        return tuple(n_tiles)
+
+
     def _normalize_axes(self, img, axes):
         if axes is None:
             axes = self.config.axes
@@ -971,12 +1878,48 @@ class StarDistBase(BaseModel):
         return [(m-np.min(i), np.max(i)-m) for (m,i) in zip(mid,ind)]
 
 
+    def _weights_hash(self):
+        h = hashlib.sha1()
+        for w in self.keras_model.get_weights():
+            h.update(str((w.shape,w.dtype.str)).encode())
+            h.update(np.ascontiguousarray(w).tobytes())
+        return h.hexdigest()
+
+
+    def _receptive_field_cached(self):
+        """Receptive field (see `_compute_receptive_field`) that is cached in the model directory.
+
+        The cache file 'receptive_field.json' is only used if it was computed for the current model weights.
+        Note that it is also written for read-only models (``basedir=None``), e.g. pretrained models.
+        """
+        logdir = getattr(self, 'logdir', None)
+        fname = None if (logdir is None or not logdir.is_dir()) else logdir / 'receptive_field.json'
+        if fname is None:
+            return [tuple(int(r) for r in rf) for rf in self._compute_receptive_field()]
+        # hashing all weights is only worth it to read or write the cache file
+        weights_hash = self._weights_hash()
+        if fname.exists():
+            try:
+                cache = load_json(str(fname))
+                if cache['weights_hash'] == weights_hash:
+                    return [tuple(rf) for rf in cache['receptive_field']]
+            except (ValueError, KeyError, TypeError):
+                pass
+        receptive_field = [tuple(int(r) for r in rf) for rf in self._compute_receptive_field()]
+        try:
+            save_json(dict(weights_hash=weights_hash, receptive_field=receptive_field), str(fname))
+        except OSError:
+            # e.g. read-only model directory
+            pass
+        return receptive_field
+
+
     def _axes_tile_overlap(self, query_axes):
         query_axes = axes_check_and_normalize(query_axes)
         try:
             self._tile_overlap
         except AttributeError:
-            self._tile_overlap = self._compute_receptive_field()
+            self._tile_overlap = self._receptive_field_cached()
         overlap = dict(zip(
             self.config.axes.replace('C',''),
             tuple(max(rf) for rf in self._tile_overlap)
@@ -1029,6 +1972,57 @@ class StarDistBase(BaseModel):
         return csbdeep_model
 
 
+    def export_TF_candidates(self, fname=None, prob_thresh=None, b=2, max_candidates=None):
+        """Export model with in-graph selection of object candidates to TensorFlow's SavedModel format
+
+        The exported model includes thresholding of the object probabilities, exclusion of the image border,
+        and (optionally) keeping only the candidates with the highest probabilities (see ``predict_sparse``).
+        Its serving signature maps a single (normalized) input image of shape ``(1,...,n_channel_in)`` with spatial
+        dimensions that are divisible by the network (see ``_axes_div_by``) to the candidate tensors ``points``
+        (pixel coordinates), ``prob``, ``dist`` (and ``prob_class``), i.e. exactly the inputs of non-maximum suppression.
+
+        Parameters
+        ----------
+        fname : str
+            Path of the zip file to store the model
+            If None, the default path "<modeldir>/TF_SavedModel_candidates.zip" is used
+        prob_thresh : float or None
+            Probability threshold of object candidates (default: ``self.thresholds.prob``).
+        b : int or None
+            Exclude candidates within this distance (in units of the grid) of the image border.
+        max_candidates : int or None
+            If not None, only keep that many candidates with the highest probabilities.
+        """
+        import shutil, tempfile
+        if self.basedir is None and fname is None:
+            raise ValueError("Need explicit 'fname', since model directory not available (basedir=None).")
+        if prob_thresh is None: prob_thresh = self.thresholds.prob
+        b = 0 if b is None else int(b)
+
+        candidates = self._candidates_function(max_candidates)
+        grid = tf.constant(self.config.grid, tf.int64)
+        input_spec = tf.TensorSpec((1,)+(None,)*self.config.n_dim+(self.config.n_channel_in,), tf.float32, name='input')
+
+        @tf.function(input_signature=[input_spec])
+        def serve(x):
+            shape = tf.shape(x)[1:-1] // tf.constant(self.config.grid, tf.int32)
+            points, prob, dist, *rest = candidates(x, tf.constant(prob_thresh, tf.float32), tf.fill([self.config.n_dim], b), shape-b)
+            outputs = dict(points=points*grid, prob=prob, dist=dist)
+            if self._is_multiclass():
+                outputs['prob_class'] = rest[0]
+            return outputs
+
+        module = tf.Module()
+        module.keras_model, module.serve = self.keras_model, serve
+
+        fname = (self.logdir / 'TF_SavedModel_candidates.zip') if fname is None else Path(fname)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpsubdir = str(Path(tmpdir) / 'model')
+            tf.saved_model.save(module, tmpsubdir, signatures=serve)
+            fname = Path(shutil.make_archive(str(fname)[:-4] if fname.suffix == '.zip' else str(fname), 'zip', tmpsubdir))
+        return fname
+
+
 
 class StarDistPadAndCropResizer(Resizer):
 
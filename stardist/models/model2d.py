@@ -22,8 +22,8 @@ Model = keras_import('models', 'Model')
 from .base import StarDistBase, StarDistDataBase
 from ..sample_patches import sample_patches
 from ..utils import edt_prob, _normalize_grid, mask_to_categorical
-from ..geometry import star_dist, dist_to_coord, polygons_to_label
-from ..nms import non_maximum_suppression, non_maximum_suppression_sparse
+from ..geometry import star_dist
+from ..postprocess import instances_from_prediction
 
 
 class StarDistData2D(StarDistDataBase):
@@ -493,7 +493,7 @@ class StarDist2D(StarDistBase):
             
         return labels, res_dict
 
-    def _instances_from_prediction(self, img_shape, prob, dist,points = None, prob_class = None,  prob_thresh=None, nms_thresh=None, overlap_label = None, return_labels = True,  **nms_kwargs):
+    def _instances_from_prediction(self, img_shape, prob, dist,points = None, prob_class = None,  prob_thresh=None, nms_thresh=None, overlap_label = None, return_labels = True, workspace = None, dist_scale = None, **nms_kwargs):
         """ 
         if points is None     -> dense prediction 
         if points is not None -> sparse prediction 
@@ -503,45 +503,9 @@ class StarDist2D(StarDistBase):
         """
         if prob_thresh is None: prob_thresh = self.thresholds.prob
         if nms_thresh  is None: nms_thresh  = self.thresholds.nms
-        if overlap_label is not None: raise NotImplementedError("overlap_label not supported for 2D yet!")
-
-        # sparse prediction
-        if points is not None:
-            points, probi, disti, indsi = non_maximum_suppression_sparse(dist, prob, points,
-                                                                  nms_thresh=nms_thresh,
-                                                                  **nms_kwargs)
-            if prob_class is not None:
-                prob_class = prob_class[indsi]
-
-        # dense prediction 
-        else:
-            # TODO: grid is axes_net order, but must be in axes order because dist and prob are in axes order (?)
-            points, probi, disti = non_maximum_suppression(dist, prob,
-                                                           grid=self.config.grid,
-                                                           prob_thresh=prob_thresh,
-                                                           nms_thresh=nms_thresh,
-                                                           **nms_kwargs)
-            if prob_class is not None:
-                inds = tuple(p//g for p,g in zip(points.T, self.config.grid))
-                prob_class = prob_class[inds]
-
-        if return_labels:
-            labels = polygons_to_label(disti, points, prob = probi, shape=img_shape)
-        else:
-            labels = None
-            
-            
-        coord = dist_to_coord(disti, points)
-        res_dict = dict(coord=coord, points=points, prob=probi)
-
-        # multi class prediction
-        if prob_class is not None:            
-            prob_class = np.asarray(prob_class)
-            class_id = np.argmax(prob_class, axis = -1)            
-            res_dict.update(dict(class_prob = prob_class, class_id = class_id))
-            
-            
-        return labels, res_dict  
+        return instances_from_prediction(img_shape, prob, dist, self.config.grid, points=points, prob_class=prob_class,
+                                         prob_thresh=prob_thresh, nms_thresh=nms_thresh, overlap_label=overlap_label,
+                                         return_labels=return_labels, workspace=workspace, dist_scale=dist_scale, **nms_kwargs)
     
 
     def _axes_div_by(self, query_axes):
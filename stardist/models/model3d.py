@@ -21,10 +21,9 @@ Model = keras_import('models', 'Model')
 from .base import StarDistBase, StarDistDataBase
 from ..sample_patches import sample_patches
 from ..utils import edt_prob, _normalize_grid, mask_to_categorical
-from ..matching import relabel_sequential
-from ..geometry import star_dist3D, polyhedron_to_label
+from ..geometry import star_dist3D
 from ..rays3d import Rays_GoldenSpiral, rays_from_json
-from ..nms import non_maximum_suppression_3d, non_maximum_suppression_3d_sparse
+from ..postprocess import instances_from_prediction
 
 
 
@@ -570,7 +569,7 @@ class StarDist3D(StarDistBase):
         return history
 
 
-    def _instances_from_prediction(self, img_shape, prob, dist,  points = None, prob_class = None, prob_thresh=None, nms_thresh=None, overlap_label=None, return_labels = True, **nms_kwargs):
+    def _instances_from_prediction(self, img_shape, prob, dist,  points = None, prob_class = None, prob_thresh=None, nms_thresh=None, overlap_label=None, return_labels = True, workspace = None, dist_scale = None, **nms_kwargs):
         """
         if points is None     -> dense prediction
         if points is not None -> sparse prediction
@@ -582,72 +581,10 @@ class StarDist3D(StarDistBase):
         if prob_thresh is None: prob_thresh = self.thresholds.prob
         if nms_thresh  is None: nms_thresh  = self.thresholds.nms
 
-        rays = rays_from_json(self.config.rays_json)
-
-        # if points is given, assume sparse prediction (else dense)
-        if points is not None:
-            points, probi, disti, indsi = non_maximum_suppression_3d_sparse(dist, prob,
-                                                                     points,  rays,
-                                                                     nms_thresh=nms_thresh,
-                                                                     **nms_kwargs)
-            if prob_class is not None:
-                prob_class = prob_class[indsi]
-            
-        else:
-            points, probi, disti = non_maximum_suppression_3d(dist, prob, rays,
-                                                          grid=self.config.grid,
-                                                          prob_thresh=prob_thresh,
-                                                          nms_thresh=nms_thresh,
-                                                          **nms_kwargs)
-            if prob_class is not None:
-                inds = tuple(p//g for p,g in zip(points.T, self.config.grid))
-                prob_class = prob_class[inds]
-
-        verbose = nms_kwargs.get('verbose',False)
-        verbose and print("render polygons...")
-
-        if return_labels:
-            labels = polyhedron_to_label(disti, points, rays=rays, prob=probi, shape=img_shape, overlap_label=overlap_label, verbose=verbose)
-
-            # map the overlap_label to something positive and back
-            # (as relabel_sequential doesn't like negative values)
-            if overlap_label is not None and overlap_label<0 and (overlap_label in labels):
-                overlap_mask = (labels == overlap_label)
-                overlap_label2 = max(set(np.unique(labels))-{overlap_label})+1
-                labels[overlap_mask] = overlap_label2
-                labels, fwd, bwd = relabel_sequential(labels)
-                labels[labels == fwd[overlap_label2]] = overlap_label
-            else:
-                labels, _,_ = relabel_sequential(labels)
-        else:
-            labels = None
-            
-        res_dict = dict(dist=disti, points=points, prob=probi, rays=rays,
-                            rays_vertices = rays.vertices,rays_faces=rays.faces)
-            
-        if prob_class is not None:
-            # build the list of class ids per label via majority vote
-            # zoom prob_class to img_shape
-            # prob_class_up = zoom(prob_class,
-            #                      tuple(s2/s1 for s1, s2 in zip(prob_class.shape[:3], img_shape))+(1,),
-            #                      order=0)
-            # class_id, label_ids = [], []
-            # for reg in regionprops(labels):
-            #     m = labels[reg.slice]==reg.label
-            #     cls_id = np.argmax(np.mean(prob_class_up[reg.slice][m], axis = 0))
-            #     class_id.append(cls_id)
-            #     label_ids.append(reg.label)
-            # # just a sanity check whether labels where in sorted order
-            # assert all(x <= y for x,y in zip(label_ids, label_ids[1:]))
-            # res_dict.update(dict(classes = class_id))
-            # res_dict.update(dict(labels = label_ids))
-            # self.p = prob_class_up
-           
-            prob_class = np.asarray(prob_class)
-            class_id = np.argmax(prob_class, axis = -1)            
-            res_dict.update(dict(class_prob = prob_class, class_id = class_id))
-            
-        return labels, res_dict
+        return instances_from_prediction(img_shape, prob, dist, self.config.grid, rays=rays_from_json(self.config.rays_json),
+                                         points=points, prob_class=prob_class, prob_thresh=prob_thresh, nms_thresh=nms_thresh,
+                                         overlap_label=overlap_label, return_labels=return_labels, workspace=workspace,
+                                         dist_scale=dist_scale, **nms_kwargs)
 
 
 
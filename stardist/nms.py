@@ -1,19 +1,52 @@
 from __future__ import print_function, unicode_literals, absolute_import, division
 import numpy as np
 from time import time
+from csbdeep.utils import _raise
 from .utils import _normalize_grid
 
+
+# dense prob/dist can be stored with reduced precision (see StarDistBase.predict): float16, or
+# unsigned integers as fixed-point numbers with an explicit scale, i.e. value = stored value / scale
+# (probabilities as uint8 always use scale 255, distances as uint8/uint16 need 'dist_scale')
+_PROB_UINT8_SCALE = 255
+
+def _to_storage_dtype(x, dtype, scale=None):
+    dtype = np.dtype(dtype)
+    if x.dtype == dtype:
+        return x
+    if np.issubdtype(dtype, np.integer):
+        scale is not None or _raise(ValueError("scale required to store values as %s" % dtype))
+        # values outside the representable range saturate
+        return np.clip(np.round(x*np.float32(scale)), 0, np.iinfo(dtype).max).astype(dtype)
+    return x.astype(dtype, copy=False)
+
+def _from_storage_dtype(x, scale=None):
+    # only applied to candidates, i.e. never to the entire prob/dist arrays
+    if np.issubdtype(x.dtype, np.integer):
+        scale is not None or _raise(ValueError("scale required for values stored as %s" % x.dtype))
+        return x.astype(np.float32) / np.float32(scale)
+    if x.dtype == np.float16:
+        return x.astype(np.float32)
+    return x
+
+
 def _ind_prob_thresh(prob, prob_thresh, b=2):
     if b is not None and np.isscalar(b):
         b = ((b,b),)*prob.ndim
 
+    if prob.dtype == np.uint8:
+        prob_thresh = prob_thresh * _PROB_UINT8_SCALE
     ind_thresh = prob > prob_thresh
     if b is not None:
-        _ind_thresh = np.zeros_like(ind_thresh)
-        ss = tuple(slice(_bs[0] if _bs[0]>0 else None,
-                         -_bs[1] if _bs[1]>0 else None)  for _bs in b)
-        _ind_thresh[ss] = True
-        ind_thresh &= _ind_thresh
+        # exclude border in-place (avoids allocating another mask)
+        for axis, _bs in enumerate(b):
+            ss = [slice(None)]*prob.ndim
+            if _bs[0]>0:
+                ss[axis] = slice(None,_bs[0])
+                ind_thresh[tuple(ss)] = False
+            if _bs[1]>0:
+                ss[axis] = slice(-_bs[1],None)
+                ind_thresh[tuple(ss)] = False
     return ind_thresh
 
 
@@ -75,7 +108,7 @@ def _non_maximum_suppression_old(coord, prob, grid=(1,1), b=2, nms_thresh=0.5, p
 
 
 def non_maximum_suppression(dist, prob, grid=(1,1), b=2, nms_thresh=0.5, prob_thresh=0.5,
-                            use_bbox=True, use_kdtree=True, verbose=False):
+                            use_bbox=True, use_kdtree=True, verbose=False, dist_scale=None):
     """Non-Maximum-Supression of 2D polygons
 
     Retains only polygons whose overlap is smaller than nms_thresh
@@ -83,6 +116,10 @@ def non_maximum_suppression(dist, prob, grid=(1,1), b=2, nms_thresh=0.5, prob_th
     dist.shape = (Ny,Nx, n_rays)
     prob.shape = (Ny,Nx)
 
+    prob and dist may be stored with reduced precision (see StarDistBase.predict),
+    only the candidates are converted to float32. If dist is stored as unsigned integers,
+    dist_scale is required (dist = stored dist / dist_scale).
+
     returns the retained points, probabilities, and distances:
 
     points, prob, dist = non_maximum_suppression(dist, prob, ....
@@ -107,8 +144,8 @@ def non_maximum_suppression(dist, prob, grid=(1,1), b=2, nms_thresh=0.5, prob_th
     mask = _ind_prob_thresh(prob, prob_thresh, b)
     points = np.stack(np.where(mask), axis=1)
 
-    dist   = dist[mask]
-    scores = prob[mask]
+    dist   = _from_storage_dtype(dist[mask], dist_scale)
+    scores = _from_storage_dtype(prob[mask], _PROB_UINT8_SCALE)
 
     # sort scores descendingly
     ind = np.argsort(scores)[::-1]
@@ -230,7 +267,7 @@ def non_maximum_suppression_inds(dist, points, scores, thresh=0.5, use_bbox=True
 #########
 
 
-def non_maximum_suppression_3d(dist, prob, rays, grid=(1,1,1), b=2, nms_thresh=0.5, prob_thresh=0.5, use_bbox=True, use_kdtree=True, verbose=False):
+def non_maximum_suppression_3d(dist, prob, rays, grid=(1,1,1), b=2, nms_thresh=0.5, prob_thresh=0.5, use_bbox=True, use_kdtree=True, verbose=False, dist_scale=None):
     """Non-Maximum-Supression of 3D polyhedra
 
     Retains only polyhedra whose overlap is smaller than nms_thresh
@@ -238,6 +275,8 @@ def non_maximum_suppression_3d(dist, prob, rays, grid=(1,1,1), b=2, nms_thresh=0
     dist.shape = (Nz,Ny,Nx, n_rays)
     prob.shape = (Nz,Ny,Nx)
 
+    prob and dist may be stored with reduced precision (see non_maximum_suppression).
+
     returns the retained points, probabilities, and distances:
 
     points, prob, dist = non_maximum_suppression_3d(dist, prob, ....
@@ -263,8 +302,8 @@ def non_maximum_suppression_3d(dist, prob, rays, grid=(1,1,1), b=2, nms_thresh=0
     ind_thresh = _ind_prob_thresh(prob, prob_thresh, b)
     points = np.stack(np.where(ind_thresh), axis=1)
     verbose and print("found %s candidates"%len(points))
-    probi = prob[ind_thresh]
-    disti = dist[ind_thresh]
+    probi = _from_storage_dtype(prob[ind_thresh], _PROB_UINT8_SCALE)
+    disti = _from_storage_dtype(dist[ind_thresh], dist_scale)
 
     _sorted = np.argsort(probi)[::-1]
     probi = probi[_sorted]
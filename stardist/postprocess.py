@@ -0,0 +1,123 @@
+"""Post-processing of the neural network outputs, i.e. non-maximum suppression and rendering of the label image.
+
+Doesn't depend on the neural network (nor imports TensorFlow), hence worker processes that only do post-processing
+need the grid, thresholds, and rays of a model (see :func:`postprocess_params`) instead of a model instance.
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+from csbdeep.utils import _raise
+
+from .nms import non_maximum_suppression, non_maximum_suppression_sparse, non_maximum_suppression_3d, non_maximum_suppression_3d_sparse
+from .geometry import polygons_to_label, polyhedron_to_label
+from .matching import relabel_sequential
+from .rays3d import rays_from_json
+from .profiling import stage
+from .instances import StarDistInstances
+
+
+
+def instances_from_prediction(img_shape, prob, dist, grid, rays=None, points=None, prob_class=None, prob_thresh=None, nms_thresh=None,
+                              overlap_label=None, return_labels=True, workspace=None, dist_scale=None, **nms_kwargs):
+    """Object instances (label image and :class:`stardist.instances.StarDistInstances`) from the outputs of the neural network.
+
+    if rays is None       -> 2D (polygons), else 3D (polyhedra)
+
+    if points is None     -> dense prediction
+    if points is not None -> sparse prediction
+
+    if prob_class is None     -> single class prediction
+    if prob_class is not None -> multi  class prediction
+    """
+    prob_thresh is not None or _raise(ValueError("prob_thresh must be given"))
+    nms_thresh  is not None or _raise(ValueError("nms_thresh must be given"))
+    if rays is None and overlap_label is not None: raise NotImplementedError("overlap_label not supported for 2D yet!")
+
+    with stage('nms') as _stage:
+        # sparse prediction
+        if points is not None:
+            _stage.add(candidates=len(points))
+            if rays is None:
+                points, probi, disti, indsi = non_maximum_suppression_sparse(dist, prob, points,
+                                                                             nms_thresh=nms_thresh, **nms_kwargs)
+            else:
+                points, probi, disti, indsi = non_maximum_suppression_3d_sparse(dist, prob, points, rays,
+                                                                                nms_thresh=nms_thresh, **nms_kwargs)
+            if prob_class is not None:
+                prob_class = prob_class[indsi]
+
+        # dense prediction
+        else:
+            # TODO: grid is axes_net order, but must be in axes order because dist and prob are in axes order (?)
+            if rays is None:
+                points, probi, disti = non_maximum_suppression(dist, prob, grid=grid,
+                                                               prob_thresh=prob_thresh, nms_thresh=nms_thresh,
+                                                               dist_scale=dist_scale, **nms_kwargs)
+            else:
+                points, probi, disti = non_maximum_suppression_3d(dist, prob, rays, grid=grid,
+                                                                  prob_thresh=prob_thresh, nms_thresh=nms_thresh,
+                                                                  dist_scale=dist_scale, **nms_kwargs)
+            if prob_class is not None:
+                inds = tuple(p//g for p,g in zip(points.T, grid))
+                prob_class = prob_class[inds]
+        _stage.add(objects=len(points))
+
+    if not return_labels:
+        labels = None
+    elif rays is None:
+        with stage('render', objects=len(points)):
+            labels_out = None if workspace is None else workspace.get('labels', img_shape, np.int32)
+            labels = polygons_to_label(disti, points, prob=probi, shape=img_shape, out=labels_out)
+    else:
+        verbose = nms_kwargs.get('verbose',False)
+        verbose and print("render polygons...")
+        # label image is allocated by c_polyhedron_to_label, hence not taken from workspace
+        with stage('render', objects=len(points)):
+            labels = polyhedron_to_label(disti, points, rays=rays, prob=probi, shape=img_shape, overlap_label=overlap_label, verbose=verbose)
+
+        # map the overlap_label to something positive and back
+        # (as relabel_sequential doesn't like negative values)
+        with stage('relabel'):
+            if overlap_label is not None and overlap_label<0 and (overlap_label in labels):
+                overlap_mask = (labels == overlap_label)
+                overlap_label2 = max(set(np.unique(labels))-{overlap_label})+1
+                labels[overlap_mask] = overlap_label2
+                labels, fwd, bwd = relabel_sequential(labels)
+                labels[labels == fwd[overlap_label2]] = overlap_label
+            else:
+                labels, _,_ = relabel_sequential(labels)
+
+    # coordinates are only computed on demand, class ids are derived from prob_class (multi class prediction)
+    res = StarDistInstances(points, probi, disti, class_prob=prob_class, rays=rays,
+                            dist_dtype=(np.float16 if np.asarray(dist).dtype == np.float16 else np.float32))
+
+    return labels, res
+
+
+def postprocess_params(model):
+    """Parameters of :func:`instances_from_prediction` for ``model`` (as picklable values that don't require TensorFlow)."""
+    return dict(grid       = tuple(model.config.grid),
+                thresholds = dict(model.thresholds._asdict()),
+                rays_json  = (model.config.rays_json if model.config.n_dim == 3 else None))
+
+
+
+# post-processing in worker processes: parameters of every model (by name), see _init_worker
+_worker_params = {}
+
+def _init_worker(params):
+    """Initializer of worker processes, ``params`` maps model names to :func:`postprocess_params` (use name None for a single model)."""
+    _worker_params.clear()
+    for name, p in params.items():
+        _worker_params[name] = dict(grid       = tuple(p['grid']),
+                                    thresholds = dict(p['thresholds']),
+                                    rays       = (None if p['rays_json'] is None else rays_from_json(p['rays_json'])))
+
+def _instances_from_prediction_worker(img_shape, prob, dist, model=None, prob_thresh=None, nms_thresh=None, **kwargs):
+    """Same as ``StarDistBase._instances_from_prediction`` for the model with given name in a worker process."""
+    p = _worker_params[model]
+    if prob_thresh is None: prob_thresh = p['thresholds']['prob']
+    if nms_thresh  is None: nms_thresh  = p['thresholds']['nms']
+    return instances_from_prediction(img_shape, prob, dist, p['grid'], rays=p['rays'],
+                                     prob_thresh=prob_thresh, nms_thresh=nms_thresh, **kwargs)
@@ -0,0 +1,212 @@
+"""Lightweight per-stage profiling of the prediction functions.
+
+Example
+-------
+>>> from stardist.profiling import profile
+>>> with profile() as prof:
+...     labels, details = model.predict_instances(img)
+>>> print(prof.report())
+>>> prof.to_chrome_trace('trace.json') # view with chrome://tracing or https://ui.perfetto.dev
+
+Stages are only recorded while a profiler is active. Otherwise, ``stage(...)`` returns a shared
+no-op context manager, i.e. the instrumentation has (almost) no overhead.
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import os
+import json
+import time
+import threading
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from csbdeep.utils import _raise
+
+
+
+_profiler = None
+
+
+class _NoStage(object):
+    # shared no-op stage for disabled profiling
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        return False
+    def add(self, **counts):
+        pass
+
+_no_stage = _NoStage()
+
+
+class _Stage(object):
+    __slots__ = ('profiler', 'name', 'counts', 'start', 'duration', 'mem_start', 'mem_peak', 'peak_bytes', 'thread')
+
+    def __init__(self, profiler, name, counts):
+        self.profiler, self.name, self.counts = profiler, name, counts
+        self.peak_bytes = None
+
+    def add(self, **counts):
+        """Add item counts (e.g. number of tiles or objects) to this stage."""
+        for k,v in counts.items():
+            self.counts[k] = self.counts.get(k,0) + int(v)
+
+    def __enter__(self):
+        self.thread = threading.get_ident()
+        if self.profiler.trace_memory:
+            self.profiler._enter_memory(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.duration = time.perf_counter() - self.start
+        if self.profiler.trace_memory:
+            self.profiler._exit_memory(self)
+        self.profiler._add(self)
+        return False
+
+
+
+class Profiler(object):
+    """Records wall time, peak allocated memory and item counts of named stages.
+
+    Use :func:`profile` to activate a profiler.
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Whether to record the peak of (Python and NumPy) memory allocated during each stage via :mod:`tracemalloc`,
+        which slows down allocations considerably. Peaks of stages that run concurrently in several threads are approximate.
+    callback : callable or None
+        (Optional) function that is called with the ``name``, ``duration`` (in seconds), item ``counts`` (dict)
+        and ``peak_bytes`` (None if memory is not traced) of every completed stage.
+    """
+
+    def __init__(self, trace_memory=False, callback=None):
+        self.trace_memory = bool(trace_memory)
+        self.callback = callback
+        self.stages = []
+        self._lock = threading.Lock()
+        self._open = []
+        self.t0 = time.perf_counter()
+
+    def _add(self, stage):
+        with self._lock:
+            self.stages.append(stage)
+        if self.callback is not None:
+            self.callback(stage.name, stage.duration, stage.counts, stage.peak_bytes)
+
+    def _enter_memory(self, stage):
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            # the outer stages must not lose their peak when it is reset for the new stage
+            for s in self._open:
+                s.mem_peak = max(s.mem_peak, peak)
+            if hasattr(tracemalloc, 'reset_peak'): # Python 3.9+, otherwise peaks are upper bounds
+                tracemalloc.reset_peak()
+            stage.mem_start, stage.mem_peak = current, current
+            self._open.append(stage)
+
+    def _exit_memory(self, stage):
+        with self._lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            stage.peak_bytes = max(stage.mem_peak, peak) - stage.mem_start
+            for s in self._open:
+                s.mem_peak = max(s.mem_peak, peak)
+            self._open.remove(stage)
+
+
+    def summary(self):
+        """Return dictionary with statistics for each stage (in order of first occurrence).
+
+        For every stage name, the number of ``calls``, the ``total``, ``mean`` and ``max`` wall time (in seconds),
+        the summed item counts, and the maximum ``peak_bytes`` (if memory is traced) are reported.
+        Note that the times of nested stages are also included in those of their parent stages.
+        """
+        result = OrderedDict()
+        for s in self.stages:
+            r = result.setdefault(s.name, dict(calls=0, total=0.0, max=0.0))
+            r['calls'] += 1
+            r['total'] += s.duration
+            r['max'] = max(r['max'], s.duration)
+            for k,v in s.counts.items():
+                r[k] = r.get(k,0) + v
+            if s.peak_bytes is not None:
+                r['peak_bytes'] = max(r.get('peak_bytes',0), s.peak_bytes)
+        for r in result.values():
+            r['mean'] = r['total'] / r['calls']
+        return result
+
+
+    def report(self):
+        """Return summary as a formatted table."""
+        summary = self.summary()
+        width = max([len(name) for name in summary] + [5])
+        lines = ["%-*s %6s %10s %10s %10s  %s" % (width, 'stage', 'calls', 'total [s]', 'mean [s]', 'peak [MB]', 'counts')]
+        for name, r in summary.items():
+            counts = ', '.join('%s=%d' % (k,v) for k,v in r.items() if k not in ('calls','total','mean','max','peak_bytes'))
+            peak = ('%10.1f' % (r['peak_bytes']/1e6)) if 'peak_bytes' in r else '%10s' % '-'
+            lines.append("%-*s %6d %10.4f %10.4f %s  %s" % (width, name, r['calls'], r['total'], r['mean'], peak, counts))
+        return '\n'.join(lines)
+
+
+    def to_chrome_trace(self, fname=None):
+        """Return recorded stages in the Chrome trace event format (and save as JSON file if ``fname`` is given)."""
+        pid = os.getpid()
+        events = []
+        for s in self.stages:
+            args = dict(s.counts)
+            if s.peak_bytes is not None:
+                args['peak_bytes'] = s.peak_bytes
+            events.append(dict(name=s.name, cat='stardist', ph='X', pid=pid, tid=s.thread,
+                               ts=1e6*(s.start-self.t0), dur=1e6*s.duration, args=args))
+        trace = dict(traceEvents=events, displayTimeUnit='ms')
+        if fname is not None:
+            with open(str(fname),'w') as f:
+                json.dump(trace, f)
+        return trace
+
+
+
+@contextmanager
+def profile(trace_memory=False, callback=None, profiler=None):
+    """Context manager that activates a :class:`Profiler` for all stages (of all threads) that run within it.
+
+    Parameters
+    ----------
+    trace_memory, callback
+        See :class:`Profiler`.
+    profiler : :class:`Profiler` or None
+        (Optional) existing profiler to continue recording with.
+
+    Returns
+    -------
+    :class:`Profiler`
+        The active profiler.
+    """
+    global _profiler
+    _profiler is None or _raise(RuntimeError("another profiler is already active"))
+    prof = Profiler(trace_memory=trace_memory, callback=callback) if profiler is None else profiler
+    started_tracing = prof.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _profiler = prof
+    try:
+        yield prof
+    finally:
+        _profiler = None
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def stage(name, **counts):
+    """Context manager to record stage ``name`` if a profiler is active (see :func:`profile`).
+
+    Item counts can be given as keyword arguments or added later via ``add`` of the returned object.
+    """
+    prof = _profiler
+    if prof is None:
+        return _no_stage
+    return _Stage(prof, name, counts)
@@ -0,0 +1,435 @@
+"""Long-running local inference server that keeps StarDist models resident.
+
+Start via the command line (see ``stardist serve --help``), e.g.
+
+    $ stardist serve --model 2D_versatile_fluo --port 8765
+
+or from Python via :func:`serve`. Images are sent via HTTP (optionally over a Unix socket) as
+``.npy`` data and the results are returned as ``.npz`` data with the label image ('labels') and
+the stored columns of the predicted :class:`stardist.StarDistInstances` (e.g. 'points', 'prob', 'dist'),
+i.e. without derived quantities such as 'coord', which :func:`predict_remote` computes on access.
+
+Endpoints:
+
+- ``POST /predict?model=<name>&axes=YX&...``: predict instances for image in request body (see :class:`ModelServer.predict`).
+- ``GET /models``: names and types of all loaded models.
+- ``GET /stats``: request counts, throughput, latency percentiles, and batch sizes.
+
+Concurrent requests for the same model with images of the same shape are batched into a single
+call of the neural network, whereas non-maximum suppression and label rendering run on a pool of worker processes
+(or threads, which only overlap post-processing with the neural network, since they are limited by the GIL).
+
+"""
+
+import io
+import sys
+import json
+import time
+import queue
+import socket
+import threading
+import http.client
+import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+from csbdeep.utils import _raise, normalize
+
+from .postprocess import postprocess_params, _init_worker, _instances_from_prediction_worker
+
+
+
+class _Stats:
+    """Thread-safe request statistics"""
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.t_start = time.time()
+        self.n_requests = self.n_errors = self.n_batches = 0
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+
+    def add_request(self, latency, error=False):
+        with self.lock:
+            self.n_requests += 1
+            self.n_errors += int(error)
+            if not error:
+                self.latencies.append((time.time(), latency))
+
+    def add_batch(self, size):
+        with self.lock:
+            self.n_batches += 1
+            self.batch_sizes.append(size)
+
+    def summary(self, recent=60):
+        with self.lock:
+            now = time.time()
+            latencies = np.array([l for _,l in self.latencies]) * 1000
+            n_recent = sum(1 for t,_ in self.latencies if t >= now - recent)
+            batch_sizes = np.array(self.batch_sizes)
+            uptime = now - self.t_start
+            return dict(
+                uptime = uptime,
+                requests = self.n_requests,
+                errors = self.n_errors,
+                throughput = self.n_requests / max(uptime,1e-6),
+                throughput_recent = n_recent / min(max(uptime,1e-6), recent),
+                latency_ms = ({f'p{p}': float(np.percentile(latencies,p)) for p in (50,90,95,99)} if len(latencies) > 0 else {}),
+                batches = self.n_batches,
+                batch_size_mean = float(np.mean(batch_sizes)) if len(batch_sizes) > 0 else 0.0,
+                batch_size_max = int(np.max(batch_sizes)) if len(batch_sizes) > 0 else 0,
+            )
+
+
+
+def _chain(future, target):
+    # set result or exception of target when future is done
+    def _done(f):
+        e = f.exception()
+        target.set_exception(e) if e is not None else target.set_result(f.result())
+    future.add_done_callback(_done)
+
+
+
+class _Request:
+    def __init__(self, img, axes, kwargs, future):
+        self.img, self.axes, self.kwargs, self.future = img, axes, kwargs, future
+
+
+
+class _Batcher(threading.Thread):
+    """Collects requests for one model and predicts same-shape requests as one batch"""
+
+    def __init__(self, model, postprocess, stats, max_batch_size, max_delay):
+        super().__init__(daemon=True)
+        self.model, self.postprocess, self.stats = model, postprocess, stats
+        self.max_batch_size, self.max_delay = int(max_batch_size), float(max_delay)
+        self.queue = queue.Queue()
+
+    def submit(self, request):
+        self.queue.put(request)
+        return request.future
+
+    def stop(self):
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+            requests, stop = [request], False
+            deadline = time.monotonic() + self.max_delay
+            while len(requests) < self.max_batch_size:
+                try:
+                    request = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                requests.append(request)
+            # group requests by image shape (in order of arrival)
+            groups = OrderedDict()
+            for request in requests:
+                groups.setdefault((request.img.shape, request.axes), []).append(request)
+            for group in groups.values():
+                self._predict(group)
+            if stop:
+                return
+
+    def _predict(self, requests):
+        try:
+            results = self.model._predict_batch([r.img for r in requests], requests[0].axes, verbose=0)
+            self.stats.add_batch(len(requests))
+        except Exception as e:
+            for r in requests:
+                r.future.set_exception(e)
+            return
+        for r, result in zip(requests, results):
+            self.postprocess(r, result)
+
+
+
+class ModelServer:
+    """Keeps StarDist models resident and serves concurrent prediction requests.
+
+    Parameters
+    ----------
+    models : dict
+        Models (:class:`stardist.models.StarDist2D` or :class:`stardist.models.StarDist3D`) by name.
+    max_batch_size : int
+        Maximum number of same-shape images that are predicted together by the neural network.
+    max_delay : float
+        Maximum time (in seconds) to wait for additional requests to form a batch.
+    workers : int or None
+        Number of workers for non-maximum suppression and label rendering (by default the number of CPUs).
+    processes : bool
+        Whether to use worker processes instead of threads. Threads can only overlap post-processing with
+        the prediction of the neural network, whereas processes can also post-process several images in parallel.
+        Worker processes only receive the grid, thresholds, and rays of every model (see :mod:`stardist.postprocess`),
+        hence they neither import TensorFlow nor hold a copy of the neural network.
+
+    """
+
+    def __init__(self, models, max_batch_size=8, max_delay=0.01, workers=None, processes=True):
+        len(models) > 0 or _raise(ValueError("at least one model required"))
+        self.models = dict(models)
+        self.stats = _Stats()
+        self.processes = bool(processes)
+        if self.processes:
+            from multiprocessing import get_context
+            # post-processing in worker processes only needs these parameters (by model name), not the neural network
+            worker_params = {name: postprocess_params(model) for name, model in self.models.items()}
+            self.pool = ProcessPoolExecutor(workers, mp_context=get_context('spawn'), initializer=_init_worker, initargs=(worker_params,))
+        else:
+            self.pool = ThreadPoolExecutor(workers)
+        # tiled (i.e. not batched) prediction of the neural network
+        self.threads = ThreadPoolExecutor()
+        self.batchers = {name: _Batcher(model, (lambda request, result, name=name: self._postprocess(name, request, result)),
+                                        self.stats, max_batch_size, max_delay) for name, model in self.models.items()}
+        for batcher in self.batchers.values():
+            batcher.start()
+
+    def _postprocess(self, name, request, result):
+        # same as in StarDistBase.predict_instances (non-sparse)
+        try:
+            model = self.models[name]
+            prob, dist = result[:2]
+            prob_class = result[2] if model._is_multiclass() else None
+            shape_inst = tuple(s for s,a in zip(request.img.shape, request.axes) if a != 'C')
+            if self.processes:
+                future = self.pool.submit(_instances_from_prediction_worker, shape_inst, prob, dist, model=name,
+                                          points=None, prob_class=prob_class, **request.kwargs)
+            else:
+                future = self.pool.submit(model._instances_from_prediction, shape_inst, prob, dist,
+                                          points=None, prob_class=prob_class, **request.kwargs)
+            _chain(future, request.future)
+        except Exception as e:
+            request.future.set_exception(e)
+
+    def _predict_tiled(self, name, request, n_tiles):
+        try:
+            result = self.models[name].predict(request.img, axes=request.axes, n_tiles=n_tiles, show_tile_progress=False)
+        except Exception as e:
+            return request.future.set_exception(e)
+        self._postprocess(name, request, result)
+
+    def predict(self, img, model=None, axes=None, normalize_input=True, pmin=1, pmax=99.8, n_tiles=None,
+                prob_thresh=None, nms_thresh=None, **kwargs):
+        """Submit prediction request and return :class:`concurrent.futures.Future` of the result of ``predict_instances``.
+
+        If ``normalize_input`` is True, the image is percentile-normalized with ``pmin`` and ``pmax``.
+        If ``n_tiles`` is given, the request is processed individually via ``predict_instances`` (without batching).
+        Additional ``kwargs`` are passed to the non-maximum suppression (see ``predict_instances``).
+        """
+        t = time.time()
+        if model is None:
+            len(self.models) == 1 or _raise(ValueError(f"model name required, must be one of {sorted(self.models)}"))
+            model = next(iter(self.models))
+        model in self.models or _raise(ValueError(f"unknown model '{model}', must be one of {sorted(self.models)}"))
+        name, model = model, self.models[model]
+        axes = model._normalize_axes(img, axes)
+        if normalize_input:
+            axis_norm = tuple(i for i,a in enumerate(axes) if a != 'C')
+            img = normalize(img, pmin, pmax, axis=axis_norm)
+
+        kwargs.update(prob_thresh=prob_thresh, nms_thresh=nms_thresh)
+        request = _Request(img, axes, kwargs, Future())
+        if n_tiles is not None:
+            self.threads.submit(self._predict_tiled, name, request, n_tiles)
+        else:
+            self.batchers[name].submit(request)
+        future = request.future
+        future.add_done_callback(lambda f: self.stats.add_request(time.time()-t, error=(f.exception() is not None)))
+        return future
+
+    def close(self):
+        for batcher in self.batchers.values():
+            batcher.stop()
+        for batcher in self.batchers.values():
+            batcher.join()
+        self.threads.shutdown()
+        self.pool.shutdown()
+
+
+
+def encode_result(labels, polys):
+    """Encode prediction result as bytes of a ``.npz`` file"""
+    from .instances import StarDistInstances
+    if isinstance(polys, StarDistInstances):
+        # only stored columns (derived quantities such as 'coord' are computed by the client if needed)
+        arrays = polys.columns
+        if polys.rays is not None:
+            arrays.update(rays_vertices=polys.rays.vertices, rays_faces=polys.rays.faces)
+    else:
+        arrays = {k: v for k, v in polys.items() if isinstance(v, np.ndarray) and v.dtype != object}
+    buffer = io.BytesIO()
+    np.savez(buffer, labels=labels, **arrays)
+    return buffer.getvalue()
+
+
+def decode_result(data):
+    """Decode prediction result (as returned by :func:`encode_result`) to tuple of labels and
+    :class:`stardist.StarDistInstances` (or dictionary, if the result doesn't contain the distances)"""
+    from .instances import StarDistInstances
+    from .rays3d import Rays_Explicit
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        polys = {k: npz[k] for k in npz.files}
+    labels = polys.pop('labels')
+    if 'dist' in polys:
+        rays = Rays_Explicit(polys['rays_vertices'], polys['rays_faces']) if 'rays_vertices' in polys else None
+        polys = StarDistInstances(polys['points'], polys['prob'], polys['dist'], class_prob=polys.get('class_prob'),
+                                  class_id=polys.get('class_id'), rays=rays, dist_dtype=polys['dist'].dtype)
+    return labels, polys
+
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # set via subclass in make_server
+    server_model = None
+    quiet = True
+
+    _param_types = dict(axes=str, normalize_input=lambda v: v.lower() not in ('0','false','no'), pmin=float, pmax=float,
+                        prob_thresh=float, nms_thresh=float, n_tiles=lambda v: tuple(int(t) for t in v.split(',')))
+
+    def address_string(self):
+        # client address is not a tuple for unix sockets
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _send(self, code, body, content_type='application/octet-stream'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, code, obj):
+        self._send(code, json.dumps(obj).encode(), 'application/json')
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/stats':
+            self._send_json(200, self.server_model.stats.summary())
+        elif path == '/models':
+            self._send_json(200, {name: type(model).__name__ for name, model in self.server_model.models.items()})
+        else:
+            self._send_json(404, dict(error=f"unknown path '{path}'"))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/predict':
+            return self._send_json(404, dict(error=f"unknown path '{url.path}'"))
+        try:
+            params = dict(parse_qsl(url.query))
+            model = params.pop('model', None)
+            kwargs = {k: self._param_types[k](v) for k, v in params.items() if k in self._param_types}
+            set(params) <= set(self._param_types) or _raise(ValueError(f"unknown parameters {sorted(set(params)-set(self._param_types))}"))
+            n = int(self.headers.get('Content-Length', 0))
+            img = np.load(io.BytesIO(self.rfile.read(n)), allow_pickle=False)
+            future = self.server_model.predict(img, model=model, **kwargs)
+        except Exception as e:
+            self.server_model.stats.add_request(None, error=True)
+            return self._send_json(400, dict(error=str(e)))
+        try:
+            labels, polys = future.result()
+            self._send(200, encode_result(labels, polys))
+        except Exception as e:
+            self._send_json(500, dict(error=str(e)))
+
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = str(self.server_address), 0
+
+
+def make_server(server_model, host='127.0.0.1', port=8765, unix_socket=None, quiet=True):
+    """Create HTTP server (that is not yet running) for a :class:`ModelServer`, listening at host/port or a unix socket"""
+    handler = type('RequestHandler', (_RequestHandler,), dict(server_model=server_model, quiet=quiet))
+    if unix_socket is not None:
+        hasattr(socket, 'AF_UNIX') or _raise(ValueError("unix sockets not supported on this platform"))
+        return _ThreadingUnixHTTPServer(str(unix_socket), handler)
+    else:
+        return _ThreadingHTTPServer((host, int(port)), handler)
+
+
+def serve(models, host='127.0.0.1', port=8765, unix_socket=None, max_batch_size=8, max_delay=0.01, workers=None, processes=True, quiet=False):
+    """Serve models until interrupted (see :class:`ModelServer` and module docstring)"""
+    server_model = ModelServer(models, max_batch_size=max_batch_size, max_delay=max_delay, workers=workers, processes=processes)
+    server = make_server(server_model, host=host, port=port, unix_socket=unix_socket, quiet=quiet)
+    where = f"unix socket '{unix_socket}'" if unix_socket is not None else f"http://{host}:{server.server_address[1]}"
+    print(f"serving model(s) {', '.join(sorted(server_model.models))} at {where} (press Ctrl+C to quit)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server_model.close()
+
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = str(path)
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def _connection(host, port, unix_socket, timeout):
+    if unix_socket is not None:
+        return _UnixHTTPConnection(unix_socket, timeout=timeout)
+    return http.client.HTTPConnection(host, int(port), timeout=timeout)
+
+
+def predict_remote(img, model=None, host='127.0.0.1', port=8765, unix_socket=None, timeout=None, **params):
+    """Client: request prediction from running server and return tuple of labels and
+    :class:`stardist.StarDistInstances` (or dictionary, if the result doesn't contain the distances).
+
+    Parameters ``params`` (e.g. 'axes', 'prob_thresh', 'n_tiles') are passed to :meth:`ModelServer.predict`.
+    """
+    if model is not None:
+        params['model'] = model
+    if 'n_tiles' in params:
+        params['n_tiles'] = ','.join(map(str, params['n_tiles']))
+    query = urlencode(params)
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(img), allow_pickle=False)
+    conn = _connection(host, port, unix_socket, timeout)
+    try:
+        conn.request('POST', '/predict' + (f'?{query}' if query else ''), body=buffer.getvalue(),
+                     headers={'Content-Type': 'application/octet-stream'})
+        response = conn.getresponse()
+        data = response.read()
+    finally:
+        conn.close()
+    response.status == 200 or _raise(RuntimeError(f"server error {response.status}: {json.loads(data).get('error')}"))
+    return decode_result(data)
+
+
+def server_stats(host='127.0.0.1', port=8765, unix_socket=None, timeout=None):
+    """Client: return statistics of running server"""
+    conn = _connection(host, port, unix_socket, timeout)
+    try:
+        conn.request('GET', '/stats')
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
@@ -4,17 +4,13 @@ import numpy as np
 import warnings
 import os
 import datetime
-from tqdm import tqdm
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from contextlib import ExitStack
 from zipfile import ZipFile, ZIP_DEFLATED
-from scipy.ndimage.morphology import distance_transform_edt, binary_fill_holes
-from scipy.ndimage.measurements import find_objects
-from scipy.optimize import minimize_scalar
-from skimage.measure import regionprops
 from csbdeep.utils import _raise
 from csbdeep.utils.six import Path
 
-from .matching import matching_dataset, _check_label_array
+from .matching import matching, matching_dataset, _accumulate_matching, _check_label_array
 
 
 def gputools_available():
@@ -54,6 +50,7 @@ def _edt_dist_func(anisotropy):
         # raise ImportError()
         dist_func = lambda img: edt_func(np.ascontiguousarray(img>0), anisotropy=anisotropy)
     except ImportError:
+        from scipy.ndimage import distance_transform_edt
         dist_func = lambda img: distance_transform_edt(img, sampling=anisotropy)
     return dist_func
 
@@ -76,6 +73,7 @@ def _edt_prob(lbl_img, anisotropy=None):
 
 def edt_prob(lbl_img, anisotropy=None):
     """Perform EDT on each labeled object and normalize."""
+    from scipy.ndimage import find_objects
     def grow(sl,interior):
         return tuple(slice(s.start-int(w[0]),s.stop+int(w[1])) for s,w in zip(sl,interior))
     def shrink(interior):
@@ -106,6 +104,7 @@ def edt_prob(lbl_img, anisotropy=None):
 
 
 def _fill_label_holes(lbl_img, **kwargs):
+    from scipy.ndimage import binary_fill_holes
     lbl_img_filled = np.zeros_like(lbl_img)
     for l in (set(np.unique(lbl_img)) - set([0])):
         mask = lbl_img==l
@@ -117,6 +116,7 @@ def _fill_label_holes(lbl_img, **kwargs):
 def fill_label_holes(lbl_img, **kwargs):
     """Fill small holes in label image."""
     # TODO: refactor 'fill_label_holes' and 'edt_prob' to share code
+    from scipy.ndimage import find_objects, binary_fill_holes
     def grow(sl,interior):
         return tuple(slice(s.start-int(w[0]),s.stop+int(w[1])) for s,w in zip(sl,interior))
     def shrink(interior):
@@ -165,6 +165,7 @@ def calculate_extents(lbl, func=np.median):
     n = lbl.ndim
     n in (2,3) or _raise(ValueError("label image should be 2- or 3-dimensional (or pass a list of these)"))
 
+    from skimage.measure import regionprops
     regs = regionprops(lbl)
     if len(regs) == 0:
         return np.zeros(n)
@@ -248,8 +249,55 @@ def export_imagej_rois(fname, polygons, set_position=True, subpixel=True, compre
                 roizip.writestr('{pos:03d}_{i:03d}.roi'.format(pos=pos,i=i), roi)
 
 
-def optimize_threshold(Y, Yhat, model, nms_thresh, measure='accuracy', iou_threshs=[0.3,0.5,0.7], bracket=None, tol=1e-2, maxiter=20, verbose=1):
-    """ Tune prob_thresh for provided (fixed) nms_thresh to maximize matching score (for given measure and averaged over iou_threshs). """
+# parallel threshold optimization: every worker process receives the validation data only once (when started)
+# and then computes the object instances and matching stats of single images for given thresholds
+_matching_worker_data = None
+
+def _init_matching_worker(params, Y, Yhat, omp_threads):
+    global _matching_worker_data
+    try:
+        # avoid oversubscription by the OpenMP threads of all workers
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=omp_threads, user_api='openmp')
+    except ImportError:
+        pass
+    from .postprocess import _init_worker
+    _init_worker({None: params})
+    _matching_worker_data = Y, Yhat
+
+def _matching_worker(i, prob_thresh, nms_thresh, iou_threshs):
+    from .postprocess import _instances_from_prediction_worker
+    Y, Yhat = _matching_worker_data
+    y_pred = _instances_from_prediction_worker(Y[i].shape, *Yhat[i], prob_thresh=prob_thresh, nms_thresh=nms_thresh)[0]
+    # as dictionaries, since the (dynamically created) Matching namedtuples can't be pickled
+    return tuple(s._asdict() for s in matching(Y[i], y_pred, thresh=iou_threshs, report_matches=False))
+
+def _matching_pool(Y, Yhat, model, n_tasks=None):
+    """Process pool (with the validation data) for ``optimize_threshold``, should be used as a context manager.
+
+    Uses one worker per CPU core, but not more than the number of concurrent tasks (default: number of images).
+    """
+    from multiprocessing import get_context
+    from concurrent.futures import ProcessPoolExecutor
+    from .postprocess import postprocess_params
+    n_cpus = os.cpu_count() or 1
+    max_workers = max(1, min(n_cpus, len(Y) if n_tasks is None else n_tasks))
+    initargs = (postprocess_params(model),
+                list(Y), [tuple(prob_dist[:2]) for prob_dist in Yhat], max(1, n_cpus//max_workers))
+    return ProcessPoolExecutor(max_workers, mp_context=get_context('spawn'), initializer=_init_matching_worker, initargs=initargs)
+
+
+def optimize_threshold(Y, Yhat, model, nms_thresh, measure='accuracy', iou_threshs=[0.3,0.5,0.7], bracket=None, tol=1e-2, maxiter=20, verbose=1, parallel=False, pool=None):
+    """ Tune prob_thresh for provided (fixed) nms_thresh to maximize matching score (for given measure and averaged over iou_threshs).
+
+    If parallel is True, object instances and matching stats of all images are computed concurrently
+    (for each candidate prob_thresh) in a pool of worker processes, since non-maximum suppression and
+    rendering of the label images do not release the GIL. An existing pool (see ``_matching_pool``) can be
+    provided via ``pool``, e.g. to share it between the optimization runs for several nms_threshs.
+    Results do not depend on the order in which the images are processed.
+    """
+    from tqdm import tqdm
+    from scipy.optimize import minimize_scalar
     np.isscalar(nms_thresh) or _raise(ValueError("nms_thresh must be a scalar"))
     iou_threshs = [iou_threshs] if np.isscalar(iou_threshs) else iou_threshs
     values = dict()
@@ -259,14 +307,23 @@ def optimize_threshold(Y, Yhat, model, nms_thresh, measure='accuracy', iou_thres
         bracket = max_prob/2, max_prob
     # print("bracket =", bracket)
 
-    with tqdm(total=maxiter, disable=(verbose!=1), desc="NMS threshold = %g" % nms_thresh) as progress:
+    with ExitStack() as stack:
+        if parallel and pool is None:
+            pool = stack.enter_context(_matching_pool(Y, Yhat, model))
+        progress = stack.enter_context(tqdm(total=maxiter, disable=(verbose!=1), desc="NMS threshold = %g" % nms_thresh))
 
         def fn(thr):
             prob_thresh = np.clip(thr, *bracket)
             value = values.get(prob_thresh)
             if value is None:
-                Y_instances = [model._instances_from_prediction(y.shape, *prob_dist, prob_thresh=prob_thresh, nms_thresh=nms_thresh)[0] for y,prob_dist in zip(Y,Yhat)]
-                stats = matching_dataset(Y, Y_instances, thresh=iou_threshs, show_progress=False, parallel=True)
+                if pool is not None:
+                    futures = [pool.submit(_matching_worker, i, prob_thresh, nms_thresh, tuple(iou_threshs)) for i in range(len(Y))]
+                    stats_all = [tuple(namedtuple('Matching', s.keys())(**s) for s in f.result()) for f in futures]
+                    stats = _accumulate_matching(stats_all, thresh=iou_threshs)
+                else:
+                    Y_instances = [model._instances_from_prediction(y.shape, *prob_dist, prob_thresh=prob_thresh, nms_thresh=nms_thresh)[0]
+                                   for y, prob_dist in zip(Y,Yhat)]
+                    stats = matching_dataset(Y, Y_instances, thresh=iou_threshs, show_progress=False, parallel=True)
                 values[prob_thresh] = value = np.mean([s._asdict()[measure] for s in stats])
             if verbose > 1:
                 print("{now}   thresh: {prob_thresh:f}   {measure}: {value:f}".format(
@@ -287,6 +344,130 @@ def optimize_threshold(Y, Yhat, model, nms_thresh, measure='accuracy', iou_thres
     return opt.x, -opt.fun
 
 
+def _thresholds_grid_candidates(prob_dist, grid, prob_thresh, b):
+    # object candidates of one image (for the smallest prob_thresh of the grid search)
+    from .nms import _ind_prob_thresh
+    prob, dist = prob_dist[:2]
+    inds = _ind_prob_thresh(prob, prob_thresh, b=b)
+    return prob[inds], dist[inds], np.stack(np.where(inds), axis=1) * np.array(grid).reshape(1,-1)
+
+def _thresholds_grid_stats(y, cand, rays, nms_thresh, prob_threshs_sorted, iou_threshs):
+    # matching stats of one image for all prob_threshs (in decreasing order), 2D if rays is None
+    from .matching import _matching_from_overlap, relabel_sequential
+    if rays is not None:
+        from .geometry import polyhedron_to_label
+        from .nms import non_maximum_suppression_3d_sparse
+        nms    = lambda dist, prob, points: non_maximum_suppression_3d_sparse(dist, prob, points, rays, nms_thresh=nms_thresh)
+        render = lambda dist, points, prob, shape: polyhedron_to_label(dist, points, rays=rays, prob=prob, shape=shape, verbose=False)
+    else:
+        from .geometry import polygons_to_label
+        from .nms import non_maximum_suppression_sparse
+        nms    = lambda dist, prob, points: non_maximum_suppression_sparse(dist, prob, points, nms_thresh=nms_thresh)
+        render = lambda dist, points, prob, shape: polygons_to_label(dist, points, prob=prob, shape=shape)
+
+    y = _check_label_array(y,'y') and relabel_sequential(y)[0]
+    probc, distc, pointsc = cand
+    # survivors are sorted by decreasing probability
+    pointsi, probi, disti, _ = nms(distc, probc, pointsc)
+
+    n_true = int(y.max())
+    lbl = np.zeros(y.shape, np.int32)
+    overlap = np.zeros((1+n_true, 1+len(probi)), np.int64)
+    overlap[:,0] = np.bincount(y.ravel(), minlength=1+n_true)
+
+    stats, start = [], 0
+    for prob_thresh in prob_threshs_sorted:
+        stop = np.count_nonzero(probi > prob_thresh)
+        if stop > start:
+            # add objects with probability in (prob_thresh, previous prob_thresh]
+            lbl_batch = render(disti[start:stop], pointsi[start:stop], probi[start:stop], y.shape)
+            # pixels already covered by objects with higher probability are kept
+            mask = (lbl == 0) & (lbl_batch > 0)
+            lbl[mask] = lbl_batch[mask] + start
+            gt, pred = y[mask], lbl[mask]
+            np.subtract.at(overlap, (gt, 0), 1)
+            np.add.at(overlap, (gt, pred), 1)
+            start = stop
+        # only keep predicted objects that are visible in the label image
+        visible = 1 + np.flatnonzero(np.any(overlap[:,1:1+start] > 0, axis=0))
+        stats.append(_matching_from_overlap(overlap[:,np.concatenate([[0],visible])], iou_threshs))
+    return stats
+
+def _thresholds_grid_worker(i, nms_thresh, prob_threshs_sorted, iou_threshs, b):
+    from .postprocess import _worker_params
+    Y, Yhat = _matching_worker_data
+    cand = _thresholds_grid_candidates(Yhat[i], _worker_params[None]['grid'], prob_threshs_sorted[-1], b)
+    stats = _thresholds_grid_stats(Y[i], cand, _worker_params[None]['rays'], nms_thresh, prob_threshs_sorted, iou_threshs)
+    # as dictionaries, since the (dynamically created) Matching namedtuples can't be pickled
+    return [tuple(m._asdict() for m in s) for s in stats]
+
+
+def optimize_thresholds_grid(Y, Yhat, model, prob_threshs, nms_threshs, measure='accuracy', iou_threshs=[0.3,0.5,0.7], b=2, verbose=1, parallel=False):
+    """ Evaluate matching score (for given measure and averaged over iou_threshs) for all combinations of prob_threshs and nms_threshs.
+
+    Object candidates of every image are extracted and sorted only once (for the smallest prob_thresh).
+    Since non-maximum suppression processes candidates in order of decreasing probability, the objects that survive
+    for a larger prob_thresh are exactly the survivors (for the smallest prob_thresh) with a probability above that threshold.
+    Hence, NMS only has to be run once per nms_thresh, and the label images and matching statistics for
+    all prob_threshs are obtained by incrementally adding objects (in order of decreasing probability).
+    (Results can only differ from separate predictions if several candidates have exactly the same probability.)
+
+    If parallel is True, the matching stats of all images and nms_threshs are computed concurrently in a pool of
+    worker processes (see ``_matching_pool``), since non-maximum suppression and rendering do not release the GIL.
+
+    Returns
+    -------
+    (float, float, float, :class:`numpy.ndarray`)
+        Returns the tuple (`prob_thresh`, `nms_thresh`, `value`) of the best threshold combination and its score,
+        as well as the full score surface of shape (len(nms_threshs), len(prob_threshs)).
+
+    """
+    from tqdm import tqdm
+    from .rays3d import rays_from_json
+
+    iou_threshs = [iou_threshs] if np.isscalar(iou_threshs) else iou_threshs
+    iou_threshs = tuple(map(float,iou_threshs))
+    prob_threshs, nms_threshs = np.asarray(prob_threshs, np.float64), np.asarray(nms_threshs, np.float64)
+    (prob_threshs.ndim == 1 and len(prob_threshs) > 0) or _raise(ValueError("prob_threshs must be a non-empty list of scalars"))
+    (nms_threshs.ndim  == 1 and len(nms_threshs)  > 0) or _raise(ValueError("nms_threshs must be a non-empty list of scalars"))
+    len(Y) == len(Yhat) or _raise(ValueError("Y and Yhat must have the same length"))
+
+    # process prob_threshs in decreasing order
+    order = np.argsort(prob_threshs, kind='stable')[::-1]
+    prob_threshs_sorted = prob_threshs[order]
+
+    scores = np.zeros((len(nms_threshs),len(prob_threshs)))
+    with ExitStack() as stack:
+        if parallel:
+            # all images and nms_threshs are processed by a single pool of worker processes
+            pool = stack.enter_context(_matching_pool(Y, Yhat, model, n_tasks=len(Y)*len(nms_threshs)))
+            futures = [[pool.submit(_thresholds_grid_worker, k, nms_thresh, prob_threshs_sorted, iou_threshs, b) for k in range(len(Y))]
+                       for nms_thresh in nms_threshs]
+        else:
+            # extract candidates of every image only once (for the smallest prob_thresh)
+            cands = [_thresholds_grid_candidates(prob_dist, model.config.grid, prob_threshs_sorted[-1], b) for prob_dist in Yhat]
+            rays = rays_from_json(model.config.rays_json) if model.config.n_dim == 3 else None
+
+        for i,nms_thresh in enumerate(tqdm(nms_threshs, disable=(verbose!=1), desc="NMS threshold")):
+            if parallel:
+                stats_all = [[tuple(namedtuple('Matching', m.keys())(**m) for m in s) for s in f.result()] for f in futures[i]]
+            else:
+                stats_all = [_thresholds_grid_stats(y, cand, rays, nms_thresh, prob_threshs_sorted, iou_threshs) for y, cand in zip(Y,cands)]
+            for j in range(len(prob_threshs)):
+                stats = _accumulate_matching([s[j] for s in stats_all], thresh=iou_threshs)
+                scores[i,order[j]] = np.mean([s._asdict()[measure] for s in stats])
+            if verbose > 1:
+                print("{now}   nms_thresh: {nms_thresh:f}   best {measure}: {value:f}".format(
+                    now = datetime.datetime.now().strftime('%H:%M:%S'),
+                    nms_thresh = nms_thresh,
+                    measure = measure,
+                    value = np.max(scores[i]),
+                ), flush=True)
+
+    i,j = np.unravel_index(np.argmax(scores), scores.shape)
+    return prob_threshs[j], nms_threshs[i], scores[i,j], scores
+
+
 def _invert_dict(d):
     """ return  v-> [k_1,k_2,k_3....] for k,v in d"""
     res = defaultdict(list)
@@ -362,3 +543,16 @@ def mask_to_categorical(y, n_classes, classes, return_cls_dict=False):
 
 def _is_floatarray(x):
     return isinstance(x.dtype.type(0),np.floating)
+
+
+def _available_memory(default=8*2**30):
+    """Available system memory in bytes (or 'default' if it cannot be determined)"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return default
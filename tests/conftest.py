@@ -10,22 +10,34 @@ def pytest_configure(config):
     _limit_tf_gpu_memory()
 
 
-def _model2d():
-    from utils import path_model2d
+def _model2d(basedir=None):
+    from utils import path_model2d, copy_model
     from stardist.models import StarDist2D
-    model_path = path_model2d()
+    model_path = copy_model(path_model2d(), basedir)
     return StarDist2D(None, name=model_path.name, basedir=str(model_path.parent))
 
 @pytest.fixture(scope='session')
-def model2d():
-    return _model2d()
-
-def _model3d():
-    from utils import path_model3d
+def model2d(tmp_path_factory):
+    return _model2d(tmp_path_factory.mktemp('models'))
+
+@pytest.fixture
+def model2d_random():
+    # small untrained model (random weights), new for every test since tests may modify it
+    from stardist.models import Config2D, StarDist2D
+    return StarDist2D(Config2D(n_rays=16, grid=(2,2), unet_n_depth=2, n_channel_in=1), None, None)
+
+@pytest.fixture
+def img2d():
+    from csbdeep.utils import normalize
+    from utils import real_image2d
+    return normalize(real_image2d()[0], 1, 99.8)
+
+def _model3d(basedir=None):
+    from utils import path_model3d, copy_model
     from stardist.models import StarDist3D
-    model_path = path_model3d()
+    model_path = copy_model(path_model3d(), basedir)
     return StarDist3D(None, name=model_path.name, basedir=str(model_path.parent))
 
 @pytest.fixture(scope='session')
-def model3d():
-    return _model3d()
+def model3d(tmp_path_factory):
+    return _model3d(tmp_path_factory.mktemp('models'))
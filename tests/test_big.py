@@ -1,13 +1,14 @@
 import numpy as np
 import pytest
 
-from csbdeep.utils import normalize
+from csbdeep.utils import normalize, _raise
 from stardist.matching import matching, relabel_sequential
 from stardist import calculate_extents, polyhedron_to_label
 from utils import real_image2d, real_image3d
 
 from stardist.geometry import polygons_to_label_coord
-from stardist.big import BlockND, Polygon, Polyhedron
+from skimage.measure import regionprops
+from stardist.big import BlockND, Polygon, Polyhedron, relabel_block
 
 
 
@@ -77,8 +78,363 @@ def test_cover3D(block_size, context, grid):
 
 
 
+@pytest.mark.parametrize('offset', [1, 1000, 2**17, 2**33])
+@pytest.mark.parametrize('dtype', [None, np.uint32, np.uint64, np.int64])
+def test_relabel_block(offset, dtype):
+    lbl = real_image3d()[1].astype(np.uint16)
+    # remove some labels and use a (non-contiguous) view
+    lbl[np.isin(lbl, (2,5,11))] = 0
+    lbl = lbl[1:-1,::2,3:]
+
+    if dtype is not None and offset + lbl.max() > np.iinfo(dtype).max:
+        with pytest.raises(ValueError):
+            relabel_block(lbl.copy(), offset, dtype=dtype)
+        return
+
+    # relabel_sequential(lbl, offset) would allocate memory proportional to offset
+    ref = relabel_sequential(lbl.astype(np.int64))[0]
+    ref[ref > 0] += offset - 1
+    res = relabel_block(lbl.copy(), offset, dtype=dtype, chunk_size=1000)
+    assert np.array_equal(ref, res)
+    assert res.dtype == (np.dtype(dtype) if dtype is not None else np.promote_types(lbl.dtype, np.min_scalar_type(int(ref.max()))))
+
+    # in-place if dtype doesn't change
+    lbl32 = lbl.astype(np.uint32)
+    if offset + lbl.max() <= np.iinfo(np.uint32).max:
+        res = relabel_block(lbl32, offset, dtype=np.uint32)
+        assert res is lbl32 and np.array_equal(ref, res)
+
+    # preallocated output (e.g. view of a reusable buffer) if dtype changes
+    out_dtype = np.uint64 if dtype is None else dtype
+    buffer = np.zeros(tuple(s+2 for s in lbl.shape), out_dtype)
+    out = buffer[tuple(slice(1,1+s) for s in lbl.shape)]
+    lbl16 = lbl.copy()
+    res = relabel_block(lbl16, offset, chunk_size=1000, out=out)
+    assert res is out and np.array_equal(ref, out) and np.array_equal(lbl16, lbl)
+    assert np.count_nonzero(buffer) == np.count_nonzero(out)
+    with pytest.raises(ValueError):
+        relabel_block(lbl.copy(), offset, out=out[1:])
+
+
+
+@pytest.mark.parametrize('grid', [1, 3])
+@pytest.mark.parametrize('block_size, context', [(80,10), (128,17), (256,80)])
+def test_cover2D_bbox(block_size, context, grid):
+    from stardist import star_dist
+    from stardist.geometry import dist_to_coord
+    np.random.seed(42)
+    lbl = repeat(real_image2d()[1].astype(np.int32), 3)
+    # polygons from ground truth objects, sorted by decreasing probability
+    points = np.array([np.array(r.centroid).astype(int) for r in regionprops(lbl)])
+    coord = dist_to_coord(star_dist(lbl, 32)[tuple(points.T)], points)
+    prob = np.random.uniform(size=len(points))
+    ind = np.argsort(prob)[::-1]
+    points, coord, prob = points[ind], coord[ind], prob[ind]
+    ref = polygons_to_label_coord(coord[::-1], shape=lbl.shape, labels=np.arange(len(points))[::-1])
+
+    max_sizes = tuple(calculate_extents(ref, func=np.max))
+    min_overlap = tuple(2+v for v in max_sizes)
+    blocks = BlockND.cover(lbl.shape, axes='YX', block_size=block_size, min_overlap=min_overlap, context=context, grid=grid)
+    result = np.zeros_like(ref)
+    n_retained = np.zeros(len(points), int)
+
+    for block in blocks:
+        # objects with center in block read region (in local coordinates)
+        start = np.array([s.start for s in block.slice_read()])
+        inside = np.all((points >= start) & (points < [s.stop for s in block.slice_read()]), axis=1)
+        polys = dict(points=points[inside]-start, coord=coord[inside]-start.reshape(1,2,1), prob=prob[inside])
+        labels, polys = block.filter_objects_bbox(polys)
+        assert labels.max() == len(polys['prob'])
+        # map label ids in block back to global ids
+        ids = np.flatnonzero(inside)[np.isin(prob[inside], polys['prob'])]
+        assert np.allclose(points[ids], polys['points'])
+        n_retained[ids] += 1
+        labels[labels > 0] = 1+ids[labels[labels > 0]-1]
+        block.write(result, labels)
+
+    assert np.all(n_retained[np.unique(ref[ref>0])-1] == 1)
+    assert np.all(ref == result)
+
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+@pytest.mark.parametrize('chunks', [None, 'memmap', (48,80), (64,64)])
+def test_block_reader(tmpdir, prefetch, chunks):
+    from tifffile import imwrite
+    from stardist.big import BlockReader, TiledTiffArray
+    np.random.seed(42)
+    x = np.random.randint(0, 1000, (300,500)).astype(np.uint16)
+    blocks = BlockND.cover(x.shape, axes='YX', block_size=128, min_overlap=16, context=8)
+
+    if chunks is None:
+        img = x
+    elif chunks == 'memmap':
+        img = np.memmap(str(tmpdir / 'img.raw'), dtype=x.dtype, mode='w+', shape=x.shape)
+        img[:] = x
+        chunks = None
+    else:
+        fname = str(tmpdir / 'img.tif')
+        imwrite(fname, x, tile=chunks, compression='zlib')
+        img = TiledTiffArray(fname)
+        assert img.shape == x.shape and img.chunks == chunks
+        assert np.array_equal(img[17:211,5:], x[17:211,5:])
+
+    cache_bytes = 20*x.itemsize*np.prod(chunks or 1)
+    reader = BlockReader(img, blocks, axes='YX', prefetch=prefetch, cache_bytes=cache_bytes)
+    assert tuple(block for block,_ in reader) == blocks
+    for block, y in reader:
+        assert np.array_equal(block.read(x, axes='YX'), y)
+        # actually read (e.g. not a lazy view of a memmap)
+        assert not isinstance(y, np.memmap)
+    if chunks is not None:
+        assert 0 < reader._cache_nbytes <= cache_bytes
+        img.close()
+
+
+
+@pytest.mark.parametrize('chunks', [None, (50,70), (64,64), (300,33)])
+def test_block_writer(chunks):
+    from stardist.big import BlockWriter
+
+    class ChunkedArray:
+        # numpy array with chunks that counts chunk reads and writes
+        def __init__(self, shape, chunks):
+            self.data, self.chunks = np.zeros(shape, np.int32), chunks
+            self.shape, self.ndim, self.dtype = self.data.shape, self.data.ndim, self.data.dtype
+            self.n_read, self.n_write = {}, {}
+        def _count(self, d, slices):
+            assert all(s.start % c == 0 for s,c in zip(slices,self.chunks))
+            key = tuple(s.start//c for s,c in zip(slices,self.chunks))
+            d[key] = d.get(key,0) + 1
+        def __getitem__(self, slices):
+            self._count(self.n_read, slices)
+            return self.data[slices].copy()
+        def __setitem__(self, slices, value):
+            self._count(self.n_write, slices)
+            self.data[slices] = value
+
+    lbl = real_image2d()[1].astype(np.int32)
+    min_overlap = tuple(1+v for v in calculate_extents(lbl, func=np.max))
+    lbl = repeat(lbl, (2,3))
+    blocks = BlockND.cover(lbl.shape, axes='YX', block_size=128, min_overlap=min_overlap, context=10)
+    # output with some existing content
+    out_ref = np.full_like(lbl, 7)
+    out = out_ref.copy() if chunks is None else ChunkedArray(lbl.shape, chunks)
+    if chunks is not None:
+        out.data[:] = out_ref
+
+    writer = BlockWriter(out, blocks)
+    done = []
+    for block in blocks:
+        labels = block.filter_objects(block.crop_context(block.read(lbl)), polys=None)
+        block.write(out_ref, labels)
+        done.extend(writer.write(block, labels))
+    done.extend(writer.close())
+
+    assert sorted(b.id for b in done) == [b.id for b in blocks]
+    assert np.all((out if chunks is None else out.data) == out_ref)
+    if chunks is not None:
+        # each chunk is read and written only once
+        assert set(out.n_read.values()) == set(out.n_write.values()) == {1}
+
+
+
+def test_block_checkpoint(tmpdir):
+    from stardist import Rays_GoldenSpiral
+    from stardist.big import BlockCheckpoint
+    blocks = BlockND.cover((100,120), axes='YX', block_size=64, min_overlap=8, context=8)
+    fingerprint = dict(shape=(100,120), block_size=(64,64), kwargs=dict(prob_thresh=np.float32(0.5)))
+    checkpoint = BlockCheckpoint(str(tmpdir), fingerprint)
+
+    labels = checkpoint.labels_out((100,120), np.uint32)
+    labels[:] = 7
+    polys = dict(prob=np.random.uniform(size=5), points=np.random.randint(0,100,(5,3)),
+                 dist=np.random.uniform(1,2,(5,16)), rays=Rays_GoldenSpiral(16))
+    assert not checkpoint.is_done(blocks[1])
+    checkpoint.save(blocks[1], polys, 42, labels)
+    assert checkpoint.is_done(blocks[1]) and not checkpoint.is_done(blocks[0])
+
+    # resume
+    checkpoint = BlockCheckpoint(str(tmpdir), fingerprint)
+    assert np.all(checkpoint.labels_out((100,120), np.uint32) == 7)
+    polys2 = checkpoint.load(blocks[1], 42)
+    assert set(polys) == set(polys2)
+    assert all(np.array_equal(polys[k],polys2[k]) for k in ('prob','points','dist'))
+    assert np.array_equal(polys['rays'].vertices, polys2['rays'].vertices)
+    with pytest.raises(RuntimeError):
+        checkpoint.load(blocks[1], 43)
+    with pytest.raises(ValueError):
+        checkpoint.labels_out((100,120), np.int32)
+    with pytest.raises(ValueError):
+        BlockCheckpoint(str(tmpdir), {**fingerprint, 'block_size':(32,32)})
+
+
+
+def test_predict_big_cleanup(tmpdir, monkeypatch, model2d_random, img2d):
+    import threading
+    from tifffile import imwrite
+    from stardist.big import TiledTiffArray
+    fname = str(tmpdir / 'img.tif')
+    imwrite(fname, img2d.astype(np.float32), tile=(64,64))
+
+    # exception during prediction of second block
+    predict_instances, n_calls = model2d_random.predict_instances, []
+    def predict_instances_failing(*args, **kwargs):
+        n_calls.append(1)
+        len(n_calls) < 2 or _raise(RuntimeError("interrupted"))
+        return predict_instances(*args, **kwargs)
+    monkeypatch.setattr(model2d_random, 'predict_instances', predict_instances_failing)
+    n_closed = []
+    monkeypatch.setattr(TiledTiffArray, 'close', lambda self: (n_closed.append(1), self._tif.close()))
+
+    with pytest.raises(RuntimeError):
+        model2d_random.predict_instances_big(fname, axes='YX', block_size=128, min_overlap=32, context=32,
+                                             reader_kwargs=dict(prefetch=2), show_progress=False)
+    # file is closed and prefetching threads are stopped
+    assert len(n_calls) == 2 and len(n_closed) == 1
+    assert not any(t.name.startswith('ThreadPoolExecutor') for t in threading.enumerate())
+
+
+
+def test_predict_big_checkpoint(tmpdir, monkeypatch, model2d_random):
+    from csbdeep.data import PercentileNormalizer
+    img = real_image2d()[0]
+    prob_thresh = float(np.quantile(model2d_random.predict(normalize(img, 1, 99.8))[0], 0.98))
+    kwargs = dict(axes='YX', block_size=128, min_overlap=32, context=32, normalizer=PercentileNormalizer(1, 99.8),
+                  prob_thresh=prob_thresh, show_progress=False, return_instances=True)
+    labels_ref, polys_ref = model2d_random.predict_instances_big(img, **kwargs)
+    n_blocks = len(BlockND.cover(img.shape, 'YX', 128, 32, 32, grid=model2d_random._axes_div_by('YX')))
+
+    # interrupted by exception during prediction of third block
+    predict_instances, n_calls = model2d_random.predict_instances, []
+    def predict_instances_failing(*args, **kwargs):
+        n_calls.append(1)
+        len(n_calls) != 3 or _raise(RuntimeError("interrupted"))
+        return predict_instances(*args, **kwargs)
+    monkeypatch.setattr(model2d_random, 'predict_instances', predict_instances_failing)
+    with pytest.raises(RuntimeError):
+        model2d_random.predict_instances_big(img, checkpoint_dir=str(tmpdir), **kwargs)
+
+    # can't resume with different configuration, e.g. normalization
+    with pytest.raises(ValueError):
+        model2d_random.predict_instances_big(img, checkpoint_dir=str(tmpdir), **{**kwargs, 'normalizer': PercentileNormalizer(3, 99.8)})
+
+    # resume: only remaining blocks are predicted, result identical to uninterrupted prediction
+    n_calls_before = len(n_calls)
+    labels, polys = model2d_random.predict_instances_big(img, checkpoint_dir=str(tmpdir), **kwargs)
+    assert len(n_calls) - n_calls_before == n_blocks - 2
+    assert polys_ref.n_objects > 0 and np.array_equal(labels, labels_ref)
+    assert all(np.array_equal(v, polys.columns[k]) for k,v in polys_ref.columns.items())
+    assert np.allclose(polys['coord'], polys_ref['coord'])
+
+
+
+def test_predict_big_auto_tiles(monkeypatch, model2d_random, img2d):
+    img = np.tile(img2d, (2,2))
+
+    # n_tiles='auto' is resolved once (for the largest block), not for every block
+    suggest_n_tiles, shapes = model2d_random.suggest_n_tiles, []
+    def suggest_n_tiles_counting(shape, *args, **kwargs):
+        shapes.append(tuple(shape))
+        return suggest_n_tiles(shape, *args, **kwargs)
+    monkeypatch.setattr(model2d_random, 'suggest_n_tiles', suggest_n_tiles_counting)
+    n_tiles, block_shapes = [], []
+    predict_instances = model2d_random.predict_instances
+    def predict_instances_recording(x, *args, **kwargs):
+        n_tiles.append(kwargs.get('n_tiles'))
+        block_shapes.append(x.shape)
+        return predict_instances(x, *args, **kwargs)
+    monkeypatch.setattr(model2d_random, 'predict_instances', predict_instances_recording)
+
+    model2d_random.predict_instances_big(img, axes='YX', block_size=256, min_overlap=32, context=32, n_tiles='auto',
+                                         memory_budget=model2d_random.estimate_memory((256,256), n_tiles=(2,1))['total'], show_progress=False)
+    assert len(shapes) == 1 and shapes[0] == tuple(np.max(block_shapes, axis=0))
+    assert len(n_tiles) > 1 and all(t == n_tiles[0] and np.prod(t) > 1 for t in n_tiles)
+
+
+
+@pytest.mark.parametrize('filter_mode', ['labels', 'bbox'])
+def test_predict_big_prescan(monkeypatch, model2d_random, img2d, filter_mode):
+    from stardist.big import ForegroundPrescan, BlockReader
+    img = np.concatenate([img2d, np.zeros_like(img2d)], axis=1)
+    kwargs = dict(axes='YX', block_size=128, min_overlap=32, context=32, prob_thresh=0.5, filter_mode=filter_mode, show_progress=False)
+    blocks = BlockND.cover(img.shape, 'YX', 128, 32, 32, grid=model2d_random._axes_div_by('YX'))
+
+    # background blocks are neither read (and normalized) nor predicted
+    predict_instances, n_predicted = model2d_random.predict_instances, []
+    def predict_instances_recording(x, *args, **kwargs):
+        n_predicted.append(1)
+        return predict_instances(x, *args, **kwargs)
+    monkeypatch.setattr(model2d_random, 'predict_instances', predict_instances_recording)
+    reader_init, n_read = BlockReader.__init__, []
+    def reader_init_recording(self, img, blocks, *args, **kwargs):
+        n_read.append(len(blocks))
+        return reader_init(self, img, blocks, *args, **kwargs)
+    monkeypatch.setattr(BlockReader, '__init__', reader_init_recording)
+
+    prescan = ForegroundPrescan(threshold=0.5, margin=4)
+    labels, polys = model2d_random.predict_instances_big(img, prescan=prescan, return_instances=True, **kwargs)
+    assert 0 < len(n_predicted) == n_read[0] < len(blocks) and prescan.n_skipped >= len(blocks) - len(n_predicted)
+    assert labels.shape == img.shape and labels.max() == polys.n_objects and np.all(labels[:, -32:] == 0)
+
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.int16, np.float32])
+def test_streaming_normalizer(dtype):
+    from csbdeep.data import PercentileNormalizer
+    from stardist.big import StreamingPercentileNormalizer
+    rng = np.random.RandomState(42)
+    x = rng.gamma(2, 200, (257,301,2)) - (100 if dtype == np.int16 else 0)
+    x = (x if dtype == np.float32 else np.clip(x, np.iinfo(dtype).min, np.iinfo(dtype).max)).astype(dtype)
+
+    for axes, _x in (('YXC',x), ('YX',x[...,0]), ('CYX',np.moveaxis(x,-1,0))):
+        normalizer = StreamingPercentileNormalizer(1, 99.8, max_bytes=10**4, n_samples=10**4)
+        with pytest.raises(RuntimeError):
+            normalizer.before(_x, axes)
+        normalizer.fit(_x, axes)
+        y, y_ref = normalizer.before(_x, axes), PercentileNormalizer(1, 99.8).before(_x, axes)
+        if dtype == np.float32:
+            assert np.allclose(y, y_ref, atol=0.05)
+        else:
+            # exact percentiles from histogram
+            assert np.allclose(y, y_ref)
+        # fixed normalization (of whole image) applied to crop
+        crop = tuple(slice(10,100) if a != 'C' else slice(None) for a in axes)
+        assert np.allclose(normalizer.before(_x[crop], axes), y[crop])
+
+
+
+@pytest.mark.parametrize('downsample', [1, 8, (4,16)])
+def test_foreground_prescan(downsample):
+    from stardist.big import ForegroundPrescan
+    x = np.zeros((300,200,2), np.uint16)
+    x[100:110,50:60,1] = 1000
+
+    prescan = ForegroundPrescan(threshold=500, margin=20, downsample=downsample, max_bytes=1000).fit(x, 'YXC')
+    assert not prescan.is_background()
+    assert not prescan.is_background(dict(Y=(90,120)))
+    assert prescan.is_background(dict(Y=(140,300)))
+    assert prescan.is_background(dict(X=(0,20)))
+    # margin: region close to foreground is not background
+    assert not prescan.is_background(dict(Y=(0,85), X=(0,45)))
+    assert prescan.n_total == 5 and prescan.n_skipped == 2
+
+    # crop with offset
+    p = prescan.crop((slice(80,200),slice(40,None),slice(None)), 'YXC')
+    assert p.shape == (120,160) and p.n_total == 0
+    assert not p.is_background(dict(Y=(20,30), X=(10,20)))
+    assert p.is_background(dict(Y=(60,120)))
+
+    # automatic threshold and inverted intensities
+    assert ForegroundPrescan(margin=0, downsample=downsample).fit(x[...,1], 'YX').is_background(dict(Y=(0,80)))
+    p = ForegroundPrescan(margin=0, downsample=downsample, invert=True).fit(1000-x[...,1].astype(np.int32), 'YX')
+    assert p.is_background(dict(Y=(0,80))) and not p.is_background(dict(Y=(100,101)))
+
+
+
+@pytest.mark.parametrize('filter_mode', ['labels', 'bbox'])
 @pytest.mark.parametrize('use_channel', [False, True])
-def test_predict2D(model2d, use_channel):
+def test_predict2D(model2d, use_channel, filter_mode):
     model = model2d
     img = real_image2d()[0]
     img = normalize(img, 1, 99.8)
@@ -90,7 +446,7 @@ def test_predict2D(model2d, use_channel):
         axes += 'C'
 
     ref_labels, ref_polys = model.predict_instances(img, axes=axes)
-    res_labels, res_polys = model.predict_instances_big(img, axes=axes, block_size=288, min_overlap=32, context=96)
+    res_labels, res_polys = model.predict_instances_big(img, axes=axes, block_size=288, min_overlap=32, context=96, filter_mode=filter_mode)
 
     m = matching(ref_labels, res_labels)
     assert (1.0, 1.0) == (m.accuracy, m.mean_true_score)
@@ -114,14 +470,15 @@ def test_predict2D(model2d, use_channel):
 
 
 
-def test_predict3D(model3d):
+@pytest.mark.parametrize('filter_mode', ['labels', 'bbox'])
+def test_predict3D(model3d, filter_mode):
     model = model3d
     img = real_image3d()[0]
     img = normalize(img, 1, 99.8)
     img = repeat(img, 2)
 
     ref_labels, ref_polys = model.predict_instances(img)
-    res_labels, res_polys = model.predict_instances_big(img, axes='ZYX', block_size=(55,105,105), min_overlap=(13,25,25), context=(17,30,30))
+    res_labels, res_polys = model.predict_instances_big(img, axes='ZYX', block_size=(55,105,105), min_overlap=(13,25,25), context=(17,30,30), filter_mode=filter_mode)
 
     m = matching(ref_labels, res_labels)
     assert (1.0, 1.0) == (m.accuracy, m.mean_true_score)
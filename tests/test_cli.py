@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from tifffile import imread, imwrite
+from csbdeep.utils import normalize
+from stardist.cli import main, load_model, predict_files
+from utils import real_image2d, path_model2d, copy_model
+
+
+@pytest.mark.parametrize('workers', [0, 1])
+def test_predict_files(tmp_path, workers, monkeypatch):
+    from stardist import postprocess
+    # post-processing in the main process must reuse the loaded model
+    monkeypatch.setattr(postprocess, '_worker_params', {})
+    img = real_image2d()[0]
+    imgs = dict(a=img[:128,:128], b=img[128:,:128], c=img[:160,:96], d=img[128:,128:])
+    (tmp_path/'input').mkdir()
+    for name, x in imgs.items():
+        imwrite(str(tmp_path/'input'/f'{name}.tif'), x)
+    files = sorted((tmp_path/'input').glob('*.tif'))
+    outdir = tmp_path/'output'
+
+    model_path = copy_model(path_model2d(), tmp_path)
+    model = load_model(str(model_path))
+    stats = predict_files(model, files, outdir, batch_size=2, workers=workers, verbose=False)
+    assert stats['processed'] == len(imgs) and stats['skipped'] == 0
+    assert all(k in stats['stages'] for k in ('read','predict','postprocess','write'))
+    assert postprocess._worker_params == {}
+
+    for name, x in imgs.items():
+        labels_ref, polys_ref = model.predict_instances(normalize(x,1,99.8), show_tile_progress=False)
+        labels = imread(str(outdir/f'{name}.tif'))
+        assert labels.shape == labels_ref.shape and np.all(labels == labels_ref)
+        table = np.loadtxt(str(outdir/f'{name}.csv'), delimiter=',', skiprows=1, ndmin=2)
+        assert len(table) == len(polys_ref['prob']) == len(np.unique(labels))-1
+        assert np.allclose(table[:,1:3], polys_ref['points']) and np.allclose(table[:,3], polys_ref['prob'], atol=1e-5)
+        assert (outdir/f'{name}.rois.zip').exists()
+
+    # resume: only images with missing results are processed
+    mtime = {f: f.stat().st_mtime_ns for f in outdir.iterdir()}
+    (outdir/'b.csv').unlink()
+    assert main(['predict', str(tmp_path/'input'/'*.tif'), '-m', str(model_path), '-o', str(outdir), '--workers', str(workers), '-q']) == 0
+    assert (outdir/'b.csv').exists() and all(f.stat().st_mtime_ns == t for f,t in mtime.items() if not f.name.startswith('b.'))
+
+
+def test_predict_files_same_names(tmp_path, model2d_random):
+    img = real_image2d()[0]
+    for name, x in dict(a=img[:128,:128], b=img[128:,:128]).items():
+        (tmp_path/'input'/name).mkdir(parents=True)
+        imwrite(str(tmp_path/'input'/name/'img.tif'), x)
+    files = sorted((tmp_path/'input').glob('*/img.tif'))
+    outdir = tmp_path/'output'
+
+    # files with the same name in different folders are saved to the respective subfolders
+    stats = predict_files(model2d_random, files, outdir, outputs=('labels','csv'), workers=0, verbose=False)
+    assert stats['processed'] == 2 and all((outdir/name/f'img{s}').exists() for name in 'ab' for s in ('.tif','.csv'))
+    stats = predict_files(model2d_random, files, outdir, outputs=('labels','csv'), workers=0, verbose=False)
+    assert stats['processed'] == 0 and stats['skipped'] == 2
+
+    # files with the same name in the same folder would have the same output files
+    imwrite(str(tmp_path/'input'/'a'/'img.tiff'), img[:128,:128])
+    with pytest.raises(ValueError):
+        predict_files(model2d_random, sorted((tmp_path/'input').glob('*/img.tif*')), outdir, workers=0, verbose=False)
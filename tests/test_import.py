@@ -0,0 +1,45 @@
+import sys
+import subprocess
+import pytest
+
+
+def _loaded_modules(statement, heavy_modules):
+    code = f"""
+{statement}
+import sys
+print(' '.join(m for m in {heavy_modules!r} if m in sys.modules))
+"""
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return out.split()
+
+
+@pytest.mark.parametrize('statement', [
+    'import stardist',
+    'from stardist import non_maximum_suppression, polygons_to_label',
+    'from stardist import non_maximum_suppression_3d, polyhedron_to_label',
+])
+def test_import_modules(statement):
+    # heavy dependencies are only imported when needed (import time is tracked by benchmarks/bench_import.py)
+    heavy_modules = ('tensorflow', 'matplotlib', 'numba', 'scipy.optimize', 'skimage.measure', 'stardist.models')
+    loaded = _loaded_modules(statement, heavy_modules)
+    assert loaded == [], f"'{statement}' imports {loaded}"
+
+
+def test_import_postprocess():
+    # worker processes for non-maximum suppression and rendering don't need TensorFlow
+    loaded = _loaded_modules('from stardist.postprocess import instances_from_prediction, _init_worker', ('tensorflow', 'stardist.models'))
+    assert loaded == []
+
+
+def test_lazy_attributes():
+    import stardist
+    assert 'polygons_to_label' in dir(stardist) and 'models' in dir(stardist)
+    from stardist import polygons_to_label
+    from stardist.geometry import polygons_to_label as _polygons_to_label
+    assert polygons_to_label is _polygons_to_label
+    assert stardist.matching is sys.modules['stardist.matching']
+    with pytest.raises(AttributeError):
+        stardist.does_not_exist
+    namespace = {}
+    exec('from stardist import *', namespace)
+    assert all(name in namespace for name in stardist.__all__)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from stardist import StarDistInstances, Rays_GoldenSpiral, dist_to_coord
+from stardist.geometry import dist_to_coord3D
+
+
+
+def random_instances(n, n_dim, n_rays, n_classes=None, seed=42):
+    rng = np.random.RandomState(seed)
+    points = rng.randint(10, 100, (n,n_dim))
+    prob = np.sort(rng.uniform(0.5, 1, n))
+    dist = rng.uniform(2, 8, (n,n_rays)).astype(np.float32)
+    class_prob = None if n_classes is None else rng.dirichlet(np.ones(n_classes+1), n)
+    rays = None if n_dim == 2 else Rays_GoldenSpiral(n_rays)
+    return StarDistInstances(points, prob, dist, class_prob=class_prob, rays=rays)
+
+
+
+@pytest.mark.parametrize('n_dim', (2,3))
+@pytest.mark.parametrize('n_classes', (None,2))
+def test_instances(n_dim, n_classes):
+    polys = random_instances(50, n_dim, 16 if n_dim==2 else 32, n_classes)
+    assert polys.n_objects == 50 and polys.points.dtype == np.int32 and polys.dist.dtype == np.float32
+
+    # dict-compatible access
+    keys = ['coord','dist','points','prob'] if n_dim==2 else ['dist','points','prob','rays','rays_vertices','rays_faces']
+    if n_classes is not None:
+        keys += ['class_prob','class_id']
+        assert np.array_equal(polys['class_id'], np.argmax(polys['class_prob'], axis=-1))
+    assert list(polys) == list(polys.keys()) == keys and set(polys.to_dict()) == set(keys)
+    assert len(polys) == len(keys) and polys.n_objects == 50
+    assert all(k in polys for k in keys) and 'foo' not in polys and polys.get('foo') is None
+    with pytest.raises(KeyError):
+        polys['foo']
+
+    # derived quantities
+    coord = polys.coord
+    if n_dim == 2:
+        assert np.allclose(coord, dist_to_coord(polys.dist, polys.points)) and polys['coord'] is coord
+        y, x = coord.transpose(1,0,2)
+        area = 0.5*np.abs(np.sum(x*np.roll(y,1,axis=1) - y*np.roll(x,1,axis=1), axis=1))
+        mins, maxs = coord.min(axis=-1), coord.max(axis=-1)
+    else:
+        assert np.allclose(coord, dist_to_coord3D(polys.dist, polys.points, polys.rays.vertices))
+        area = polys.rays.volume(polys.dist)
+        mins, maxs = coord.min(axis=1), coord.max(axis=1)
+    assert np.allclose(polys.area, area, rtol=1e-4)
+    assert polys.bbox.shape == (50,2*n_dim)
+    assert np.all(polys.bbox[:,:n_dim] <= mins) and np.all(maxs < polys.bbox[:,n_dim:])
+    assert np.all(polys.bbox[:,n_dim:] - polys.bbox[:,:n_dim] <= np.ceil(maxs-mins)+1)
+
+    # subsets: slices are views, also of cached quantities
+    sub = polys[10:20]
+    assert sub.n_objects == 10 and all(np.shares_memory(sub.columns[k], v) for k,v in polys.columns.items())
+    assert np.shares_memory(sub.coord, coord) and np.array_equal(sub.area, polys.area[10:20])
+    mask = polys.prob > 0.75
+    assert np.array_equal(polys[mask]['prob'], polys.prob[mask])
+    assert np.array_equal(polys[[3,1]].points, polys.points[[3,1]]) and polys[[]].n_objects == 0
+    assert np.array_equal(polys[-1].dist, polys.dist[-1:])
+    with pytest.raises(IndexError):
+        polys[50]
+
+    # concatenation and translation
+    both = StarDistInstances.concatenate([polys[:20], polys[20:].translate((5,)*n_dim)])
+    assert both.n_objects == 50 and np.array_equal(both.dist, polys.dist)
+    assert np.array_equal(both.points[20:], polys.points[20:]+5) and np.allclose(both.coord[20:], coord[20:]+5)
+    with pytest.raises(ValueError):
+        StarDistInstances.concatenate([polys, random_instances(5, n_dim, 8)])
+
+    # reduced precision and empty
+    polys16 = StarDistInstances(polys.points, polys.prob, polys.dist, rays=polys.rays, dist_dtype=np.float16)
+    assert polys16.dist.dtype == np.float16 and polys16.nbytes < polys.nbytes
+    assert np.allclose(polys16.area, polys.area, rtol=1e-2)
+    empty = polys[polys.prob > 2]
+    assert empty.n_objects == 0 and empty.coord.shape[0] == empty.area.shape[0] == empty.bbox.shape[0] == 0
+    with pytest.raises(ValueError):
+        StarDistInstances(polys.points.astype(float)+0.5, polys.prob, polys.dist, rays=polys.rays)
+
+
+
+def test_predict_instances(model2d_random, img2d):
+    prob, dist = model2d_random.predict(img2d)
+    prob_thresh = float(np.quantile(prob, 0.98))
+
+    labels, polys = model2d_random.predict_instances(img2d, prob_thresh=prob_thresh, show_tile_progress=False, return_instances=True)
+    assert isinstance(polys, StarDistInstances) and polys.n_objects > 0 and labels.max() == polys.n_objects
+    assert np.allclose(polys['coord'], dist_to_coord(polys.dist, polys.points))
+
+    _, polys16 = model2d_random.predict_instances(img2d, prob_thresh=prob_thresh, dist_dtype=np.float16, show_tile_progress=False, return_instances=True)
+    assert polys16.dist.dtype == np.float16 and np.array_equal(polys16.points, polys.points)
+
+    # plain dictionary by default
+    _, details = model2d_random.predict_instances(img2d, prob_thresh=prob_thresh, show_tile_progress=False)
+    assert type(details) is dict and set(details) == set(polys) and len(details['prob']) == polys.n_objects
+    assert all(np.array_equal(details[k], polys[k]) for k in polys)
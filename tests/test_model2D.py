@@ -7,8 +7,8 @@ from stardist.models import Config2D, StarDist2D, StarDistData2D
 from stardist.matching import matching
 from stardist.utils import export_imagej_rois
 from stardist.plot import render_label, render_label_pred
-from csbdeep.utils import normalize
-from utils import circle_image, real_image2d, path_model2d, NumpySequence
+from csbdeep.utils import normalize, _raise
+from utils import circle_image, real_image2d, path_model2d, copy_model, NumpySequence
     
 
 @pytest.mark.parametrize('n_rays, grid, n_channel, workers, use_sequence', [(17, (1, 1), None, 1, False), (32, (2, 4), 1, 4, False), (4, (8, 2), 2, 1, True)])
@@ -87,8 +87,8 @@ def test_load_and_predict(model2d):
     assert (stats.fp, stats.tp, stats.fn) == (1, 48, 17)
     return labels
 
-def test_load_and_predict_big():
-    model_path = path_model2d()
+def test_load_and_predict_big(tmp_path):
+    model_path = copy_model(path_model2d(), tmp_path)
     model = StarDist2D(None, name=model_path.name,
                        basedir=str(model_path.parent))
     img, _ = real_image2d()
@@ -113,6 +113,147 @@ def test_optimize_thresholds(model2d):
     np.testing.assert_almost_equal(res["nms"] , 0.3, decimal=3)
 
 
+def test_optimize_thresholds_parallel(model2d, monkeypatch):
+    import concurrent.futures
+    pools, tasks = [], []
+    class CountingPool(concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+        def submit(self, fn, *args, **kwargs):
+            tasks.append(args)
+            return super().submit(fn, *args, **kwargs)
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', CountingPool)
+
+    model = model2d
+    img, mask = real_image2d()
+    x = normalize(img, 1, 99.8)
+
+    kwargs = dict(nms_threshs=[.3, .4, .5], iou_threshs=[.3, .5], optimize_kwargs=dict(tol=1e-1), save_to_json=False)
+    res1 = model.optimize_thresholds([x, x[:, ::-1]], [mask, mask[:, ::-1]], parallel=False, **kwargs)
+    assert len(pools) == 0
+    res2 = model.optimize_thresholds([x, x[:, ::-1]], [mask, mask[:, ::-1]], parallel=True, **kwargs)
+    assert res1 == res2
+    # single process pool for all images and nms_threshs
+    assert len(pools) == 1
+    assert {(i, nms_thresh) for i, _, nms_thresh, _ in tasks} == {(i, nms_thresh) for i in range(2) for nms_thresh in kwargs['nms_threshs']}
+
+
+@pytest.mark.parametrize('grid', [(1, 1), (2, 2)])
+def test_optimize_thresholds_grid(grid):
+    from stardist import star_dist, edt_prob
+    from stardist.matching import matching_dataset
+    from stardist.utils import optimize_thresholds_grid
+    model = StarDist2D(Config2D(n_rays=32, grid=grid), None, None)
+    _, mask = real_image2d()
+    masks = [mask, mask[:, ::-1]]
+    rng = np.random.RandomState(42)
+    # synthetic (noisy) predictions derived from the ground truth
+    Yhat = []
+    for y in masks:
+        prob = (edt_prob(y) + 0.3*rng.uniform(size=y.shape)) / 1.3
+        dist = star_dist(y, n_rays=32) * rng.uniform(0.8, 1.2, size=y.shape+(1,))
+        sl = tuple(slice(None,None,g) for g in grid)
+        Yhat.append((prob[sl], np.maximum(1e-3, dist[sl])))
+
+    prob_threshs, nms_threshs, iou_threshs = [.2, .5, .4, .7], [.3, .5], [.3, .5, .7]
+    prob, nms, value, scores = optimize_thresholds_grid(masks, Yhat, model, prob_threshs, nms_threshs,
+                                                        iou_threshs=iou_threshs, verbose=0)
+    assert scores.shape == (len(nms_threshs), len(prob_threshs))
+    assert value == np.max(scores) and value == scores[nms_threshs.index(nms), prob_threshs.index(prob)]
+
+    for i, nms_thresh in enumerate(nms_threshs):
+        for j, prob_thresh in enumerate(prob_threshs):
+            Y_pred = [model._instances_from_prediction(y.shape, *yhat, prob_thresh=prob_thresh, nms_thresh=nms_thresh)[0]
+                      for y, yhat in zip(masks, Yhat)]
+            stats = matching_dataset(masks, Y_pred, thresh=iou_threshs, show_progress=False)
+            assert np.isclose(scores[i, j], np.mean([s.accuracy for s in stats]))
+
+    # same scores if images and nms_threshs are processed concurrently by worker processes
+    _, _, _, scores_parallel = optimize_thresholds_grid(masks, Yhat, model, prob_threshs, nms_threshs,
+                                                        iou_threshs=iou_threshs, verbose=0, parallel=True)
+    assert np.allclose(scores, scores_parallel)
+
+
+@pytest.mark.parametrize('grid', [(1, 1), (2, 2)])
+def test_estimate_memory(grid):
+    model = StarDist2D(Config2D(n_rays=32, grid=grid), None, None)
+    mem1, mem2 = model.estimate_memory((256,256)), model.estimate_memory((512,512))
+    assert mem1['total'] == max(mem1['image']+mem1['network']+mem1['outputs'], mem1['outputs']+mem1['candidates']+mem1['labels'])
+    # memory scales with number of pixels
+    assert all(mem2[k] == 4*mem1[k] for k in ('image','network','outputs','labels'))
+    assert mem2['network'] > model.estimate_memory((512,512), n_tiles=(2,2))['network']
+    assert model.estimate_memory((512,512), sparse=True)['outputs'] == 0
+
+    # peak of live activations is between the largest and the sum of all (actual) layer outputs
+    from tensorflow import keras
+    layers = [l for l in model.keras_model.layers if not isinstance(l, keras.layers.InputLayer)]
+    activations = keras.Model(model.keras_model.inputs, [l.output for l in layers])(np.zeros((1,256,256,1), np.float32))
+    nbytes = [a.numpy().nbytes for a in activations]
+    assert max(nbytes) <= mem1['network'] <= sum(nbytes) + mem1['image']
+
+    budget = mem2['total'] // 2
+    n_tiles = model.suggest_n_tiles((512,512), memory_budget=budget, verbose=False)
+    assert np.prod(n_tiles) > 1 and model.estimate_memory((512,512), n_tiles=n_tiles)['total'] <= budget
+    assert model.suggest_n_tiles((512,512), memory_budget=mem2['total'], verbose=False) == (1,1)
+    assert model.suggest_n_tiles((512,512,1), axes='YXC', memory_budget=budget, verbose=False)[-1] == 1
+
+    x = np.zeros((160,192), np.float32)
+    prob, dist = model.predict(x, n_tiles='auto', show_tile_progress=False)
+    assert prob.shape == tuple(s//g for s,g in zip(x.shape,grid))
+
+
+def test_receptive_field_cache(tmpdir):
+    model = StarDist2D(Config2D(n_rays=8, grid=(2,2), unet_n_depth=2), name='model', basedir=str(tmpdir))
+    overlap = model._axes_tile_overlap('YX')
+    assert overlap == tuple(max(rf) for rf in model._compute_receptive_field())
+    assert (model.logdir / 'receptive_field.json').exists()
+    model.keras_model.save_weights(str(model.logdir / 'weights_best.h5'))
+
+    def _count_calls(model):
+        compute, model.n_calls = model._compute_receptive_field, 0
+        def _compute(*args, **kwargs):
+            model.n_calls += 1
+            return compute(*args, **kwargs)
+        model._compute_receptive_field = _compute
+        return model
+
+    # cached receptive field is reused for the same weights
+    model = _count_calls(StarDist2D(None, name='model', basedir=str(tmpdir)))
+    assert model._axes_tile_overlap('YX') == overlap and model.n_calls == 0
+    # but not for different weights
+    model = _count_calls(StarDist2D(None, name='model', basedir=str(tmpdir)))
+    model.keras_model.set_weights([w*1.1 for w in model.keras_model.get_weights()])
+    model._axes_tile_overlap('YX')
+    assert model.n_calls == 1
+
+    # weights are not hashed without model directory (no cache file)
+    model = StarDist2D(Config2D(n_rays=8, grid=(2,2), unet_n_depth=2), None, None)
+    model._weights_hash = lambda: _raise(AssertionError("weights hashed"))
+    assert len(model._axes_tile_overlap('YX')) == 2
+
+
+def test_from_pretrained_cache(monkeypatch):
+    from csbdeep.models.base_model import BaseModel
+    n_loaded = []
+    def _from_pretrained(cls, name_or_alias=None):
+        n_loaded.append(name_or_alias)
+        return cls(Config2D(n_rays=8, grid=(2,2), unet_n_depth=2), None, None)
+    monkeypatch.setattr(BaseModel, 'from_pretrained', classmethod(_from_pretrained))
+
+    StarDist2D.clear_pretrained_cache()
+    model = StarDist2D.from_pretrained('2D_demo')
+    assert StarDist2D.from_pretrained('2D_demo') is model and len(n_loaded) == 1
+    assert StarDist2D.from_pretrained('2D_demo', cache=False) is not model and len(n_loaded) == 2
+    StarDist2D.clear_pretrained_cache()
+    assert StarDist2D.from_pretrained('2D_demo') is not model and len(n_loaded) == 3
+    StarDist2D.clear_pretrained_cache()
+
+    durations = model.warmup([(64,96), (128,128)])
+    assert set(durations) == {(64,96), (128,128)}
+    assert model.warmup((64,64,1), axes='YXC', n_tiles=(2,1,1)).keys() == {(64,64,1)}
+
+
 def test_stardistdata(n_classes = None, classes = 1):
     np.random.seed(42)
     from stardist.models import StarDistData2D
@@ -429,14 +570,188 @@ def test_pretrained_integration():
 
 
 # this test has to be at the end of the model
-def test_load_and_export_TF(model2d):
+def test_load_and_export_TF(tmp_path, model2d):
     model = model2d
     assert any(g>1 for g in model.config.grid)
     # model.export_TF(single_output=False, upsample_grid=False)
     # model.export_TF(single_output=False, upsample_grid=True)
-    model.export_TF(single_output=True, upsample_grid=False)
-    model.export_TF(single_output=True, upsample_grid=True)
+    model.export_TF(str(tmp_path/'TF_SavedModel.zip'), single_output=True, upsample_grid=False)
+    model.export_TF(str(tmp_path/'TF_SavedModel.zip'), single_output=True, upsample_grid=True)
     
+def test_candidates_in_graph(tmp_path, model2d_random, img2d):
+    import zipfile
+    import tensorflow as tf
+    prob_thresh = np.median(model2d_random.predict(img2d)[0])
+    prob_ref, dist_ref, points_ref = model2d_random.predict_sparse(img2d, prob_thresh=prob_thresh, show_tile_progress=False)
+
+    # keep candidates with highest probabilities (in same order as without limit)
+    for n_tiles in (None, (2,2)):
+        prob, dist, points = model2d_random.predict_sparse(img2d, prob_thresh=prob_thresh, n_tiles=n_tiles, max_candidates=100, show_tile_progress=False)
+        assert 0 < len(prob) <= 100*np.prod(n_tiles or 1)
+        ind = np.ravel_multi_index(tuple(points_ref.T), img2d.shape)
+        ind_sel = np.minimum(np.searchsorted(ind, np.ravel_multi_index(tuple(points.T), img2d.shape)), len(ind)-1)
+        assert np.all(ind[ind_sel] == np.ravel_multi_index(tuple(points.T), img2d.shape))
+        assert np.allclose(prob, prob_ref[ind_sel]) and np.allclose(dist, dist_ref[ind_sel], rtol=1e-4, atol=1e-5)
+        if n_tiles is None:
+            assert np.all(np.diff(ind_sel) > 0) and np.min(prob) >= np.sort(prob_ref)[-100]
+
+    # combined with pre-scan: tiles (or image) in background are skipped, region of candidates unaffected
+    from stardist.big import ForegroundPrescan
+    img_bg = img2d.copy()
+    img_bg[:,:3*img2d.shape[1]//4] = 0
+    for n_tiles in (None, (2,2)):
+        prescan_kwargs = dict(threshold=0.5, margin=4)
+        res_ref = model2d_random.predict_sparse(img_bg, prob_thresh=prob_thresh, n_tiles=n_tiles, show_tile_progress=False,
+                                                prescan=ForegroundPrescan(**prescan_kwargs))
+        for kwargs in (dict(sparse_dist=True), dict(max_candidates=10**6)):
+            prescan = ForegroundPrescan(**prescan_kwargs)
+            res = model2d_random.predict_sparse(img_bg, prob_thresh=prob_thresh, n_tiles=n_tiles, show_tile_progress=False, prescan=prescan, **kwargs)
+            assert prescan.n_skipped == (0 if n_tiles is None else 2)
+            assert len(res[0]) > 0 and all(np.allclose(r, r_ref, rtol=1e-4, atol=1e-5) for r, r_ref in zip(res, res_ref))
+
+    fname = model2d_random.export_TF_candidates(str(tmp_path/'candidates.zip'), prob_thresh=prob_thresh)
+    with zipfile.ZipFile(str(fname)) as f:
+        f.extractall(str(tmp_path/'candidates'))
+    serve = tf.saved_model.load(str(tmp_path/'candidates')).signatures['serving_default']
+    res = serve(input=tf.constant(img2d[np.newaxis,...,np.newaxis], tf.float32))
+    assert set(res.keys()) == {'points','prob','dist'}
+    assert np.all(res['points'].numpy() == points_ref)
+    assert np.allclose(res['prob'].numpy(), prob_ref) and np.allclose(res['dist'].numpy(), dist_ref, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_predict_instances_iter(processes, model2d_random, img2d):
+    imgs = np.stack([img2d[:128,:160], img2d[64:192,:160], img2d[128:,96:], img2d[:128,96:256], img2d[100:228,50:210]])
+    images = (x for x in list(imgs[:3]) + [img2d[:96,:96]] + list(imgs[3:]))
+    results = list(model2d_random.predict_instances_iter(images, batch_size=2, workers=2, processes=processes, prob_thresh=0.5))
+    assert len(results) == len(imgs) + 1
+    for x, (labels, polys) in zip(list(imgs[:3]) + [img2d[:96,:96]] + list(imgs[3:]), results):
+        labels_ref, polys_ref = model2d_random.predict_instances(x, prob_thresh=0.5, show_tile_progress=False)
+        assert np.all(labels == labels_ref) and np.allclose(polys['coord'], polys_ref['coord'])
+
+    # time-lapse (first axis is iterated over)
+    for t, (labels, polys) in enumerate(model2d_random.predict_instances_iter(imgs, batch_size=4, n_tiles=(1,2), max_pending=1, prob_thresh=0.5)):
+        labels_ref, _ = model2d_random.predict_instances(imgs[t], n_tiles=(1,2), prob_thresh=0.5, show_tile_progress=False)
+        assert np.all(labels == labels_ref)
+    assert t == len(imgs)-1
+
+
+def test_init_worker(monkeypatch, model2d_random, img2d):
+    from stardist import postprocess
+    monkeypatch.setattr(postprocess, '_worker_params', {})
+    model2d_random.thresholds = dict(prob=0.6, nms=0.3)
+
+    # worker only gets the (picklable) post-processing parameters, not a model instance
+    postprocess._init_worker({None: postprocess.postprocess_params(model2d_random)})
+    assert postprocess._worker_params[None]['thresholds'] == model2d_random.thresholds._asdict()
+
+    prob, dist = model2d_random.predict(img2d)
+    labels, polys = postprocess._instances_from_prediction_worker(img2d.shape, prob, dist)
+    labels_ref, polys_ref = model2d_random._instances_from_prediction(img2d.shape, prob, dist)
+    assert np.all(labels == labels_ref) and np.array_equal(polys.points, polys_ref.points)
+
+
+def test_prediction_workspace(model2d_random, img2d):
+    from stardist.models import PredictionWorkspace
+    workspace = PredictionWorkspace()
+    for x in (img2d, img2d[::-1]):
+        prob_ref, dist_ref = model2d_random.predict(x, n_tiles=(2,2), show_tile_progress=False)
+        labels_ref, polys_ref = model2d_random.predict_instances(x, n_tiles=(2,2), show_tile_progress=False, prob_thresh=0.5)
+        n_allocations = workspace.n_allocations
+        prob, dist = model2d_random.predict(x, n_tiles=(2,2), show_tile_progress=False, workspace=workspace)
+        assert np.allclose(prob, prob_ref) and np.allclose(dist, dist_ref)
+        assert np.shares_memory(prob, workspace.buffers['prob']) and np.shares_memory(dist, workspace.buffers['dist'])
+        labels, polys = model2d_random.predict_instances(x, n_tiles=(2,2), show_tile_progress=False, prob_thresh=0.5, workspace=workspace)
+        assert np.all(labels == labels_ref) and np.allclose(polys['coord'], polys_ref['coord'])
+        assert np.shares_memory(labels, workspace.buffers['labels'])
+        # buffers are only allocated once (for the first image)
+        assert workspace.n_allocations == (3 if x is img2d else n_allocations)
+    assert workspace.nbytes == sum(b.nbytes for b in workspace.buffers.values())
+
+    # outputs of non-tiled prediction are not taken from the workspace
+    prob, dist = model2d_random.predict(img2d, show_tile_progress=False, workspace=workspace)
+    assert not np.shares_memory(prob, workspace.buffers['prob']) and workspace.n_allocations == 3
+
+
+@pytest.mark.parametrize('n_tiles', [None, (2,2)])
+def test_predict_reduced_precision(n_tiles, model2d_random, img2d):
+    prob_ref, dist_ref = model2d_random.predict(img2d, n_tiles=n_tiles, show_tile_progress=False)
+    for prob_dtype, dist_dtype, dist_scale in ((np.float16, np.float16, None), (np.uint8, np.float16, None), (np.uint8, np.uint16, 64)):
+        prob, dist = model2d_random.predict(img2d, n_tiles=n_tiles, show_tile_progress=False, prob_dtype=prob_dtype, dist_dtype=dist_dtype, dist_scale=dist_scale)
+        assert prob.dtype == prob_dtype and dist.dtype == dist_dtype
+        assert np.allclose(prob / (255 if prob_dtype == np.uint8 else 1), prob_ref, atol=1/255)
+        assert np.allclose(dist / (dist_scale or 1), dist_ref, rtol=1e-3, atol=1e-3 if dist_scale is None else 1/dist_scale)
+        labels, polys = model2d_random.predict_instances(img2d, n_tiles=n_tiles, show_tile_progress=False, prob_dtype=prob_dtype, dist_dtype=dist_dtype, dist_scale=dist_scale, return_instances=True)
+        assert labels.shape == img2d.shape and polys['prob'].dtype == np.float32
+        assert polys.dist.dtype == (np.float16 if dist_dtype == np.float16 else np.float32)
+    with pytest.raises(ValueError):
+        model2d_random.predict(img2d, dist_dtype=np.int32)
+    with pytest.raises(ValueError):
+        # integer distances require a scale
+        model2d_random.predict(img2d, dist_dtype=np.uint16)
+    mem32, mem16 = model2d_random.estimate_memory(img2d.shape, n_tiles=n_tiles), model2d_random.estimate_memory(img2d.shape, n_tiles=n_tiles, prob_dtype=np.float16, dist_dtype=np.float16)
+    assert mem16['outputs'] == mem32['outputs'] // 2
+    # peak memory is only reduced for tiled prediction (float32 network outputs are converted afterwards otherwise)
+    assert (mem16['total'] < mem32['total']) if n_tiles is not None else (mem16['total'] >= mem32['total'])
+
+
+@pytest.mark.parametrize('n_tiles', [None, (2,3)])
+@pytest.mark.parametrize('n_classes', [None, 2])
+def test_predict_sparse_dist(n_tiles, n_classes, img2d):
+    model = StarDist2D(Config2D(n_rays=16, grid=(2,2), unet_n_depth=2, n_channel_in=1, n_classes=n_classes), None, None)
+    prob_thresh = np.median(model.predict(img2d)[0])
+    res_ref = model.predict_sparse(img2d, prob_thresh=prob_thresh, n_tiles=n_tiles, show_tile_progress=False)
+    res     = model.predict_sparse(img2d, prob_thresh=prob_thresh, n_tiles=n_tiles, show_tile_progress=False, sparse_dist=True)
+    assert len(res[0]) > 0 and len(res) == len(res_ref)
+    for r, r_ref in zip(res, res_ref):
+        assert r.shape == r_ref.shape and np.allclose(r, r_ref, rtol=1e-4, atol=1e-5)
+    labels_ref, _ = model.predict_instances(img2d, prob_thresh=prob_thresh, n_tiles=n_tiles, show_tile_progress=False, sparse=True)
+    labels, _     = model.predict_instances(img2d, prob_thresh=prob_thresh, n_tiles=n_tiles, show_tile_progress=False, sparse_dist=True)
+    assert np.all(labels == labels_ref)
+
+
+@pytest.mark.parametrize('upsample_grid', [False, True])
+def test_inference_backend(tmp_path, upsample_grid, monkeypatch, model2d_random, img2d):
+    from stardist.models import InferenceBackend, register_backend
+    from stardist.models import backend as backend_module
+    from stardist.models.backend import KerasBackend
+    # registered test backend is removed afterwards
+    monkeypatch.setattr(backend_module, '_backends', dict(backend_module._backends))
+    prob_ref, dist_ref = model2d_random.predict(img2d, n_tiles=(2,2), show_tile_progress=False)
+    labels_ref, _ = model2d_random.predict_instances(img2d, sparse=True, show_tile_progress=False)
+    assert isinstance(model2d_random.backend, KerasBackend)
+
+    class CountingBackend(InferenceBackend):
+        def __init__(self, model):
+            super().__init__(model)
+            self.keras_backend, self.n_calls = KerasBackend(model), 0
+        def predict(self, x, **kwargs):
+            self.n_calls += 1
+            return self.keras_backend.predict(x, **kwargs)
+    register_backend('counting', CountingBackend)
+    backend = model2d_random.set_backend('counting')
+    model2d_random.predict_instances_big(img2d, axes='YX', block_size=128, min_overlap=16, context=32, show_progress=False)
+    assert backend.n_calls > 1
+    with pytest.raises(ValueError):
+        model2d_random.set_backend(InferenceBackend(StarDist2D(Config2D(n_rays=8, n_channel_in=1), None, None)))
+
+    model2d_random.export_TF(str(tmp_path/'model.zip'), single_output=True, upsample_grid=upsample_grid)
+    backend = model2d_random.set_backend('savedmodel', fname=str(tmp_path/'model.zip'), upsample_grid=upsample_grid)
+    assert model2d_random.backend is backend
+    prob, dist = model2d_random.predict(img2d, n_tiles=(2,2), show_tile_progress=False)
+    assert np.allclose(prob, prob_ref, atol=1e-5) and np.allclose(dist, dist_ref, atol=1e-4)
+    labels, _ = model2d_random.predict_instances(img2d, sparse=True, show_tile_progress=False)
+    assert np.all(labels == labels_ref)
+
+    # specification is derived from the export, which doesn't match models with other n_rays or n_channel_in
+    for config in (Config2D(n_rays=8, grid=(2,2), unet_n_depth=2, n_channel_in=1), Config2D(n_rays=16, grid=(2,2), unet_n_depth=2, n_channel_in=2)):
+        with pytest.raises(ValueError):
+            StarDist2D(config, None, None).set_backend('savedmodel', fname=str(tmp_path/'model.zip'), upsample_grid=upsample_grid)
+    # in-graph candidate selection is only supported by the Keras backend
+    with pytest.raises(ValueError):
+        model2d_random.predict_sparse(img2d, sparse_dist=True)
+
+
 if __name__ == '__main__':
     from conftest import _model2d
     # test_speed(_model2d())
@@ -5,7 +5,7 @@ from stardist.models import Config3D, StarDist3D
 from stardist.matching import matching
 from stardist.geometry import export_to_obj_file3D
 from csbdeep.utils import normalize
-from utils import circle_image, real_image3d, path_model3d, NumpySequence
+from utils import circle_image, real_image3d, path_model3d, copy_model, NumpySequence
 
 
 
@@ -95,8 +95,8 @@ def test_load_and_predict_with_overlap(model3d):
     return model, labels
 
 
-def test_predict_dense_sparse():
-    model_path = path_model3d()
+def test_predict_dense_sparse(tmp_path):
+    model_path = copy_model(path_model3d(), tmp_path)
     model = StarDist3D(None, name=model_path.name,
                        basedir=str(model_path.parent))
     img, mask = real_image3d()
@@ -108,12 +108,12 @@ def test_predict_dense_sparse():
     return labels2, labels2 
 
 
-def test_load_and_export_TF():
-    model_path = path_model3d()
+def test_load_and_export_TF(tmp_path):
+    model_path = copy_model(path_model3d(), tmp_path/'models')
     model = StarDist3D(None, name=model_path.name,
                        basedir=str(model_path.parent))
-    model.export_TF(single_output=True, upsample_grid=False)
-    model.export_TF(single_output=True, upsample_grid=True)
+    model.export_TF(str(tmp_path/'TF_SavedModel.zip'), single_output=True, upsample_grid=False)
+    model.export_TF(str(tmp_path/'TF_SavedModel.zip'), single_output=True, upsample_grid=True)
 
 
 def test_optimize_thresholds(model3d):
@@ -309,13 +309,13 @@ def test_model_multiclass(tmpdir, n_classes, classes, n_channel, epochs):
 
 
 # this test has to be at the end of the model
-def test_load_and_export_TF(model3d):
+def test_load_and_export_TF(tmp_path, model3d):
     model = model3d
     assert any(g>1 for g in model.config.grid)
     # model.export_TF(single_output=False, upsample_grid=False)
     # model.export_TF(single_output=False, upsample_grid=True)
-    model.export_TF(single_output=True, upsample_grid=False)
-    model.export_TF(single_output=True, upsample_grid=True)
+    model.export_TF(str(tmp_path/'TF_SavedModel.zip'), single_output=True, upsample_grid=False)
+    model.export_TF(str(tmp_path/'TF_SavedModel.zip'), single_output=True, upsample_grid=True)
 
 
     
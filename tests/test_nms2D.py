@@ -75,6 +75,37 @@ def test_acc(img, grid):
     print("accuracy {acc:.2f}".format(acc=acc))
     assert acc > 0.9
 
+@pytest.mark.parametrize('prob_dtype, dist_dtype', ((np.float16, np.float16), (np.uint8, np.float16), (np.uint8, np.float32), (np.uint8, np.uint16)))
+@pytest.mark.parametrize('grid', ((1,1),(2,2)))
+def test_acc_reduced_precision(grid, prob_dtype, dist_dtype):
+    # prob/dist stored with reduced precision (cf. StarDistBase.predict) vs. float32
+    from stardist.nms import _to_storage_dtype, _PROB_UINT8_SCALE
+    img = real_image2d()[1]
+    rng = np.random.RandomState(42)
+    prob = edt_prob(img)[::grid[0],::grid[1]]
+    dist = star_dist(img, n_rays=32, mode="cpp")[::grid[0],::grid[1]]
+    prob = np.clip(prob + 0.05*rng.normal(size=prob.shape), 0, 1).astype(np.float32)
+    dist = np.maximum(1e-3, dist*(1+0.05*rng.normal(size=dist.shape))).astype(np.float32)
+
+    points, probi, disti = non_maximum_suppression(dist, prob, grid=grid, prob_thresh=0.4)
+    img1 = polygons_to_label(disti, points, prob=probi, shape=img.shape)
+    # uint16 distances as fixed-point numbers with resolution 1/64 pixel
+    dist_scale = 64 if dist_dtype == np.uint16 else None
+    points, probi, disti = non_maximum_suppression(_to_storage_dtype(dist, dist_dtype, dist_scale), _to_storage_dtype(prob, prob_dtype, _PROB_UINT8_SCALE),
+                                                   grid=grid, prob_thresh=0.4, dist_scale=dist_scale)
+    assert probi.dtype == disti.dtype == np.float32
+    img2 = polygons_to_label(disti, points, prob=probi, shape=img.shape)
+    m = matching(img1, img2)
+    print("accuracy {acc:.4f}, mean true score {mts:.4f}".format(acc=m.accuracy, mts=m.mean_true_score))
+    # same objects, but slightly different polygons (mean IoU > 0.97) since rounding changes the order of similar probabilities
+    assert m.accuracy == 1 and m.mean_true_score > 0.97
+    assert matching(img, img2).accuracy == pytest.approx(matching(img, img1).accuracy, abs=0.01)
+    if dist_scale is not None:
+        # integer distances are never interpreted without explicit scale
+        with pytest.raises(ValueError):
+            non_maximum_suppression(_to_storage_dtype(dist, dist_dtype, dist_scale), prob, grid=grid, prob_thresh=0.4)
+
+
 @pytest.mark.parametrize('grid', ((1,1),(16,16)))
 @pytest.mark.parametrize('n_rays', (11,32))
 @pytest.mark.parametrize('shape', ((356, 299),(114, 217)))
@@ -192,4 +223,3 @@ def bench():
 
 if __name__ == '__main__':
     points1, img1, points2, img2 = test_old_new((62,82),32,(2,2), nms_thresh = .1)
-
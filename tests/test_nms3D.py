@@ -57,6 +57,34 @@ def test_nms_kdtree(nms_thresh=0.1, shape=(33, 44, 55), noise=.1, n_rays=32):
     return (points1, probi1, disti1),(points2, probi2, disti2)
 
 
+@pytest.mark.parametrize('prob_dtype, dist_dtype', ((np.float16, np.float16), (np.uint8, np.uint16)))
+def test_nms_reduced_precision(prob_dtype, dist_dtype, n_rays=32):
+    # prob/dist stored with reduced precision (cf. StarDistBase.predict) vs. float32
+    from stardist import star_dist3D, edt_prob
+    from stardist.nms import _to_storage_dtype, _PROB_UINT8_SCALE
+    from stardist.matching import matching
+    from utils import real_image3d
+    img = real_image3d()[1]
+    rays = Rays_GoldenSpiral(n_rays)
+    rng = np.random.RandomState(42)
+    prob = np.clip(edt_prob(img) + 0.05*rng.normal(size=img.shape), 0, 1).astype(np.float32)
+    dist = np.maximum(1e-3, star_dist3D(img, rays)*(1+0.05*rng.normal(size=img.shape+(n_rays,)))).astype(np.float32)
+
+    points1, probi1, disti1 = non_maximum_suppression_3d(dist, prob, rays, prob_thresh=0.7, nms_thresh=0.4)
+    # uint16 distances as fixed-point numbers with resolution 1/64 pixel
+    dist_scale = 64 if dist_dtype == np.uint16 else None
+    points2, probi2, disti2 = non_maximum_suppression_3d(_to_storage_dtype(dist, dist_dtype, dist_scale), _to_storage_dtype(prob, prob_dtype, _PROB_UINT8_SCALE), rays,
+                                                         prob_thresh=0.7, nms_thresh=0.4, dist_scale=dist_scale)
+    assert probi2.dtype == disti2.dtype == np.float32
+    lbl1 = polyhedron_to_label(disti1, points1, rays, prob=probi1, shape=img.shape, verbose=False)
+    lbl2 = polyhedron_to_label(disti2, points2, rays, prob=probi2, shape=img.shape, verbose=False)
+    m = matching(lbl1, lbl2)
+    print("accuracy {acc:.4f}, mean true score {mts:.4f}".format(acc=m.accuracy, mts=m.mean_true_score))
+    # same objects, but slightly different polyhedra since rounding changes the order of similar probabilities
+    assert m.accuracy > 0.95 and m.mean_true_score > 0.9
+    assert matching(img, lbl2).accuracy == pytest.approx(matching(img, lbl1).accuracy, abs=0.02)
+
+
 @pytest.mark.parametrize('noise',(0,.2,.6,.9))
 @pytest.mark.parametrize('n_rays',(32,65,100))
 def test_nms_accuracy(noise, n_rays):
@@ -0,0 +1,56 @@
+import json
+import numpy as np
+import pytest
+from stardist.profiling import profile, stage, Profiler
+
+
+def test_profile_predict_instances(tmp_path, model2d_random, img2d):
+
+    completed = []
+    with profile(trace_memory=True, callback=lambda name, *args: completed.append(name)) as prof:
+        labels, polys = model2d_random.predict_instances(img2d, n_tiles=(2,2), show_tile_progress=False)
+        polys['coord'] # computed on demand
+        with pytest.raises(RuntimeError):
+            with profile():
+                pass
+    summary = prof.summary()
+    for name in ('normalize', 'pad', 'network', 'assemble', 'crop', 'nms', 'render', 'coords'):
+        assert name in summary and summary[name]['total'] >= 0 and 'peak_bytes' in summary[name]
+    assert summary['network']['tiles'] == 4
+    assert summary['nms']['objects'] == summary['render']['objects'] == len(polys['prob'])
+    assert summary['crop']['peak_bytes'] > 0
+    assert completed == [s.name for s in prof.stages]
+
+    with profile(profiler=prof):
+        model2d_random.predict_instances(img2d, sparse=True, show_tile_progress=False)
+    assert prof.summary()['threshold']['candidates'] > 0
+    assert 'threshold' in prof.report()
+
+    trace = prof.to_chrome_trace(tmp_path/'trace.json')
+    with open(str(tmp_path/'trace.json')) as f:
+        assert json.load(f) == trace
+    assert len(trace['traceEvents']) == len(prof.stages)
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in trace['traceEvents'])
+
+    # disabled: nothing is recorded
+    n_stages = len(prof.stages)
+    model2d_random.predict_instances(img2d, show_tile_progress=False)
+    with stage('test', items=3) as s:
+        s.add(items=1)
+    assert len(prof.stages) == n_stages
+
+
+def test_nested_stages():
+    with profile(trace_memory=True) as prof:
+        with stage('outer') as s:
+            x = np.ones(10**6)
+            with stage('inner'):
+                y = np.ones(2*10**6)
+            del x, y
+            s.add(items=2)
+            s.add(items=3)
+    summary = prof.summary()
+    assert summary['outer']['items'] == 5
+    assert summary['inner']['peak_bytes'] >= 16e6
+    assert summary['outer']['peak_bytes'] >= 24e6
+    assert summary['outer']['total'] >= summary['inner']['total']
@@ -0,0 +1,71 @@
+import threading
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from csbdeep.utils import normalize
+from stardist.cli import load_model
+from stardist.serve import ModelServer, make_server, predict_remote, server_stats, encode_result, decode_result
+from utils import real_image2d, path_model2d, copy_model
+
+
+@pytest.mark.parametrize('use_socket, processes', [(False, True), (True, False)])
+def test_serve(tmp_path, use_socket, processes):
+    model = load_model(str(copy_model(path_model2d(), tmp_path)))
+    img = real_image2d()[0]
+    imgs = [img[:128,:128], img[128:,:128], img[:128,128:], img[128:,128:], img[:160,:96]]
+
+    # model name that needs to be escaped in the query string
+    name = 'demo &model=1'
+    server_model = ModelServer({name: model}, max_batch_size=4, max_delay=0.5, workers=2, processes=processes)
+    if use_socket:
+        server = make_server(server_model, unix_socket=tmp_path/'stardist.sock')
+        address = dict(unix_socket=tmp_path/'stardist.sock')
+    else:
+        server = make_server(server_model, port=0)
+        address = dict(port=server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with ThreadPoolExecutor(len(imgs)) as pool:
+            results = list(pool.map(lambda x: predict_remote(x, **address), imgs))
+        labels_tiled, _ = predict_remote(img, model=name, n_tiles=(2,2), prob_thresh=0.6, **address)
+        with pytest.raises(RuntimeError):
+            predict_remote(img, model='unknown', **address)
+        stats = server_stats(**address)
+    finally:
+        server.shutdown()
+        server.server_close()
+        server_model.close()
+
+    for x, (labels, polys) in zip(imgs, results):
+        labels_ref, polys_ref = model.predict_instances(normalize(x,1,99.8), show_tile_progress=False)
+        assert labels.dtype == labels_ref.dtype and np.all(labels == labels_ref)
+        assert np.allclose(polys['coord'], polys_ref['coord']) and np.allclose(polys['prob'], polys_ref['prob'])
+        assert list(polys) == list(polys_ref)
+    labels_ref, _ = model.predict_instances(normalize(img,1,99.8), n_tiles=(2,2), prob_thresh=0.6, show_tile_progress=False)
+    assert np.all(labels_tiled == labels_ref)
+
+    assert stats['requests'] == len(imgs) + 2 and stats['errors'] == 1
+    # 4 same-shape requests predicted together (other shape separately)
+    assert stats['batch_size_max'] > 1 and stats['batches'] < len(imgs)
+    assert all(k in stats['latency_ms'] for k in ('p50','p90','p99'))
+
+
+
+@pytest.mark.parametrize('n_dim', [2, 3])
+def test_encode_result(n_dim):
+    from stardist import StarDistInstances, Rays_GoldenSpiral
+    rng = np.random.RandomState(42)
+    n_rays = 16 if n_dim == 2 else 32
+    polys = StarDistInstances(rng.randint(10, 100, (20,n_dim)), rng.uniform(0.5, 1, 20), rng.uniform(2, 8, (20,n_rays)),
+                              class_prob=rng.dirichlet(np.ones(3), 20), rays=None if n_dim == 2 else Rays_GoldenSpiral(n_rays),
+                              dist_dtype=np.float16)
+    labels = rng.randint(0, 20, (64,)*n_dim).astype(np.int32)
+
+    # only stored columns are sent (e.g. no coordinates computed)
+    data = encode_result(labels, polys)
+    assert 'coord' not in polys._cache
+    labels2, polys2 = decode_result(data)
+    assert np.array_equal(labels, labels2) and isinstance(polys2, StarDistInstances) and list(polys2) == list(polys)
+    assert all(np.array_equal(v, polys2.columns[k]) and v.dtype == polys2.columns[k].dtype for k,v in polys.columns.items())
+    assert np.allclose(polys2.coord, polys.coord) and np.allclose(polys2.area, polys.area)
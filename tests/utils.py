@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 import numpy as np
 from tifffile import imread
 from skimage.measure import label
@@ -81,3 +83,10 @@ def path_model2d():
 
 def path_model3d():
     return Path(_root_dir()) / '..' / 'models' / 'examples' / '3D_demo'
+
+
+def copy_model(model_path, basedir=None):
+    """Copy of model folder in basedir (new temporary directory if None), since using a model can write files into its folder."""
+    if basedir is None:
+        basedir = tempfile.mkdtemp()
+    return Path(shutil.copytree(str(model_path), str(Path(basedir) / model_path.name)))